@@ -0,0 +1,481 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import structlog
+
+from django.db import connections
+
+try:
+    from queue import Empty, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Queue
+
+from . import builder, checkpoint, instrumentation, throttle
+
+log = structlog.get_logger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def get_pk_bounds(connection, model):
+    """
+    Return a tuple with the smallest and largest primary key in the table
+    underlying *model*. Both values are ``None`` if the table is empty.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN({pk}), MAX({pk}) FROM {table};'.format(
+            pk=model._meta.pk.column,
+            table=model._meta.db_table))
+        return cursor.fetchone()
+
+
+def get_rows_per_second(rows, elapsed):
+    if not elapsed:
+        return None
+    return round(rows / elapsed, 1)
+
+
+class BackfillProgress(object):
+    """
+    Keep track of the rows copied by one or more workers and emit a
+    ``backfill_progress`` event with the throughput and the estimated time
+    left for every copied range.
+    """
+
+    def __init__(self, old_model, new_model, estimated_total=None):
+        self.old_table = old_model._meta.db_table
+        self.new_table = new_model._meta.db_table
+        self.estimated_total = estimated_total
+        self.rows_copied = 0
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, rows, duration, **data):
+        with self.lock:
+            self.rows_copied += rows
+            rows_copied = self.rows_copied
+
+        elapsed = time.time() - self.started_at
+
+        instrumentation.emit(
+            'backfill_progress',
+            old_table=self.old_table,
+            new_table=self.new_table,
+            rows_copied=rows_copied,
+            estimated_total=self.estimated_total,
+            rows_per_second=get_rows_per_second(rows_copied, elapsed),
+            eta=instrumentation.get_eta(rows_copied, self.estimated_total,
+                                        elapsed),
+            elapsed=round(elapsed, 3),
+            batch_rows=rows,
+            batch_duration=round(duration, 6),
+            **data)
+
+    def finish(self, **data):
+        elapsed = time.time() - self.started_at
+
+        instrumentation.emit(
+            'backfill_finished',
+            old_table=self.old_table,
+            new_table=self.new_table,
+            rows_copied=self.rows_copied,
+            elapsed=round(elapsed, 3),
+            rows_per_second=get_rows_per_second(self.rows_copied, elapsed),
+            **data)
+
+
+def iter_pk_ranges(lower, upper, batch_size):
+    """
+    Yield half-open ``(start, end)`` ranges of *batch_size* primary keys that
+    cover all values from *lower* to *upper* (inclusive).
+    """
+    if batch_size < 1:
+        raise ValueError('batch size has to be a positive integer')
+
+    start = lower
+    while start <= upper:
+        yield start, start + batch_size
+        start += batch_size
+
+
+def copy_range(connection, statement, start, end, progress=None,
+               backfill_checkpoint=None, **data):
+    """
+    Copy the rows with a primary key in ``[start, end)`` using the range copy
+    *statement* in a transaction of its own. Returns the number of rows that
+    have been written to the new table. The copied rows are reported to
+    *progress* together with any additional event *data*. A
+    *backfill_checkpoint* is updated in the same transaction. The
+    transaction is rolled back if copying the range fails.
+    """
+    started_at = time.time()
+
+    with connection.cursor() as cursor:
+        cursor.execute('BEGIN;')
+        try:
+            cursor.execute(statement, [start, end])
+            row_count = cursor.rowcount
+            if backfill_checkpoint is not None:
+                backfill_checkpoint.record(cursor, start, end, row_count)
+        except Exception:
+            # Neither the range nor its checkpoint update are kept and the
+            # connection is left usable instead of in an aborted transaction.
+            cursor.execute('ROLLBACK;')
+            raise
+        cursor.execute('COMMIT;')
+
+    if backfill_checkpoint is not None:
+        backfill_checkpoint.commit(start, end)
+
+    if progress is not None:
+        progress.add(row_count, time.time() - started_at,
+                     range_start=start, range_end=end, **data)
+
+    return row_count
+
+
+def get_copy_bounds(connection, old_model, new_model,
+                    backfill_checkpoint=None):
+    """
+    Return the smallest and largest primary key that still has to be copied,
+    continuing after the *backfill_checkpoint* if given. Both values are
+    ``None`` if there is nothing to copy.
+    """
+    lower, upper = get_pk_bounds(connection, old_model)
+
+    if lower is not None and backfill_checkpoint is not None:
+        lower = backfill_checkpoint.resume(connection, lower)
+
+    if lower is None or lower > upper:
+        log.info('no rows to copy',
+                 old_table=old_model._meta.db_table,
+                 new_table=new_model._meta.db_table)
+        return None, None
+
+    return lower, upper
+
+
+def iter_throttled_pk_ranges(lower, upper, backfill_throttle):
+    """
+    Same as `iter_pk_ranges` but each range has the current batch size of
+    *backfill_throttle*, which is adjusted while the ranges are copied.
+    """
+    start = lower
+    while start <= upper:
+        end = start + backfill_throttle.batch_size
+        yield start, end
+        start = end
+
+
+def get_next_pk(connection, model, start, offset):
+    """
+    Return the primary key *offset* rows after *start* in the table of
+    *model*, or ``None`` if there are fewer rows left. Only the primary key
+    index is read and nothing but the single key is sent to the client.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT {pk} FROM {table} WHERE {pk} >= %s ORDER BY {pk} '
+            'OFFSET %s LIMIT 1;'.format(pk=model._meta.pk.column,
+                                        table=model._meta.db_table),
+            [start, offset])
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+def iter_keyset_pk_ranges(connection, model, lower, upper, batch_size,
+                          backfill_throttle=None):
+    """
+    Same as `iter_pk_ranges` but each range ends at the primary key that
+    follows the next *batch_size* rows, so every range contains the same
+    number of rows regardless of gaps between the primary keys. The end of
+    each range is looked up right before it is copied, using the current
+    batch size of *backfill_throttle* if given.
+    """
+    start = lower
+    while start <= upper:
+        if backfill_throttle is not None:
+            batch_size = backfill_throttle.batch_size
+
+        end = get_next_pk(connection, model, start, batch_size)
+        if end is None or end > upper:
+            end = upper + 1
+
+        yield start, end
+        start = end
+
+
+def copy_model_data_in_batches(connection, old_model, new_model,
+                               batch_size=DEFAULT_BATCH_SIZE,
+                               keep_existing=False, backfill_checkpoint=None,
+                               backfill_throttle=None, mapping=None,
+                               keyset=False):
+    """
+    Copy all rows from the table of *old_model* to the table of *new_model*
+    walking the primary key in ranges of *batch_size*. Each range is copied
+    and committed separately, keeping locks and transactions short. The
+    triggers have to be in place before calling this, otherwise changes to
+    already copied rows are lost. Rows that already exist in the new table
+    are not overwritten if *keep_existing* is set. With a
+    *backfill_checkpoint*, the copy continues where a previous run stopped
+    and records its progress. A *backfill_throttle* adapts the size of the
+    ranges and pauses between them depending on the database load. The
+    *mapping* of columns and partition key of a differently shaped new table
+    is passed on to `builder.copy_model_data_range`. With *keyset* set, the
+    ranges are bounded by the number of rows instead of the number of
+    primary keys (see `iter_keyset_pk_ranges`). Returns the number of rows
+    copied.
+    """
+    lower, upper = get_copy_bounds(connection, old_model, new_model,
+                                   backfill_checkpoint)
+
+    if lower is None:
+        return 0
+
+    statement = builder.copy_model_data_range(old_model, new_model,
+                                              keep_existing=keep_existing,
+                                              **(mapping or {}))
+    progress = BackfillProgress(
+        old_model, new_model,
+        instrumentation.get_estimated_row_count(connection, old_model))
+
+    if keyset:
+        ranges = iter_keyset_pk_ranges(connection, old_model, lower, upper,
+                                       batch_size, backfill_throttle)
+    elif backfill_throttle is not None:
+        ranges = iter_throttled_pk_ranges(lower, upper, backfill_throttle)
+    else:
+        ranges = iter_pk_ranges(lower, upper, batch_size)
+
+    for start, end in ranges:
+        started_at = time.time()
+        copy_range(connection, statement, start, end, progress,
+                   backfill_checkpoint, max_pk=upper)
+
+        if backfill_throttle is not None:
+            backfill_throttle.wait(connection, time.time() - started_at)
+
+    if backfill_checkpoint is not None:
+        backfill_checkpoint.finish(connection)
+
+    progress.finish()
+    return progress.rows_copied
+
+
+def copy_ranges_from_queue(alias, statement, ranges, worker,
+                           progress=None, backfill_checkpoint=None,
+                           backfill_throttle=None):
+    """
+    Copy the primary key ranges taken from the *ranges* queue until it is
+    empty, using a connection to the database *alias* that is exclusive to
+    the current thread. Returns the number of rows copied by this worker.
+    """
+    connection = connections[alias]
+
+    rows_copied = 0
+    started_at = time.time()
+
+    try:
+        while True:
+            try:
+                start, end = ranges.get_nowait()
+            except Empty:
+                break
+
+            range_started_at = time.time()
+            rows_copied += copy_range(connection, statement, start, end,
+                                      progress, backfill_checkpoint,
+                                      worker=worker)
+
+            if backfill_throttle is not None:
+                backfill_throttle.wait(connection,
+                                       time.time() - range_started_at)
+    finally:
+        connection.close()
+
+    elapsed = time.time() - started_at
+    instrumentation.emit(
+        'backfill_worker_finished',
+        worker=worker,
+        thread=threading.current_thread().name,
+        rows_copied=rows_copied,
+        elapsed=round(elapsed, 3),
+        rows_per_second=get_rows_per_second(rows_copied, elapsed))
+
+    return rows_copied
+
+
+def copy_model_data_in_parallel(connection, old_model, new_model, workers,
+                                batch_size=DEFAULT_BATCH_SIZE,
+                                keep_existing=False, backfill_checkpoint=None,
+                                backfill_throttle=None, mapping=None):
+    """
+    Same as `copy_model_data_in_batches` but the primary key ranges are
+    copied concurrently by *workers* threads, each with a database connection
+    of its own. The ranges are handed out from a shared queue so that
+    workers that finish early pick up more work, even if the primary keys
+    aren't evenly distributed. As the ranges are created upfront, a
+    *backfill_throttle* only pauses the workers under load but doesn't change
+    the size of the ranges. Returns the number of rows copied.
+    """
+    lower, upper = get_copy_bounds(connection, old_model, new_model,
+                                   backfill_checkpoint)
+
+    if lower is None:
+        return 0
+
+    statement = builder.copy_model_data_range(old_model, new_model,
+                                              keep_existing=keep_existing,
+                                              **(mapping or {}))
+
+    progress = BackfillProgress(
+        old_model, new_model,
+        instrumentation.get_estimated_row_count(connection, old_model))
+
+    ranges = Queue()
+    for pk_range in iter_pk_ranges(lower, upper, batch_size):
+        ranges.put(pk_range)
+
+    log.info('starting parallel backfill',
+             old_table=old_model._meta.db_table,
+             new_table=new_model._meta.db_table,
+             workers=workers,
+             ranges=ranges.qsize())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_ranges_from_queue, connection.alias,
+                                   statement, ranges, worker, progress,
+                                   backfill_checkpoint, backfill_throttle)
+                   for worker in range(workers)]
+        rows_copied = sum(future.result() for future in futures)
+
+    if backfill_checkpoint is not None:
+        backfill_checkpoint.finish(connection)
+
+    progress.finish(workers=workers)
+
+    return rows_copied
+
+
+def copy_model_data(connection, old_model, new_model,
+                    batch_size=DEFAULT_BATCH_SIZE, keep_existing=False,
+                    workers=None, resumable=False, throttle_options=None,
+                    mapping=None, keyset=False):
+    """
+    Copy the data of *old_model* into *new_model* in batches, spread across
+    several threads if more than one of *workers* is requested. With
+    *resumable* set, the progress is stored in a checkpoint and an
+    interrupted copy continues where it stopped. *throttle_options* enable
+    load-aware throttling (see `throttle.get_throttle`). *keyset* bounds the
+    batches of a copy without workers by rows instead of primary keys.
+    """
+    backfill_checkpoint = None
+    if resumable:
+        backfill_checkpoint = checkpoint.BackfillCheckpoint(old_model,
+                                                            new_model)
+
+    backfill_throttle = throttle.get_throttle(old_model, new_model,
+                                              batch_size, throttle_options)
+
+    if workers and workers > 1:
+        return copy_model_data_in_parallel(
+            connection, old_model, new_model, workers, batch_size,
+            keep_existing=keep_existing,
+            backfill_checkpoint=backfill_checkpoint,
+            backfill_throttle=backfill_throttle, mapping=mapping)
+
+    return copy_model_data_in_batches(connection, old_model, new_model,
+                                      batch_size, keep_existing=keep_existing,
+                                      backfill_checkpoint=backfill_checkpoint,
+                                      backfill_throttle=backfill_throttle,
+                                      mapping=mapping, keyset=keyset)
+
+
+def get_backfill_levels(model_pairs):
+    """
+    Group the ``(old_model, new_model)`` pairs into a list of levels, such
+    that the new table of each pair only references new tables of pairs in
+    earlier levels through foreign keys. All pairs of a level can therefore
+    be copied at the same time. Pairs with circular references end up in the
+    last level together.
+    """
+    new_tables = set(new_model._meta.db_table for _, new_model in model_pairs)
+
+    dependencies = {}
+    for old_model, new_model in model_pairs:
+        table = new_model._meta.db_table
+        dependencies[table] = set()
+
+        for field in new_model._meta.fields:
+            related_model = getattr(field, 'related_model', None)
+            if not isinstance(related_model, type):
+                continue
+
+            related_table = related_model._meta.db_table
+            if related_table in new_tables and related_table != table:
+                dependencies[table].add(related_table)
+
+    levels = []
+    copied_tables = set()
+    remaining = list(model_pairs)
+
+    while remaining:
+        level = [pair for pair in remaining
+                 if dependencies[pair[1]._meta.db_table] <= copied_tables]
+
+        if not level:
+            log.warning('circular foreign keys between new tables',
+                        tables=[new._meta.db_table for _, new in remaining])
+            level = remaining
+
+        levels.append(level)
+        copied_tables.update(new._meta.db_table for _, new in level)
+        remaining = [pair for pair in remaining if pair not in level]
+
+    return levels
+
+
+def copy_model_pair_in_thread(alias, old_model, new_model, batch_size,
+                              keep_existing, workers, resumable,
+                              throttle_options, mapping):
+    connection = connections[alias]
+
+    try:
+        return copy_model_data(connection, old_model, new_model, batch_size,
+                               keep_existing, workers, resumable,
+                               throttle_options, mapping)
+    finally:
+        connection.close()
+
+
+def copy_model_pairs(connection, model_pairs, batch_size=DEFAULT_BATCH_SIZE,
+                     keep_existing=False, workers=None, resumable=False,
+                     throttle_options=None, mapping=None):
+    """
+    Copy the data for all ``(old_model, new_model)`` *model_pairs*. Pairs
+    without foreign keys between their new tables are copied concurrently,
+    each with a connection of its own, so the total time is close to the one
+    of the largest table. Returns the number of rows copied.
+    """
+    rows_copied = 0
+
+    for level in get_backfill_levels(model_pairs):
+        if len(level) == 1:
+            old_model, new_model = level[0]
+            rows_copied += copy_model_data(connection, old_model, new_model,
+                                           batch_size, keep_existing, workers,
+                                           resumable, throttle_options,
+                                           mapping)
+            continue
+
+        with ThreadPoolExecutor(max_workers=len(level)) as executor:
+            futures = [executor.submit(copy_model_pair_in_thread,
+                                       connection.alias, old_model, new_model,
+                                       batch_size, keep_existing, workers,
+                                       resumable, throttle_options, mapping)
+                       for old_model, new_model in level]
+            rows_copied += sum(future.result() for future in futures)
+
+    return rows_copied
@@ -1,11 +1,45 @@
+import threading
+from collections import OrderedDict, namedtuple
+
 import structlog
 
 from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 
 log = structlog.get_logger(__name__)
 
-
-def get_context_from_model(model, prefix, ignore_unique=False):
+# All the information about a model's table required to generate the SQL
+# statements. Unlike the model class itself, it is hashable and equal for
+# every rendering of the same model, e.g. in different migration states.
+ModelSignature = namedtuple('ModelSignature', ['db_table',
+                                               'column_names',
+                                               'unique_column_names',
+                                               'pk_name'])
+
+# A column of the new table and the SQL expressions computing its value
+# from a row of the old table: the bare column names, the ``NEW`` and ``OLD``
+# row of a row-level trigger and the transition tables of a statement-level
+# trigger.
+Column = namedtuple('Column', ['name', 'unique', 'value', 'new_value',
+                               'old_value', 'updated_value', 'deleted_value'])
+
+ROW_PREFIXES = (('value', ''),
+                ('new_value', 'NEW.'),
+                ('old_value', 'OLD.'),
+                ('updated_value', 'updated_rows.'),
+                ('deleted_value', 'deleted_rows.'))
+
+# Number of rendered statements kept by `render_signature_statement`.
+STATEMENT_CACHE_SIZE = 512
+
+# The rendered statements by the arguments of `render_signature_statement`,
+# the least recently used first. Backfills render statements from several
+# threads, hence the lock.
+statement_cache = OrderedDict()
+statement_cache_lock = threading.Lock()
+
+
+def get_model_signature(model):
     column_names = []
     unique_column_names = []
 
@@ -17,64 +51,292 @@ def get_context_from_model(model, prefix, ignore_unique=False):
 
         column_names.append(name)
 
-    return {
-        '{}_db_table_name'.format(prefix): model._meta.db_table,
-        '{}_column_names'.format(prefix): column_names,
-        '{}_unique_column_names'.format(prefix): unique_column_names,
-        'pk_name': model._meta.pk.attname
+    return ModelSignature(db_table=model._meta.db_table,
+                          column_names=tuple(column_names),
+                          unique_column_names=tuple(unique_column_names),
+                          pk_name=model._meta.pk.attname)
+
+
+def get_context_from_signature(signature, prefix, ignore_unique=False):
+    context = {
+        '{}_db_table_name'.format(prefix): signature.db_table,
+        '{}_column_names'.format(prefix): list(signature.column_names),
+        '{}_unique_column_names'.format(prefix): list(
+            signature.unique_column_names),
+        'pk_name': signature.pk_name
     }
 
+    if ignore_unique:
+        context['{}_updatable_column_names'.format(prefix)] = [
+            name for name in signature.column_names
+            if name not in signature.unique_column_names]
 
-def drop_trigger(event, old_model, new_model):
-    event = event.lower()
+    return context
 
-    template = get_template('removalist/drop_{}_trigger.sql'.format(event))
 
-    context = get_context_from_model(new_model, 'new')
-    context.update(get_context_from_model(old_model, 'old'))
+def get_context_from_model(model, prefix, ignore_unique=False):
+    """
+    Build the template context describing the table of *model* with all keys
+    prefixed with *prefix*. If *ignore_unique* is set, the context also
+    contains the ``<prefix>_updatable_column_names``, the columns without a
+    unique constraint that can be written to when updating a row.
+    """
+    return get_context_from_signature(get_model_signature(model), prefix,
+                                      ignore_unique)
+
+
+def get_columns(old_signature, new_signature, column_map=None):
+    """
+    Return the `Column` of each column of the new table that is written
+    when syncing from the old table. *column_map* maps names of new columns
+    to SQL expressions that can refer to the columns of the old table as
+    ``{column_name}``, e.g. ``{'full_name': "{first} || ' ' || {last}"}``
+    or a constant default like ``{'region': "'eu'"}``. Literal braces
+    have to be doubled, as in `str.format`. Other columns of
+    the new table are copied from the old column of the same name, or left
+    to their database default if the old table doesn't have one. Columns
+    only present in the old table are dropped.
+    """
+    column_map = dict(column_map or {})
+
+    unknown_columns = set(column_map) - set(new_signature.column_names)
+    if unknown_columns:
+        raise ValueError('{} has no column {}'.format(
+            new_signature.db_table, ', '.join(sorted(unknown_columns))))
+
+    columns = []
+
+    for name in new_signature.column_names:
+        if name in column_map:
+            expression = column_map[name]
+        elif name in old_signature.column_names:
+            expression = '{' + name + '}'
+        else:
+            continue
+
+        values = {}
+        for field, prefix in ROW_PREFIXES:
+            try:
+                values[field] = mark_safe(expression.format(**{
+                    column_name: prefix + column_name
+                    for column_name in old_signature.column_names}))
+            except KeyError as exc:
+                raise ValueError('{} has no column {} used for {}'.format(
+                    old_signature.db_table, exc, name))
+
+        columns.append(Column(
+            name=name, unique=name in new_signature.unique_column_names,
+            **values))
+
+    return columns
+
+
+def get_mapping_context(old_signature, new_signature, column_map=None,
+                        partition_columns=None):
+    """
+    Build the template context for writing rows of the old table to the new
+    table according to *column_map* (see `get_columns`).
+
+    *partition_columns* are the columns of the partition key of a
+    partitioned new table. They are added to the conflict target of upserts,
+    which has to match a unique index of a partitioned table, and to the
+    lookup of updated and deleted rows, so that only the partition the row
+    lives in is scanned. The partition key of a row is expected not to
+    change while the tables are in sync.
+    """
+    columns = get_columns(old_signature, new_signature, column_map)
+    columns_by_name = {column.name: column for column in columns}
+
+    partition_columns = list(partition_columns or [])
+    for name in partition_columns:
+        if name not in columns_by_name:
+            raise ValueError('Partition column {} is not written to {}'.format(
+                name, new_signature.db_table))
 
-    statement = template.render(context)
-    log.debug('drop {} trigger statement'.format(event),
-              sql_statement=statement)
+    return {
+        'columns': columns,
+        'updatable_columns': [column for column in columns
+                              if not column.unique],
+        'partition_columns': [columns_by_name[name]
+                              for name in partition_columns
+                              if name != new_signature.pk_name],
+        'conflict_target': ', '.join(
+            [new_signature.pk_name] +
+            [name for name in partition_columns
+             if name != new_signature.pk_name]),
+        'column_map': column_map,
+    }
+
+
+def parse_column_map(definitions):
+    """
+    Parse a list of ``column=expression`` *definitions*, e.g. from the
+    command line, into a column map (see `get_columns`).
+    """
+    column_map = {}
+
+    for definition in definitions or []:
+        name, separator, expression = definition.partition('=')
+        if not separator:
+            raise ValueError('Invalid column mapping {!r}, expected '
+                             'column=expression'.format(definition))
+        column_map[name.strip()] = expression.strip()
+
+    return column_map
+
+
+def get_mapping(column_map=None, partition_columns=None):
+    """
+    Return the keyword arguments passed to the statement builders for a new
+    table of a different shape, or ``None`` if it has the same columns as
+    the old table.
+    """
+    if not (column_map or partition_columns):
+        return None
+
+    return {'column_map': column_map, 'partition_columns': partition_columns}
+
+
+def clear_statement_cache():
+    with statement_cache_lock:
+        statement_cache.clear()
+
+
+def render_signature_statement(template_name, old_signature, new_signature,
+                               ignore_unique, check_columns, column_map,
+                               partition_columns, options):
+    """
+    Render the template *template_name* for the tables described by the
+    model signatures *old_signature* and *new_signature*. All arguments are
+    hashable, the *column_map* and the additional context *options* are
+    passed as tuples of items. The *STATEMENT_CACHE_SIZE* most recently used
+    statements are cached, so repeatedly generating the same statement, e.g.
+    while planning migrations, doesn't render the template again.
+    """
+    key = (template_name, old_signature, new_signature, ignore_unique,
+           check_columns, column_map, partition_columns, options)
+    with statement_cache_lock:
+        statement = statement_cache.pop(key, None)
+        if statement is not None:
+            statement_cache[key] = statement
+            return statement
+
+    if check_columns and not column_map:
+        assert (sorted(old_signature.column_names) ==
+                sorted(new_signature.column_names)), \
+            "{} <=> {}".format(old_signature.column_names,
+                               new_signature.column_names)
+
+    context = get_context_from_signature(new_signature, 'new', ignore_unique)
+    context.update(get_context_from_signature(old_signature, 'old',
+                                              ignore_unique))
+    context.update(get_mapping_context(old_signature, new_signature,
+                                       column_map, partition_columns))
+    context.update(dict(options))
+    statement = get_template(template_name).render(context)
+
+    with statement_cache_lock:
+        statement_cache[key] = statement
+        while len(statement_cache) > STATEMENT_CACHE_SIZE:
+            statement_cache.popitem(last=False)
 
     return statement
 
 
-def create_trigger(event, old_model, new_model):
+def render_statement(template_name, old_model, new_model, ignore_unique=False,
+                     check_columns=True, column_map=None,
+                     partition_columns=None, **options):
+    """
+    Render the template *template_name* for the tables of *old_model* and
+    *new_model* with the additional context *options*. The statements are
+    cached per model signatures and options (see
+    `render_signature_statement`). With *check_columns* set, both models
+    have to have the same columns unless a *column_map* describes how to
+    fill the new table (see `get_mapping_context`).
+    """
+    return render_signature_statement(
+        template_name, get_model_signature(old_model),
+        get_model_signature(new_model), ignore_unique, check_columns,
+        tuple(sorted((column_map or {}).items())),
+        tuple(partition_columns or ()), tuple(sorted(options.items())))
+
+
+def drop_trigger(event, old_model, new_model):
     event = event.lower()
 
-    old_column_names = [f.get_attname_column()[0]
-                        for f in old_model._meta.fields]
-    new_column_names = [f.get_attname_column()[0]
-                        for f in new_model._meta.fields]
+    statement = render_statement(
+        'removalist/drop_{}_trigger.sql'.format(event), old_model, new_model,
+        check_columns=False)
+    log.debug('drop {} trigger statement'.format(event),
+              sql_statement=statement)
 
-    assert sorted(old_column_names) == sorted(new_column_names), \
-        "{} <=> {}".format(old_column_names, new_column_names)
+    return statement
 
-    template = get_template('removalist/create_{}_trigger.sql'.format(event))
 
-    ignore_unique = bool(event == 'update')
+def create_trigger(event, old_model, new_model, upsert=False,
+                   statement_level=False, changed_columns_only=False,
+                   column_map=None, partition_columns=None):
+    """
+    Render the statement creating the trigger for *event*. With *upsert*
+    set, the insert and update triggers write rows with an
+    ``INSERT ... ON CONFLICT DO UPDATE`` so that they don't depend on the row
+    already (or not yet) being present in the new table.
+
+    Setting *statement_level* creates a ``FOR EACH STATEMENT`` trigger that
+    applies all changed rows from the statement's transition table in a
+    single set-based statement (requires PostgreSQL 10 or later).
+
+    The update trigger skips rows that haven't changed. With
+    *changed_columns_only* set, it builds the ``SET`` list of its update
+    from the columns that actually changed and leaves all other columns
+    alone, which avoids re-writing large (TOASTed) values that didn't
+    change. The row-level trigger compares the old and new row, or the
+    stored row when upserting, and the statement-level trigger the changed
+    rows with the stored ones. The update is then run with ``EXECUTE``.
+
+    *column_map* and *partition_columns* describe how rows are written to a
+    new table of a different shape, see `get_mapping_context`.
+    """
+    event = event.lower()
 
-    context = get_context_from_model(new_model, 'new', ignore_unique)
-    context.update(get_context_from_model(old_model, 'old', ignore_unique))
+    if statement_level:
+        template_name = 'removalist/create_{}_statement_trigger.sql'
+    else:
+        template_name = 'removalist/create_{}_trigger.sql'
 
-    statement = template.render(context)
+    ignore_unique = bool(event == 'update')
+    template_event = event
+    if ignore_unique and changed_columns_only:
+        template_event = 'update_changed_columns'
+
+    statement = render_statement(template_name.format(template_event),
+                                 old_model, new_model, ignore_unique,
+                                 column_map=column_map,
+                                 partition_columns=partition_columns,
+                                 upsert=upsert)
     log.debug('create {} trigger statement'.format(event),
               sql_statement=statement)
 
     return statement
 
 
-def create_insert_trigger(old_model, new_model):
-    return create_trigger('insert', old_model, new_model)
+def create_insert_trigger(old_model, new_model, upsert=False,
+                          statement_level=False, **mapping):
+    return create_trigger('insert', old_model, new_model, upsert,
+                          statement_level, **mapping)
 
 
-def create_update_trigger(old_model, new_model):
-    return create_trigger('update', old_model, new_model)
+def create_update_trigger(old_model, new_model, upsert=False,
+                          statement_level=False, changed_columns_only=False,
+                          **mapping):
+    return create_trigger('update', old_model, new_model, upsert,
+                          statement_level, changed_columns_only, **mapping)
 
 
-def create_delete_trigger(old_model, new_model):
-    return create_trigger('delete', old_model, new_model)
+def create_delete_trigger(old_model, new_model, statement_level=False,
+                          **mapping):
+    return create_trigger('delete', old_model, new_model,
+                          statement_level=statement_level, **mapping)
 
 
 def drop_insert_trigger(old_model, new_model):
@@ -89,22 +351,100 @@ def drop_delete_trigger(old_model, new_model):
     return drop_trigger('delete', old_model, new_model)
 
 
-def copy_model_data(old_model, new_model):
-    old_column_names = [f.get_attname_column()[0]
-                        for f in old_model._meta.fields]
-    new_column_names = [f.get_attname_column()[0]
-                        for f in new_model._meta.fields]
+def copy_model_data(old_model, new_model, **mapping):
+    statement = render_statement('removalist/copy_table.sql',
+                                 old_model, new_model, **mapping)
+    log.debug('copy {} -> {} statement'.format(old_model, new_model),
+              sql_statement=statement)
 
-    assert sorted(old_column_names) == sorted(new_column_names), \
-        "{} <=> {}".format(old_column_names, new_column_names)
+    return statement
 
-    template = get_template('removalist/copy_table.sql')
 
-    context = get_context_from_model(new_model, 'new')
-    context.update(get_context_from_model(old_model, 'old'))
+def copy_model_data_range(old_model, new_model, keep_existing=False,
+                          **mapping):
+    """
+    Same as `copy_model_data` but restricted to a half-open range of primary
+    keys that has to be passed as two query parameters (lower and upper
+    bound). The selected rows in the old table are locked with ``FOR SHARE``
+    for the duration of the transaction to prevent concurrent updates or
+    deletes from slipping in between reading and writing a batch.
+
+    With *keep_existing* set, rows already present in the new table are left
+    untouched and the old rows are only locked ``FOR KEY SHARE``, which
+    blocks deletes but not updates. This requires upserting triggers (see
+    `create_trigger`) to be in place, which make the row in the new table
+    the most recent one.
+    """
+    statement = render_statement('removalist/copy_table.sql',
+                                 old_model, new_model,
+                                 pk_range=True,
+                                 keep_existing=keep_existing, **mapping)
+    log.debug('copy {} -> {} range statement'.format(old_model, new_model),
+              sql_statement=statement)
 
-    statement = template.render(context)
-    log.debug('copy {} -> {} statement'.format(old_model, new_model),
+    return statement
+
+
+def copy_model_data_for_pks(old_model, new_model, **mapping):
+    """
+    Same as `copy_model_data` but restricted to the rows with a primary key
+    in a list passed as a single query parameter. The selected rows in the
+    old table are locked with ``FOR SHARE``.
+    """
+    statement = render_statement('removalist/copy_table.sql',
+                                 old_model, new_model,
+                                 pk_list=True, **mapping)
+    log.debug('copy {} -> {} rows statement'.format(old_model, new_model),
               sql_statement=statement)
 
     return statement
+
+
+def delete_missing_rows(old_model, new_model):
+    """
+    Render the statement deleting the rows of the new table with a primary
+    key in a list passed as a single query parameter that no longer exist in
+    the old table.
+    """
+    statement = render_statement('removalist/delete_missing_rows.sql',
+                                 old_model, new_model, check_columns=False)
+    log.debug('delete missing rows statement', sql_statement=statement)
+
+    return statement
+
+
+def get_changelog_table_name(old_model, new_model):
+    return '{}_to_{}_changelog'.format(old_model._meta.db_table,
+                                       new_model._meta.db_table)
+
+
+def create_changelog_trigger(old_model, new_model, pk_type):
+    """
+    Render the statements creating a changelog table and a trigger on the
+    table of *old_model* that records the primary key and operation (``I``,
+    ``U`` or ``D``) of every changed row. *pk_type* is the database type of
+    the primary key column, e.g. ``integer``.
+    """
+    statement = render_statement(
+        'removalist/create_changelog_trigger.sql', old_model, new_model,
+        check_columns=False,
+        changelog_table_name=get_changelog_table_name(old_model, new_model),
+        pk_type=pk_type)
+    log.debug('create changelog trigger statement', sql_statement=statement)
+
+    return statement
+
+
+def drop_changelog_trigger(old_model, new_model, keep_table=False):
+    """
+    Render the statements dropping the changelog trigger and, unless
+    *keep_table* is set, the changelog table.
+    """
+    statement = render_statement(
+        'removalist/drop_changelog_trigger.sql', old_model, new_model,
+        check_columns=False,
+        changelog_table_name=get_changelog_table_name(old_model, new_model),
+        keep_table=keep_table)
+    log.debug('drop changelog trigger statement', sql_statement=statement)
+
+    return statement
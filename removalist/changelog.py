@@ -0,0 +1,230 @@
+"""
+Changelog based sync of a new table within the same database.
+
+The changelog trigger (see `builder.create_changelog_trigger`) records the
+primary key of every row changed in the old table. Applying the changelog
+re-copies the current state of those rows into the new table, or deletes
+them from it if they no longer exist, so the work is proportional to the
+number of changed rows rather than to the size of the table.
+
+In the asynchronous mode of `CreateTableDuplication`, the changelog replaces
+the sync triggers. Writes to the old table only append to the changelog and
+the ``removalist_sync`` management command applies the changes in the
+background.
+"""
+import time
+
+import structlog
+
+from . import builder, instrumentation
+
+log = structlog.get_logger(__name__)
+
+DEFAULT_CHANGELOG_BATCH_SIZE = 10000
+
+
+def changelog_exists(connection, old_model, new_model):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL;',
+                       [builder.get_changelog_table_name(old_model,
+                                                         new_model)])
+        return cursor.fetchone()[0]
+
+
+def create_changelog(schema_editor, old_model, new_model):
+    """
+    Create the changelog table and trigger for *old_model*. This doesn't
+    start or commit a transaction.
+    """
+    pk_type = old_model._meta.pk.rel_db_type(schema_editor.connection)
+
+    instrumentation.execute_timed(
+        schema_editor,
+        builder.create_changelog_trigger(old_model, new_model, pk_type),
+        'create_changelog_trigger',
+        **instrumentation.get_table_data(old_model, new_model))
+
+
+def apply_rows(cursor, old_model, new_model, pks, mapping=None):
+    """
+    Copy the current state of the rows with the primary keys *pks* from the
+    old table into the new table and delete the ones that no longer exist
+    in the old table, written according to *mapping*.
+    """
+    cursor.execute(builder.delete_missing_rows(old_model, new_model), [pks])
+    cursor.execute(builder.copy_model_data_for_pks(old_model, new_model,
+                                                   **(mapping or {})),
+                   [pks])
+
+
+def apply_changelog_entries(cursor, old_model, new_model,
+                            batch_size=DEFAULT_CHANGELOG_BATCH_SIZE,
+                            mapping=None):
+    """
+    Apply the oldest *batch_size* changelog entries to the new table using
+    *cursor*, without starting or committing a transaction. Repeated changes
+    to the same row are coalesced and applied once. The rows are written
+    according to the *mapping* of a differently shaped new table (see
+    `builder.get_mapping_context`). Returns the number of changelog entries
+    processed.
+    """
+    changelog_table_name = builder.get_changelog_table_name(old_model,
+                                                            new_model)
+
+    cursor.execute(
+        'SELECT id, row_pk FROM {} ORDER BY id LIMIT %s;'.format(
+            changelog_table_name),
+        [batch_size])
+    entries = cursor.fetchall()
+
+    if not entries:
+        return 0
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pks = sorted(set(row_pk for _, row_pk in entries))
+
+    apply_rows(cursor, old_model, new_model, pks, mapping)
+    # Entries are deleted by ID rather than up to the last one because IDs
+    # are assigned before commit and a lower one might only become visible
+    # after reading this batch.
+    cursor.execute(
+        'DELETE FROM {} WHERE id = ANY(%s);'.format(changelog_table_name),
+        [entry_ids])
+
+    log.debug('changelog batch applied',
+              old_table=old_model._meta.db_table,
+              new_table=new_model._meta.db_table,
+              entries=len(entries),
+              rows=len(pks))
+
+    return len(entries)
+
+
+def apply_changelog_batch(connection, old_model, new_model,
+                          batch_size=DEFAULT_CHANGELOG_BATCH_SIZE,
+                          mapping=None):
+    """
+    Same as `apply_changelog_entries` in a transaction of its own.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('BEGIN;')
+        try:
+            applied = apply_changelog_entries(cursor, old_model, new_model,
+                                              batch_size, mapping)
+        except Exception:
+            # The entries stay in the changelog and the connection is left
+            # usable instead of in an aborted transaction.
+            cursor.execute('ROLLBACK;')
+            raise
+        cursor.execute('COMMIT;')
+
+    return applied
+
+
+def apply_changelog(connection, old_model, new_model,
+                    batch_size=DEFAULT_CHANGELOG_BATCH_SIZE, mapping=None):
+    """
+    Apply changelog batches until the changelog has been drained. Returns
+    the total number of changelog entries processed.
+    """
+    started_at = time.time()
+    entries_applied = 0
+
+    while True:
+        applied = apply_changelog_batch(connection, old_model, new_model,
+                                        batch_size, mapping)
+        entries_applied += applied
+
+        if applied < batch_size:
+            break
+
+    instrumentation.emit('changelog_applied',
+                         entries=entries_applied,
+                         elapsed=round(time.time() - started_at, 3),
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+    return entries_applied
+
+
+def get_sync_lag(connection, old_model, new_model):
+    """
+    Return the number of changelog entries that haven't been applied yet and
+    the age of the oldest one in seconds, ``0`` if the changelog is empty.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT count(*), '
+            'COALESCE(EXTRACT(EPOCH FROM now() - MIN(created_at)), 0) '
+            'FROM {};'.format(builder.get_changelog_table_name(old_model,
+                                                               new_model)))
+        pending_entries, lag = cursor.fetchone()
+
+    return pending_entries, float(lag)
+
+
+def emit_sync_lag(connection, old_model, new_model):
+    pending_entries, lag = get_sync_lag(connection, old_model, new_model)
+
+    instrumentation.emit('sync_lag',
+                         pending_entries=pending_entries,
+                         lag_seconds=round(lag, 3),
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+    return pending_entries, lag
+
+
+def wait_until_caught_up(connection, old_model, new_model, max_pending=0,
+                         timeout=None,
+                         batch_size=DEFAULT_CHANGELOG_BATCH_SIZE,
+                         mapping=None):
+    """
+    Apply changelog batches until at most *max_pending* entries are left to
+    be applied. Returns ``False`` if that isn't reached within *timeout*
+    seconds, e.g. because the old table is written to faster than the
+    changes can be applied, and ``True`` otherwise.
+    """
+    started_at = time.time()
+
+    while True:
+        pending_entries, _ = emit_sync_lag(connection, old_model, new_model)
+
+        if pending_entries <= max_pending:
+            return True
+
+        if timeout is not None and time.time() - started_at > timeout:
+            return False
+
+        apply_changelog_batch(connection, old_model, new_model, batch_size,
+                              mapping)
+
+
+def finish_changelog_sync(schema_editor, old_model, new_model,
+                          batch_size=DEFAULT_CHANGELOG_BATCH_SIZE,
+                          mapping=None):
+    """
+    Apply all remaining changelog entries while holding an ``EXCLUSIVE``
+    lock on the old table, so no new entries can be added in the meantime.
+    This doesn't start or commit a transaction, the lock is held until the
+    caller commits. Returns the number of entries applied.
+    """
+    tables = instrumentation.get_table_data(old_model, new_model)
+
+    lock_wait_time = instrumentation.execute_timed(
+        schema_editor,
+        'LOCK TABLE {} IN EXCLUSIVE MODE;'.format(old_model._meta.db_table),
+        'lock_table', **tables)
+    instrumentation.emit('lock_acquired', mode='EXCLUSIVE',
+                         lock_wait_time=round(lock_wait_time, 6), **tables)
+
+    entries_applied = 0
+
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            applied = apply_changelog_entries(cursor, old_model, new_model,
+                                              batch_size, mapping)
+            entries_applied += applied
+
+            if applied < batch_size:
+                return entries_applied
@@ -0,0 +1,229 @@
+"""
+Persistent progress of batched backfills.
+
+The progress of each backfill is stored in the ``removalist_checkpoint``
+table, one row per pair of old and new table. It is updated in the same
+transaction that copies a primary key range, so the checkpoint never claims
+rows that haven't been committed to the new table. A backfill that has been
+interrupted continues after the last checkpoint when it is started again.
+"""
+import threading
+from collections import namedtuple
+
+import structlog
+
+from . import instrumentation
+
+log = structlog.get_logger(__name__)
+
+CHECKPOINT_TABLE_NAME = 'removalist_checkpoint'
+
+Checkpoint = namedtuple('Checkpoint', ['last_pk', 'rows_copied', 'finished'])
+
+BackfillJob = namedtuple('BackfillJob', ['old_table', 'new_table', 'last_pk',
+                                         'rows_copied', 'finished',
+                                         'updated_at'])
+
+
+class BackfillNotFinished(Exception):
+    """
+    Raised when releasing a duplication whose backfill hasn't finished.
+    """
+
+
+def create_checkpoint_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'old_table varchar(255) NOT NULL, '
+            'new_table varchar(255) NOT NULL, '
+            'last_pk bigint NULL, '
+            'rows_copied bigint NOT NULL DEFAULT 0, '
+            'finished boolean NOT NULL DEFAULT false, '
+            'updated_at timestamp with time zone NOT NULL DEFAULT now(), '
+            'PRIMARY KEY (old_table, new_table));'.format(
+                CHECKPOINT_TABLE_NAME))
+
+
+def checkpoint_table_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL;',
+                       [CHECKPOINT_TABLE_NAME])
+        return cursor.fetchone()[0]
+
+
+def get_checkpoint(connection, old_model, new_model):
+    """
+    Return the `Checkpoint` of the backfill from *old_model* to *new_model*
+    or ``None`` if no backfill has been started.
+    """
+    if not checkpoint_table_exists(connection):
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT last_pk, rows_copied, finished FROM {} '
+            'WHERE old_table = %s AND new_table = %s;'.format(
+                CHECKPOINT_TABLE_NAME),
+            [old_model._meta.db_table, new_model._meta.db_table])
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    return Checkpoint(*row)
+
+
+def get_backfill_jobs(connection, unfinished_only=False):
+    """
+    Return a `BackfillJob` for every backfill with a checkpoint, or only
+    for those that haven't finished if *unfinished_only* is set.
+    """
+    if not checkpoint_table_exists(connection):
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT old_table, new_table, last_pk, rows_copied, finished, '
+            'updated_at FROM {}{} ORDER BY old_table, new_table;'.format(
+                CHECKPOINT_TABLE_NAME,
+                ' WHERE NOT finished' if unfinished_only else ''))
+        return [BackfillJob(*row) for row in cursor.fetchall()]
+
+
+def check_backfill_finished(connection, old_model, new_model):
+    """
+    Raise `BackfillNotFinished` if a backfill from *old_model* to
+    *new_model* has been started but not finished.
+    """
+    checkpoint = get_checkpoint(connection, old_model, new_model)
+
+    if checkpoint is not None and not checkpoint.finished:
+        raise BackfillNotFinished(
+            'The backfill of {} -> {} has only copied {} rows so far, run '
+            'the removalist_backfill management command to finish '
+            'it.'.format(old_model._meta.db_table, new_model._meta.db_table,
+                         checkpoint.rows_copied))
+
+
+START_CHECKPOINT_STATEMENT = (
+    'INSERT INTO {} (old_table, new_table) VALUES (%s, %s) '
+    'ON CONFLICT DO NOTHING;'.format(CHECKPOINT_TABLE_NAME))
+
+# The checkpoint table only exists once a resumable backfill has been run.
+CLEAR_CHECKPOINT_STATEMENT = """
+DO $$
+BEGIN
+    IF to_regclass('{table}') IS NOT NULL THEN
+        DELETE FROM {table} WHERE old_table = %s AND new_table = %s;
+    END IF;
+END
+$$;""".format(table=CHECKPOINT_TABLE_NAME)
+
+
+def start_checkpoint(schema_editor, old_model, new_model):
+    """
+    Record that the backfill from *old_model* to *new_model* has started.
+    This is meant to be executed in the transaction creating the triggers,
+    so an existing checkpoint also means that the triggers are in place.
+    """
+    schema_editor.execute(START_CHECKPOINT_STATEMENT,
+                          [old_model._meta.db_table, new_model._meta.db_table])
+
+
+def clear_checkpoint(schema_editor, old_model, new_model):
+    """
+    Remove the checkpoint of the backfill from *old_model* to *new_model*,
+    e.g. when the triggers are dropped and the new table stops being in
+    sync.
+    """
+    schema_editor.execute(CLEAR_CHECKPOINT_STATEMENT,
+                          [old_model._meta.db_table, new_model._meta.db_table])
+
+
+class BackfillCheckpoint(object):
+    """
+    Keep the checkpoint of a batched backfill up to date while ranges are
+    copied, possibly by several workers at once. The checkpoint only moves
+    past a range once all ranges before it have been committed, so resuming
+    never skips rows, but may copy a few ranges a second time.
+    """
+
+    def __init__(self, old_model, new_model):
+        self.old_model = old_model
+        self.new_model = new_model
+        self.old_table = old_model._meta.db_table
+        self.new_table = new_model._meta.db_table
+        self.next_pk = None
+        self.committed = {}
+        self.lock = threading.Lock()
+
+    def resume(self, connection, lower):
+        """
+        Return the primary key the backfill should start from given the
+        smallest primary key *lower* in the old table, or ``None`` if the
+        backfill has finished before.
+        """
+        checkpoint = get_checkpoint(connection, self.old_model,
+                                    self.new_model)
+
+        if checkpoint is None:
+            create_checkpoint_table(connection)
+            with connection.cursor() as cursor:
+                cursor.execute(START_CHECKPOINT_STATEMENT,
+                               [self.old_table, self.new_table])
+        elif checkpoint.finished:
+            log.info('backfill already finished',
+                     old_table=self.old_table,
+                     new_table=self.new_table,
+                     rows_copied=checkpoint.rows_copied)
+            return None
+        elif checkpoint.last_pk is not None:
+            instrumentation.emit('backfill_resumed',
+                                 old_table=self.old_table,
+                                 new_table=self.new_table,
+                                 last_pk=checkpoint.last_pk,
+                                 rows_copied=checkpoint.rows_copied)
+            lower = max(lower, checkpoint.last_pk + 1)
+
+        self.next_pk = lower
+        return lower
+
+    def get_last_pk(self, start, end):
+        next_pk = self.next_pk
+        pending = dict(self.committed)
+        pending[start] = end
+
+        while next_pk in pending:
+            next_pk = pending.pop(next_pk)
+
+        return next_pk - 1
+
+    def record(self, cursor, start, end, rows):
+        """
+        Update the checkpoint for the range ``[start, end)`` with *rows*
+        copied, using the *cursor* of the transaction copying the range.
+        """
+        with self.lock:
+            last_pk = self.get_last_pk(start, end)
+
+        cursor.execute(
+            'UPDATE {} SET last_pk = GREATEST(last_pk, %s), '
+            'rows_copied = rows_copied + %s, updated_at = now() '
+            'WHERE old_table = %s AND new_table = %s;'.format(
+                CHECKPOINT_TABLE_NAME),
+            [last_pk, rows, self.old_table, self.new_table])
+
+    def commit(self, start, end):
+        with self.lock:
+            self.committed[start] = end
+            while self.next_pk in self.committed:
+                self.next_pk = self.committed.pop(self.next_pk)
+
+    def finish(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {} SET finished = true, updated_at = now() '
+                'WHERE old_table = %s AND new_table = %s;'.format(
+                    CHECKPOINT_TABLE_NAME),
+                [self.old_table, self.new_table])
@@ -0,0 +1,156 @@
+"""
+Cutover from the old table to the new table of a duplication.
+
+Once the new table is in sync, the cutover stops the sync and puts the new
+table in place of the old one in a single short transaction holding an
+``ACCESS EXCLUSIVE`` lock on both tables:
+
+* ``view`` renames the old table out of the way and creates an updatable
+  view with its name that selects from the new table, so code still using
+  the old table reads and writes the new one.
+* ``rename`` renames the old table out of the way and the new table to the
+  name of the old one, e.g. for a duplication that only changes the shape
+  of the table while the model keeps its table name.
+
+The old table is kept under the archive name. The primary key sequence of
+the new table is moved past the values used in either table, as the synced
+rows have been written with explicit primary keys.
+
+Reading the new table and its indexes with ``pg_prewarm`` beforehand avoids
+the latency spike of queries hitting a cold cache right after the cutover.
+This requires the ``pg_prewarm`` extension and is skipped without it.
+"""
+import structlog
+
+from django.db.backends.utils import truncate_name
+
+from . import instrumentation
+
+log = structlog.get_logger(__name__)
+
+VIEW = 'view'
+RENAME = 'rename'
+SWAP_MODES = (VIEW, RENAME)
+
+MAX_TABLE_NAME_LENGTH = 63
+
+
+class SyncNotCaughtUp(Exception):
+    pass
+
+
+def get_archive_table_name(old_model):
+    return truncate_name('{}_archived'.format(old_model._meta.db_table),
+                         MAX_TABLE_NAME_LENGTH)
+
+
+def prewarm_extension_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_extension "
+                       "WHERE extname = 'pg_prewarm');")
+        return cursor.fetchone()[0]
+
+
+def prewarm(connection, model):
+    """
+    Load the table of *model* and its indexes into the shared buffers.
+    Returns the number of blocks read, or ``None`` if the ``pg_prewarm``
+    extension isn't installed.
+    """
+    table = model._meta.db_table
+
+    if not prewarm_extension_exists(connection):
+        log.warning('pg_prewarm is not installed, not prewarming table',
+                    table=table)
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_prewarm(%s::regclass) + COALESCE(SUM(pg_prewarm('
+            'indexrelid)), 0) FROM pg_index WHERE indrelid = %s::regclass;',
+            [table, table])
+        blocks = int(cursor.fetchone()[0])
+
+    instrumentation.emit('table_prewarmed', table=table, blocks=blocks)
+
+    return blocks
+
+
+def fix_sequence(cursor, old_model, new_model):
+    """
+    Set the primary key sequence of the new table past the largest primary
+    key in it and past the last value of the sequence of the old table, so
+    values are never handed out twice. Returns the new value of the
+    sequence, or ``None`` if the primary key of the new table has none.
+    """
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+    new_pk = new_model._meta.pk.column
+
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s), '
+                   'pg_get_serial_sequence(%s, %s);',
+                   [old_table, old_model._meta.pk.column, new_table, new_pk])
+    old_sequence, new_sequence = cursor.fetchone()
+
+    if new_sequence is None:
+        return None
+
+    old_last_value = '0'
+    if old_sequence is not None:
+        old_last_value = '(SELECT last_value FROM {})'.format(old_sequence)
+
+    cursor.execute(
+        'SELECT setval(%s, GREATEST((SELECT MAX({pk}) FROM {table}), {old}, '
+        '1));'.format(pk=new_pk, table=new_table, old=old_last_value),
+        [new_sequence])
+    value = cursor.fetchone()[0]
+
+    instrumentation.emit('sequence_fixed', sequence=new_sequence, value=value,
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+    return value
+
+
+def get_swap_statements(old_model, new_model, swap=VIEW):
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+
+    statements = ['ALTER TABLE {} RENAME TO {};'.format(
+        old_table, get_archive_table_name(old_model))]
+
+    if swap == VIEW:
+        statements.append('CREATE VIEW {} AS SELECT * FROM {};'.format(
+            old_table, new_table))
+    else:
+        statements.append('ALTER TABLE {} RENAME TO {};'.format(new_table,
+                                                                old_table))
+
+    return statements
+
+
+def lock_tables(schema_editor, old_model, new_model):
+    tables = instrumentation.get_table_data(old_model, new_model)
+
+    lock_wait_time = instrumentation.execute_timed(
+        schema_editor,
+        'LOCK TABLE {}, {} IN ACCESS EXCLUSIVE MODE;'.format(
+            old_model._meta.db_table, new_model._meta.db_table),
+        'lock_table', **tables)
+    instrumentation.emit('lock_acquired', mode='ACCESS EXCLUSIVE',
+                         lock_wait_time=round(lock_wait_time, 6), **tables)
+
+
+def swap_tables(schema_editor, old_model, new_model, swap=VIEW):
+    """
+    Fix the sequence of the new table and put it in place of the old table
+    according to *swap*. The tables are expected to be locked by
+    `lock_tables` in the same transaction, this doesn't start or commit it.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        fix_sequence(cursor, old_model, new_model)
+
+    for statement in get_swap_statements(old_model, new_model, swap):
+        instrumentation.execute_timed(
+            schema_editor, statement, 'swap_tables',
+            **instrumentation.get_table_data(old_model, new_model))
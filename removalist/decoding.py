@@ -0,0 +1,413 @@
+"""
+Logical decoding based sync of a new table.
+
+Instead of triggers, the changes to the old table are read from a logical
+replication slot created for the duplication with the ``test_decoding``
+output plugin. Writes to the old table don't do any additional work, the
+changes are decoded from the WAL and applied to the new table in batches,
+like the changelog (see `changelog`): the primary keys of the changed rows
+are collected and the current state of those rows is copied into the new
+table, or deleted from it if they no longer exist.
+
+This requires ``wal_level = logical`` and a free replication slot. While the
+slot exists, the server retains all WAL it hasn't been read up to, so the
+changes have to be applied continuously, e.g. with the ``removalist_sync``
+management command, and the slot is dropped when the duplication is
+released.
+"""
+import re
+import time
+
+import structlog
+
+from django.db.backends.utils import truncate_name
+from django.db.transaction import TransactionManagementError
+
+from . import changelog, instrumentation
+
+log = structlog.get_logger(__name__)
+
+DEFAULT_DECODING_BATCH_SIZE = 10000
+OUTPUT_PLUGIN = 'test_decoding'
+MAX_SLOT_NAME_LENGTH = 63
+
+CHANGE_PATTERN = re.compile(
+    r'^table (?P<table>.+?): (?P<action>INSERT|UPDATE|DELETE|TRUNCATE): '
+    r'(?P<data>.*)$', re.DOTALL)
+PEEK_CHANGES_STATEMENT = (
+    "SELECT lsn, data FROM pg_logical_slot_peek_changes("
+    "%s, NULL, %s, 'include-xids', '0', 'skip-empty-xacts', '1')")
+# Server-side cursor over the decoded changes while finishing the sync.
+CHANGES_CURSOR_NAME = 'removalist_decoded_changes'
+
+COLUMN_PATTERN = re.compile(
+    r'\s*(?:(?:old-key|new-tuple):\s*)?'
+    r'(?P<name>"(?:[^"]|"")*"|[^\[\s]+)\[(?P<type>.+?)\]:'
+    r"(?P<value>'(?:[^']|'')*'|\S+)")
+
+
+class LogicalDecodingUnavailable(Exception):
+    pass
+
+
+class ReplicationSlotNotFound(Exception):
+    pass
+
+
+def get_slot_name(old_model, new_model):
+    name = re.sub(r'[^a-z0-9_]', '_', 'removalist_{}_to_{}'.format(
+        old_model._meta.db_table, new_model._meta.db_table).lower())
+    return truncate_name(name, MAX_SLOT_NAME_LENGTH)
+
+
+def check_logical_decoding(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW wal_level;')
+        wal_level = cursor.fetchone()[0]
+
+    if wal_level != 'logical':
+        raise LogicalDecodingUnavailable(
+            "wal_level is '{}', the sync with logical decoding requires "
+            "wal_level = logical.".format(wal_level))
+
+
+def slot_exists(connection, old_model, new_model):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM pg_replication_slots '
+                       'WHERE slot_name = %s);',
+                       [get_slot_name(old_model, new_model)])
+        return cursor.fetchone()[0]
+
+
+def create_slot(connection, old_model, new_model):
+    """
+    Create the replication slot for the sync of *old_model* into
+    *new_model*, unless it exists already. All changes committed after this
+    are decoded from the slot. This can't run in a transaction that has
+    written anything, so it is executed on its own and raises
+    `TransactionManagementError` in an atomic block, e.g. of a migration
+    that isn't marked as ``atomic = False``. Returns whether the slot has
+    been created.
+    """
+    if connection.in_atomic_block:
+        raise TransactionManagementError(
+            'The replication slot for {} -> {} can\'t be created in an atomic '
+            'block, mark the migration as atomic = False.'.format(
+                old_model._meta.db_table, new_model._meta.db_table))
+
+    if slot_exists(connection, old_model, new_model):
+        return False
+
+    slot_name = get_slot_name(old_model, new_model)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT lsn FROM pg_create_logical_replication_slot('
+                       '%s, %s);', [slot_name, OUTPUT_PLUGIN])
+        lsn = cursor.fetchone()[0]
+
+    instrumentation.emit('replication_slot_created', slot=slot_name, lsn=lsn,
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+    return True
+
+
+def drop_slot(connection, old_model, new_model):
+    slot_name = get_slot_name(old_model, new_model)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_drop_replication_slot(slot_name) '
+                       'FROM pg_replication_slots WHERE slot_name = %s;',
+                       [slot_name])
+
+    instrumentation.emit('replication_slot_dropped', slot=slot_name,
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+
+def unquote(value, quote):
+    if value.startswith(quote) and value.endswith(quote) and len(value) > 1:
+        return value[1:-1].replace(quote * 2, quote)
+    return value
+
+
+def parse_change(data):
+    """
+    Return the table, the action and the ``(column, value)`` pairs of a
+    change in the output of ``test_decoding``, or ``None`` for other output,
+    e.g. the beginning and end of a transaction. The columns of the old key
+    of an update are included before the new row. Values are returned as
+    text and ``None`` for ``NULL``.
+    """
+    match = CHANGE_PATTERN.match(data)
+    if match is None:
+        return None
+
+    table = match.group('table')
+    # The table is qualified with its schema and quoted where necessary.
+    table = unquote(re.split(r'\.(?=(?:[^"]|"[^"]*")*$)', table)[-1], '"')
+
+    columns = []
+    position = 0
+    column_data = match.group('data')
+    while True:
+        column = COLUMN_PATTERN.match(column_data, position)
+        if column is None:
+            break
+
+        value = column.group('value')
+        columns.append((unquote(column.group('name'), '"'),
+                        None if value == 'null' else unquote(value, "'")))
+        position = column.end()
+
+    return table, match.group('action'), columns
+
+
+def get_changed_pks(old_model, changes):
+    """
+    Return the sorted primary keys of the rows of *old_model* changed by the
+    decoded *changes*, converted to the values of the primary key field.
+    """
+    table = old_model._meta.db_table
+    pk = old_model._meta.pk
+
+    pks = set()
+    for data in changes:
+        change = parse_change(data)
+        if change is None or change[0] != table:
+            continue
+
+        _, action, columns = change
+        if action == 'TRUNCATE':
+            log.warning('truncate of old table is not synced', table=table)
+            continue
+
+        for name, value in columns:
+            if name == pk.column and value is not None:
+                pks.add(pk.to_python(value))
+
+    return sorted(pks)
+
+
+def peek_changes(cursor, old_model, new_model, max_changes=None):
+    """
+    Return the ``(lsn, data)`` of up to about *max_changes* changes decoded
+    from the slot, without consuming them. The changes of a transaction are
+    always returned together.
+    """
+    cursor.execute(PEEK_CHANGES_STATEMENT + ';',
+                   [get_slot_name(old_model, new_model), max_changes])
+    return cursor.fetchall()
+
+
+def apply_changes(cursor, old_model, new_model, changes,
+                  batch_size=DEFAULT_DECODING_BATCH_SIZE, mapping=None):
+    """
+    Apply the decoded *changes* to the new table using *cursor*, copying the
+    changed rows in chunks of *batch_size* primary keys. Returns the number
+    of changed rows.
+    """
+    pks = get_changed_pks(old_model, [data for _, data in changes])
+
+    for start in range(0, len(pks), batch_size):
+        changelog.apply_rows(cursor, old_model, new_model,
+                             pks[start:start + batch_size], mapping)
+
+    return len(pks)
+
+
+def get_current_lsn(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_lsn();')
+        return cursor.fetchone()[0]
+
+
+def slot_has_reached(connection, old_model, new_model, lsn):
+    """
+    Return whether the changes up to *lsn* have been consumed from the slot.
+    Raises `ReplicationSlotNotFound` if the slot doesn't exist.
+    """
+    slot_name = get_slot_name(old_model, new_model)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT confirmed_flush_lsn >= %s::pg_lsn '
+            'FROM pg_replication_slots WHERE slot_name = %s;',
+            [lsn, slot_name])
+        row = cursor.fetchone()
+
+    if row is None:
+        raise ReplicationSlotNotFound(
+            'The replication slot {} of {} -> {} does not exist.'.format(
+                slot_name, old_model._meta.db_table,
+                new_model._meta.db_table))
+
+    return row[0]
+
+
+def apply_decoded_batch(connection, old_model, new_model,
+                        batch_size=DEFAULT_DECODING_BATCH_SIZE, mapping=None):
+    """
+    Apply about *batch_size* changes decoded from the slot in a transaction
+    and consume them from the slot once it has been committed. Changes are
+    applied again if this is interrupted in between, which only copies the
+    current state of the rows once more. Returns the number of decoded
+    changes, including the ones to other tables.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('BEGIN;')
+        try:
+            changes = peek_changes(cursor, old_model, new_model, batch_size)
+            rows = apply_changes(cursor, old_model, new_model, changes,
+                                 batch_size, mapping)
+        except Exception:
+            # The changes stay in the slot and the connection is left usable
+            # instead of in an aborted transaction.
+            cursor.execute('ROLLBACK;')
+            raise
+        cursor.execute('COMMIT;')
+
+        if changes:
+            cursor.execute('SELECT pg_replication_slot_advance(%s, %s);',
+                           [get_slot_name(old_model, new_model),
+                            changes[-1][0]])
+
+    log.debug('decoded batch applied',
+              old_table=old_model._meta.db_table,
+              new_table=new_model._meta.db_table,
+              changes=len(changes),
+              rows=rows)
+
+    return len(changes)
+
+
+def apply_decoded_changes(connection, old_model, new_model,
+                          batch_size=DEFAULT_DECODING_BATCH_SIZE,
+                          mapping=None):
+    """
+    Apply decoded batches until the slot has been consumed up to the WAL
+    position at the start, or no changes are left. The batches include the
+    changes to other tables, so their size doesn't tell whether the slot
+    has been drained. Returns the total number of decoded changes.
+    """
+    started_at = time.time()
+    changes_applied = 0
+    target_lsn = get_current_lsn(connection)
+
+    while True:
+        applied = apply_decoded_batch(connection, old_model, new_model,
+                                      batch_size, mapping)
+        changes_applied += applied
+
+        if not applied or slot_has_reached(connection, old_model, new_model,
+                                           target_lsn):
+            break
+
+    instrumentation.emit('decoded_changes_applied',
+                         changes=changes_applied,
+                         elapsed=round(time.time() - started_at, 3),
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+    return changes_applied
+
+
+def get_sync_lag(connection, old_model, new_model):
+    """
+    Return the amount of WAL in bytes that hasn't been consumed from the
+    slot yet. This includes changes to other tables, so it never quite
+    drops to zero on a busy database. Raises `ReplicationSlotNotFound` if
+    the slot doesn't exist.
+    """
+    slot_name = get_slot_name(old_model, new_model)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '
+            'confirmed_flush_lsn) FROM pg_replication_slots '
+            'WHERE slot_name = %s;', [slot_name])
+        row = cursor.fetchone()
+
+    if row is None:
+        raise ReplicationSlotNotFound(
+            'The replication slot {} of {} -> {} does not exist.'.format(
+                slot_name, old_model._meta.db_table,
+                new_model._meta.db_table))
+
+    return int(row[0])
+
+
+def emit_sync_lag(connection, old_model, new_model):
+    lag = get_sync_lag(connection, old_model, new_model)
+
+    instrumentation.emit('sync_lag', lag_bytes=lag,
+                         **instrumentation.get_table_data(old_model,
+                                                          new_model))
+
+    return lag
+
+
+def wait_until_caught_up(connection, old_model, new_model, timeout=None,
+                         batch_size=DEFAULT_DECODING_BATCH_SIZE,
+                         mapping=None):
+    """
+    Apply decoded batches until a batch isn't full, i.e. the slot has been
+    drained up to the changes that were being written meanwhile. Returns
+    ``False`` if that isn't reached within *timeout* seconds and ``True``
+    otherwise.
+    """
+    started_at = time.time()
+
+    while True:
+        emit_sync_lag(connection, old_model, new_model)
+
+        if apply_decoded_batch(connection, old_model, new_model, batch_size,
+                               mapping) < batch_size:
+            return True
+
+        if timeout is not None and time.time() - started_at > timeout:
+            return False
+
+
+def finish_decoding_sync(schema_editor, old_model, new_model,
+                         batch_size=DEFAULT_DECODING_BATCH_SIZE,
+                         mapping=None):
+    """
+    Apply all remaining changes decoded from the slot while holding an
+    ``EXCLUSIVE`` lock on the old table, so no changes can be added in the
+    meantime. The changes are fetched through a server-side cursor in
+    batches of *batch_size*, so the client never holds the whole backlog
+    of the slot, which includes the changes to all other tables. This
+    doesn't start or commit a transaction and doesn't consume the changes,
+    the slot is expected to be dropped after the commit. Returns the number
+    of changed rows.
+    """
+    tables = instrumentation.get_table_data(old_model, new_model)
+
+    lock_wait_time = instrumentation.execute_timed(
+        schema_editor,
+        'LOCK TABLE {} IN EXCLUSIVE MODE;'.format(old_model._meta.db_table),
+        'lock_table', **tables)
+    instrumentation.emit('lock_acquired', mode='EXCLUSIVE',
+                         lock_wait_time=round(lock_wait_time, 6), **tables)
+
+    rows = 0
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'DECLARE {} NO SCROLL CURSOR FOR {};'.format(
+                CHANGES_CURSOR_NAME, PEEK_CHANGES_STATEMENT),
+            [get_slot_name(old_model, new_model), None])
+
+        while True:
+            cursor.execute('FETCH FORWARD %s FROM {};'.format(
+                CHANGES_CURSOR_NAME), [batch_size])
+            changes = cursor.fetchall()
+            rows += apply_changes(cursor, old_model, new_model, changes,
+                                  batch_size, mapping)
+
+            if len(changes) < batch_size:
+                break
+
+        cursor.execute('CLOSE {};'.format(CHANGES_CURSOR_NAME))
+
+    return rows
@@ -0,0 +1,266 @@
+"""
+Online retargeting of the foreign keys referencing a duplicated table.
+
+Pointing a foreign key at another table with ``AlterField`` drops and adds
+the constraint in one statement, which checks every row of the referencing
+table while holding a lock that blocks writes to it. Instead, each
+constraint referencing the old table is re-created against the new table as
+``NOT VALID`` in a short transaction of its own, which only checks rows
+written from then on. The existing rows are checked afterwards with
+``VALIDATE CONSTRAINT``, which only takes a ``SHARE UPDATE EXCLUSIVE`` lock
+on the referencing table and doesn't block reads or writes.
+
+Each retargeted constraint is recorded in the
+``removalist_retargeted_foreign_key`` table in the transaction that
+retargets it. Only the recorded constraints are validated and pointed back
+at the old table when migrating backwards, constraints that referenced the
+new table all along are left alone. The constraints keep their names, so
+running the retargeting again after an interruption continues with the
+constraints still referencing the old table and validates the recorded ones
+that haven't been validated yet.
+
+The new table has to be kept in sync by the sync triggers. With a changelog
+or logical decoding sync, rows inserted into the old table only show up in
+the new table later, so inserting rows referencing them would fail the
+foreign key check.
+"""
+import re
+import time
+from collections import namedtuple
+
+from . import instrumentation, locking
+
+ReferencingConstraint = namedtuple('ReferencingConstraint',
+                                   ['table', 'name', 'definition',
+                                    'validated'])
+
+REFERENCES_PATTERN = re.compile(r'REFERENCES\s+(?:"(?:[^"]|"")*"|[^\s("])+\(')
+
+RETARGETED_TABLE_NAME = 'removalist_retargeted_foreign_key'
+
+SYNC_TRIGGER_EVENTS = ('insert', 'update', 'delete')
+MAX_TRIGGER_NAME_LENGTH = 63
+
+
+class TriggerSyncRequired(Exception):
+    pass
+
+
+def check_trigger_sync(connection, old_model, new_model):
+    """
+    Raise `TriggerSyncRequired` unless the table of *new_model* is kept in
+    sync with the table of *old_model* by the sync triggers.
+    """
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+    # Like the templates, but truncated as PostgreSQL does.
+    names = ['{}_to_{}_{}_trigger'.format(
+        old_table, new_table, event)[:MAX_TRIGGER_NAME_LENGTH]
+        for event in SYNC_TRIGGER_EVENTS]
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM pg_trigger '
+                       'WHERE tgrelid = %s::regclass AND tgname = ANY(%s);',
+                       [old_table, names])
+        trigger_count = cursor.fetchone()[0]
+
+    if trigger_count < len(names):
+        raise TriggerSyncRequired(
+            'The foreign keys referencing {old} can only be retargeted to '
+            '{new} while the sync triggers keep {new} in sync, not with a '
+            'changelog or logical decoding sync or after the duplication has '
+            'been released.'.format(old=old_table, new=new_table))
+
+
+def create_retargeted_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'old_table varchar(255) NOT NULL, '
+            'new_table varchar(255) NOT NULL, '
+            'referencing_table varchar(255) NOT NULL, '
+            'name varchar(255) NOT NULL, '
+            'PRIMARY KEY (referencing_table, name));'.format(
+                RETARGETED_TABLE_NAME))
+
+
+def retargeted_table_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL;',
+                       [RETARGETED_TABLE_NAME])
+        return cursor.fetchone()[0]
+
+
+def get_referencing_constraints(connection, table, excluded_tables=()):
+    """
+    Return a `ReferencingConstraint` for every foreign key constraint
+    referencing *table*, except for those of *table* itself and of the
+    *excluded_tables*. Constraints of partitions inherited from their
+    partitioned table are left to the constraint of the partitioned table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conrelid::regclass::text, conname, '
+            'pg_get_constraintdef(oid), convalidated FROM pg_constraint '
+            "WHERE contype = 'f' AND confrelid = %s::regclass "
+            'AND conparentid = 0 '
+            'AND conrelid <> ALL(%s::regclass[]) '
+            'ORDER BY conrelid::regclass::text, conname;',
+            [table, [table] + list(excluded_tables)])
+        return [ReferencingConstraint(*row) for row in cursor.fetchall()]
+
+
+def get_retargeted_constraints(connection, old_table, new_table,
+                               referenced_table):
+    """
+    Return a `ReferencingConstraint` for every constraint recorded as
+    retargeted from *old_table* to *new_table* that currently references
+    *referenced_table*.
+    """
+    if not retargeted_table_exists(connection):
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT retargeted.referencing_table, retargeted.name, '
+            'pg_get_constraintdef(pg_constraint.oid), '
+            'pg_constraint.convalidated '
+            'FROM {} AS retargeted JOIN pg_constraint '
+            'ON pg_constraint.conrelid = '
+            'to_regclass(retargeted.referencing_table) '
+            'AND pg_constraint.conname = retargeted.name '
+            'WHERE retargeted.old_table = %s AND retargeted.new_table = %s '
+            "AND pg_constraint.contype = 'f' "
+            'AND pg_constraint.confrelid = %s::regclass '
+            'ORDER BY retargeted.referencing_table, retargeted.name;'.format(
+                RETARGETED_TABLE_NAME),
+            [old_table, new_table, referenced_table])
+        return [ReferencingConstraint(*row) for row in cursor.fetchall()]
+
+
+def get_retargeted_definition(definition, table):
+    """
+    Return the constraint *definition* as returned by
+    ``pg_get_constraintdef`` referencing *table* instead, without being
+    marked ``NOT VALID``.
+    """
+    retargeted, count = REFERENCES_PATTERN.subn(
+        'REFERENCES {}('.format(table), definition, count=1)
+
+    if not count:
+        raise ValueError('Not a foreign key definition: {}'.format(
+            definition))
+
+    if retargeted.endswith(' NOT VALID'):
+        retargeted = retargeted[:-len(' NOT VALID')]
+
+    return retargeted
+
+
+def retarget_constraint(connection, constraint, table, lock_retry=None,
+                        record_for=None):
+    """
+    Replace *constraint* by a ``NOT VALID`` constraint with the same name
+    that references *table*, in a transaction retried on lock timeouts
+    according to *lock_retry* (see `locking.get_lock_retry`). With
+    *record_for* set to the ``(old_table, new_table)`` of a duplication,
+    the constraint is recorded as retargeted in the same transaction.
+    """
+    statement = ('ALTER TABLE {table} DROP CONSTRAINT {name}, '
+                 'ADD CONSTRAINT {name} {definition} NOT VALID;'.format(
+                     table=constraint.table, name=constraint.name,
+                     definition=get_retargeted_definition(
+                         constraint.definition, table)))
+
+    def retarget():
+        cursor.execute(statement)
+
+        if record_for is not None:
+            cursor.execute(
+                'INSERT INTO {} (old_table, new_table, referencing_table, '
+                'name) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;'.format(
+                    RETARGETED_TABLE_NAME),
+                list(record_for) + [constraint.table, constraint.name])
+
+    started_at = time.time()
+
+    with connection.cursor() as cursor:
+        locking.run_transaction(
+            cursor.execute, retarget, lock_retry, connection=connection,
+            step='retarget_foreign_key', table=constraint.table,
+            constraint=constraint.name)
+
+    instrumentation.emit('foreign_key_retargeted', table=constraint.table,
+                         constraint=constraint.name, referenced_table=table,
+                         duration=round(time.time() - started_at, 3))
+
+
+def validate_constraint(connection, constraint):
+    started_at = time.time()
+
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {} VALIDATE CONSTRAINT {};'.format(
+            constraint.table, constraint.name))
+
+    instrumentation.emit('foreign_key_validated', table=constraint.table,
+                         constraint=constraint.name,
+                         duration=round(time.time() - started_at, 3))
+
+
+def validate_retargeted_constraints(connection, old_table, new_table,
+                                   referenced_table):
+    for constraint in get_retargeted_constraints(connection, old_table,
+                                                 new_table, referenced_table):
+        if not constraint.validated:
+            validate_constraint(connection, constraint)
+
+
+def retarget_foreign_keys(connection, old_model, new_model, lock_retry=None):
+    """
+    Make all foreign keys referencing the table of *old_model* reference
+    the table of *new_model* instead, one referencing constraint at a time,
+    and validate them afterwards. Foreign keys of either table are left
+    alone. The tables are expected to be synced by the sync triggers (see
+    `check_trigger_sync`). Returns the number of retargeted constraints.
+    """
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+
+    create_retargeted_table(connection)
+
+    constraints = get_referencing_constraints(connection, old_table,
+                                              [new_table])
+    for constraint in constraints:
+        retarget_constraint(connection, constraint, new_table, lock_retry,
+                            record_for=(old_table, new_table))
+
+    validate_retargeted_constraints(connection, old_table, new_table,
+                                    new_table)
+
+    return len(constraints)
+
+
+def restore_foreign_keys(connection, old_model, new_model, lock_retry=None):
+    """
+    Point the foreign keys retargeted by `retarget_foreign_keys` back at the
+    table of *old_model*, validate them and remove their records. Returns
+    the number of constraints pointed back.
+    """
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+
+    constraints = get_retargeted_constraints(connection, old_table, new_table,
+                                             new_table)
+    for constraint in constraints:
+        retarget_constraint(connection, constraint, old_table, lock_retry)
+
+    validate_retargeted_constraints(connection, old_table, new_table,
+                                    old_table)
+
+    if retargeted_table_exists(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE old_table = %s AND new_table = %s;'
+                .format(RETARGETED_TABLE_NAME), [old_table, new_table])
+
+    return len(constraints)
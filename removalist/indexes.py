@@ -0,0 +1,233 @@
+"""
+Deferred building of the secondary indexes and foreign keys of a new table.
+
+Copying into a table with all its indexes and foreign keys in place updates
+every index and checks every foreign key row by row. Building the indexes
+once after the copy and validating the foreign keys in one scan is a lot
+cheaper for large tables.
+
+Before the copy, the non-unique secondary indexes and the foreign key
+constraints of the new table are dropped and their definitions stored in
+the ``removalist_deferred_object`` table, so they survive an interrupted
+migration. After the copy, the indexes are re-created with ``CREATE INDEX
+CONCURRENTLY`` and the foreign keys are added ``NOT VALID`` and validated
+separately, neither of which blocks writes to the new table. The primary
+key and unique indexes are kept, the upserts and ``ON CONFLICT`` clauses
+depend on them.
+"""
+import time
+from collections import namedtuple
+
+import structlog
+
+from . import instrumentation, locking
+
+log = structlog.get_logger(__name__)
+
+DEFERRED_TABLE_NAME = 'removalist_deferred_object'
+
+INDEX = 'index'
+CONSTRAINT = 'constraint'
+
+DeferredObject = namedtuple('DeferredObject', ['name', 'kind', 'definition'])
+
+
+def create_deferred_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'new_table varchar(255) NOT NULL, '
+            'name varchar(255) NOT NULL, '
+            'kind varchar(16) NOT NULL, '
+            'definition text NOT NULL, '
+            'PRIMARY KEY (new_table, name));'.format(DEFERRED_TABLE_NAME))
+
+
+def deferred_table_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL;',
+                       [DEFERRED_TABLE_NAME])
+        return cursor.fetchone()[0]
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class "
+                       "WHERE oid = %s::regclass;", [table])
+        return cursor.fetchone()[0]
+
+
+def get_deferrable_indexes(connection, table):
+    """
+    Return a `DeferredObject` for every index of *table* that isn't unique
+    and doesn't back a constraint.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid) '
+            'FROM pg_index '
+            'JOIN pg_class AS index_class '
+            'ON index_class.oid = pg_index.indexrelid '
+            'WHERE pg_index.indrelid = %s::regclass '
+            'AND NOT pg_index.indisunique '
+            'AND NOT EXISTS (SELECT 1 FROM pg_constraint '
+            'WHERE pg_constraint.conindid = pg_index.indexrelid) '
+            'ORDER BY index_class.relname;', [table])
+        return [DeferredObject(name, INDEX, definition)
+                for name, definition in cursor.fetchall()]
+
+
+def get_foreign_keys(connection, table):
+    """
+    Return a `DeferredObject` for every foreign key constraint of *table*.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype = 'f' "
+            'ORDER BY conname;', [table])
+        return [DeferredObject(name, CONSTRAINT, definition)
+                for name, definition in cursor.fetchall()]
+
+
+def get_deferred_objects(connection, table):
+    if not deferred_table_exists(connection):
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT name, kind, definition FROM {} WHERE new_table = %s '
+            'ORDER BY kind DESC, name;'.format(DEFERRED_TABLE_NAME),
+            [table])
+        return [DeferredObject(*row) for row in cursor.fetchall()]
+
+
+def defer_indexes(connection, new_model):
+    """
+    Drop the secondary indexes and foreign keys of the table of
+    *new_model* and record them to be re-created by `restore_indexes`. This
+    doesn't start or commit a transaction, so the objects are dropped and
+    recorded atomically. Partitioned tables are skipped, as their indexes
+    can't be built concurrently. Returns the deferred objects.
+    """
+    table = new_model._meta.db_table
+
+    if is_partitioned(connection, table):
+        log.info('not deferring indexes of partitioned table', table=table)
+        return []
+
+    deferred = (get_deferrable_indexes(connection, table) +
+                get_foreign_keys(connection, table))
+
+    with connection.cursor() as cursor:
+        for deferred_object in deferred:
+            cursor.execute(
+                'INSERT INTO {} (new_table, name, kind, definition) '
+                'VALUES (%s, %s, %s, %s);'.format(DEFERRED_TABLE_NAME),
+                [table] + list(deferred_object))
+
+            if deferred_object.kind == INDEX:
+                cursor.execute('DROP INDEX {};'.format(deferred_object.name))
+            else:
+                cursor.execute('ALTER TABLE {} DROP CONSTRAINT {};'.format(
+                    table, deferred_object.name))
+
+    instrumentation.emit('indexes_deferred', new_table=table,
+                         indexes=[o.name for o in deferred
+                                  if o.kind == INDEX],
+                         constraints=[o.name for o in deferred
+                                      if o.kind == CONSTRAINT])
+
+    return deferred
+
+
+def get_index_validity(cursor, table, name):
+    # Index names are only unique per schema, so the index is looked up on
+    # its table rather than by name alone.
+    cursor.execute('SELECT pg_index.indisvalid FROM pg_index '
+                   'JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+                   'WHERE pg_index.indrelid = %s::regclass '
+                   'AND pg_class.relname = %s;', [table, name])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def restore_index(cursor, table, deferred_object):
+    # An interrupted concurrent build leaves an invalid index behind that
+    # has to be dropped before building it again.
+    valid = get_index_validity(cursor, table, deferred_object.name)
+    if valid is False:
+        cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS {};'.format(
+            deferred_object.name))
+    elif valid:
+        return
+
+    cursor.execute(deferred_object.definition.replace(
+        'INDEX', 'INDEX CONCURRENTLY', 1))
+
+
+def restore_constraint(cursor, table, deferred_object, lock_retry=None):
+    cursor.execute(
+        'SELECT 1 FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND conname = %s;',
+        [table, deferred_object.name])
+
+    if cursor.fetchone() is None:
+        def add_constraint():
+            cursor.execute(
+                'ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID;'.format(
+                    table, deferred_object.name, deferred_object.definition))
+
+        # Adding the constraint briefly locks the referenced table as well.
+        retry = locking.get_lock_retry(lock_retry)
+        if retry is None:
+            add_constraint()
+        else:
+            retry.run(cursor.execute, add_constraint, connection=cursor.db,
+                      step='add_constraint', new_table=table)
+
+    cursor.execute('ALTER TABLE {} VALIDATE CONSTRAINT {};'.format(
+        table, deferred_object.name))
+
+
+def restore_indexes(connection, new_model, analyze=True, lock_retry=None):
+    """
+    Re-create the indexes and foreign keys of the table of *new_model*
+    deferred by `defer_indexes`, one at a time and each outside of a
+    transaction, and ``ANALYZE`` the table afterwards if *analyze* is set.
+    Waiting to add a foreign key is bounded according to *lock_retry* (see
+    `locking.get_lock_retry`).
+    Objects that have been restored are removed from the record, so this
+    can be repeated after being interrupted. Returns the number of restored
+    objects.
+    """
+    table = new_model._meta.db_table
+    deferred = get_deferred_objects(connection, table)
+
+    with connection.cursor() as cursor:
+        for deferred_object in deferred:
+            started_at = time.time()
+
+            if deferred_object.kind == INDEX:
+                restore_index(cursor, table, deferred_object)
+            else:
+                restore_constraint(cursor, table, deferred_object,
+                                   lock_retry=lock_retry)
+
+            cursor.execute(
+                'DELETE FROM {} WHERE new_table = %s AND name = %s;'.format(
+                    DEFERRED_TABLE_NAME),
+                [table, deferred_object.name])
+
+            instrumentation.emit('index_restored', new_table=table,
+                                 name=deferred_object.name,
+                                 kind=deferred_object.kind,
+                                 duration=round(time.time() - started_at, 3))
+
+        if analyze:
+            started_at = time.time()
+            cursor.execute('ANALYZE {};'.format(table))
+            instrumentation.emit('table_analyzed', new_table=table,
+                                 duration=round(time.time() - started_at, 3))
+
+    return len(deferred)
@@ -0,0 +1,91 @@
+"""
+Instrumentation of the table duplication.
+
+Every event is logged through structlog, sent as the
+`removalist.signals.duplication_event` signal and passed to the hooks listed
+in the ``REMOVALIST_METRICS_HOOKS`` setting. A hook is the dotted path to a
+callable that is called with the event name and the event data as keyword
+arguments, e.g. to forward them to a metrics backend::
+
+    REMOVALIST_METRICS_HOOKS = ['myproject.metrics.forward_removalist_event']
+
+Events emitted from the parallel backfill are sent from the worker threads.
+"""
+import time
+
+import structlog
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .signals import duplication_event
+
+log = structlog.get_logger(__name__)
+
+
+def get_hooks():
+    return [import_string(path)
+            for path in getattr(settings, 'REMOVALIST_METRICS_HOOKS', [])]
+
+
+def emit(event, **data):
+    log.info(event, **data)
+
+    duplication_event.send(sender=None, event=event, **data)
+
+    for hook in get_hooks():
+        try:
+            hook(event, **data)
+        except Exception:
+            log.exception('metrics hook failed', metrics_event=event,
+                          hook=hook)
+
+
+def get_table_data(old_model, new_model):
+    return {'old_table': old_model._meta.db_table,
+            'new_table': new_model._meta.db_table}
+
+
+def get_estimated_row_count(connection, model):
+    """
+    Return the number of rows in the table of *model* as estimated by the
+    planner statistics in ``pg_class.reltuples``. This is cheap to look up
+    but only as accurate as the last ``ANALYZE``.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class '
+                       'WHERE oid = %s::regclass;',
+                       [model._meta.db_table])
+        row = cursor.fetchone()
+
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def get_eta(rows_done, estimated_total, elapsed):
+    """
+    Return the estimated number of seconds left until *estimated_total* rows
+    are done, based on the rate of the *rows_done* in *elapsed* seconds.
+    """
+    if not (estimated_total and rows_done and elapsed):
+        return None
+
+    rows_left = max(estimated_total - rows_done, 0)
+    return round(rows_left / (rows_done / elapsed), 1)
+
+
+def execute_timed(schema_editor, statement, name, **data):
+    """
+    Execute *statement* using *schema_editor* and emit a
+    ``statement_executed`` event with its duration. Returns the duration in
+    seconds.
+    """
+    started_at = time.time()
+    schema_editor.execute(statement)
+    duration = time.time() - started_at
+
+    emit('statement_executed', statement=name, duration=round(duration, 6),
+         **data)
+
+    return duration
@@ -0,0 +1,164 @@
+"""
+Bounded lock waits for the transactions taking table locks.
+
+Creating and dropping triggers, locking a table for the copy or adding a
+foreign key all need a lock that conflicts with the writes on the table.
+While such a statement waits for a long-running query to release its locks,
+every new query on the table queues up behind it. A `LockRetry` sets a short
+``lock_timeout`` in the transaction, so it gives up instead, rolls back and
+is retried after a jittered, exponentially growing delay, giving the queued
+queries a chance to run in between.
+
+The retries are configured per operation with *lock_retry*, or for all
+operations with the ``REMOVALIST_LOCK_RETRY`` setting, either ``True`` for
+the defaults or a dict of `LockRetry` arguments::
+
+    REMOVALIST_LOCK_RETRY = {'lock_timeout': 1.0, 'max_attempts': 20}
+
+Rolling back would discard everything done earlier in an enclosing
+transaction, so retried operations have to run in migrations marked as
+``atomic = False``.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.transaction import TransactionManagementError
+
+from . import instrumentation
+
+DEFAULT_LOCK_TIMEOUT = 2.0
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_MIN_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+
+# SQLSTATE of a lock that couldn't be acquired within lock_timeout.
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def is_lock_timeout(exc):
+    """
+    Return whether the database error *exc*, as raised by Django or by the
+    driver, has been caused by the ``lock_timeout``.
+    """
+    for error in (exc, exc.__cause__):
+        if getattr(error, 'pgcode', None) == LOCK_NOT_AVAILABLE:
+            return True
+    return False
+
+
+class LockRetry(object):
+    """
+    Run transactions with a ``lock_timeout`` of *lock_timeout* seconds, up
+    to *max_attempts* times. After a lock timeout, the next attempt waits
+    between *min_delay* and *max_delay* seconds, doubling with each attempt
+    and randomized by up to half the delay so that concurrent migrations
+    don't retry in lockstep.
+    """
+
+    def __init__(self, lock_timeout=DEFAULT_LOCK_TIMEOUT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 min_delay=DEFAULT_MIN_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        if max_attempts < 1:
+            raise ValueError('max_attempts has to be a positive integer')
+
+        self.lock_timeout = lock_timeout
+        self.max_attempts = max_attempts
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        delay = min(self.min_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay - random.uniform(0, delay / 2)
+
+    def run(self, execute, transaction, begin='BEGIN;', connection=None,
+            **data):
+        """
+        Run the callable *transaction* between *begin* and a commit, both
+        executed with *execute*, e.g. ``schema_editor.execute``. Everything
+        *transaction* executes has to be in the database, as it is called
+        again after a lock timeout rolled the transaction back. The *data*
+        is added to the emitted ``lock_timeout`` events. Re-raises the lock
+        timeout of the last attempt, other errors are raised after rolling
+        back right away.
+
+        A rollback would discard everything done earlier in an enclosing
+        transaction as well, so `TransactionManagementError` is raised if
+        the *connection* is in an atomic block, e.g. of a migration that
+        isn't marked as ``atomic = False``.
+        """
+        if connection is not None and connection.in_atomic_block:
+            raise TransactionManagementError(
+                'Transactions retried on lock timeouts can\'t run in an '
+                'atomic block, mark the migration as atomic = False.')
+
+        for attempt in range(1, self.max_attempts + 1):
+            execute(begin)
+            execute("SET LOCAL lock_timeout = '{}ms';".format(
+                int(self.lock_timeout * 1000)))
+
+            try:
+                result = transaction()
+            except Exception as exc:
+                execute('ROLLBACK;')
+
+                if not (isinstance(exc, DatabaseError) and
+                        is_lock_timeout(exc)):
+                    raise
+
+                if attempt == self.max_attempts:
+                    instrumentation.emit('lock_retries_exhausted',
+                                         attempts=attempt, **data)
+                    raise
+
+                delay = self.get_delay(attempt)
+                instrumentation.emit('lock_timeout', attempt=attempt,
+                                     delay=round(delay, 3), **data)
+                time.sleep(delay)
+            else:
+                execute('COMMIT;')
+                return result
+
+
+def get_lock_retry(options=None):
+    """
+    Return the `LockRetry` for the *options* of an operation, falling back
+    to the ``REMOVALIST_LOCK_RETRY`` setting, or ``None`` for lock waits
+    without a timeout.
+    """
+    if options is None:
+        options = getattr(settings, 'REMOVALIST_LOCK_RETRY', None)
+
+    if not options:
+        return None
+    if isinstance(options, LockRetry):
+        return options
+    if options is True:
+        return LockRetry()
+    return LockRetry(**options)
+
+
+def run_transaction(execute, transaction, lock_retry=None, begin='BEGIN;',
+                    connection=None, **data):
+    """
+    Run the callable *transaction* between *begin* and a commit executed
+    with *execute*, retrying it on lock timeouts according to the
+    *lock_retry* options (see `get_lock_retry`), which requires the
+    *connection* to be outside of an atomic block (see `LockRetry.run`).
+    Rolls back before re-raising errors. Returns the result of
+    *transaction*.
+    """
+    retry = get_lock_retry(lock_retry)
+    if retry is not None:
+        return retry.run(execute, transaction, begin=begin,
+                         connection=connection, **data)
+
+    execute(begin)
+    try:
+        result = transaction()
+    except Exception:
+        execute('ROLLBACK;')
+        raise
+    execute('COMMIT;')
+    return result
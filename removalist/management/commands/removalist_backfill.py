@@ -0,0 +1,127 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from removalist import backfill, builder, checkpoint, indexes
+
+
+def get_model_by_table(db_table):
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.db_table == db_table:
+            return model
+
+    raise CommandError('No model with the table {}.'.format(db_table))
+
+
+class Command(BaseCommand):
+    help = ("Run the backfill registered by a CreateTableDuplication "
+            "operation with defer_backfill=True, or continue an interrupted "
+            "resumable backfill from its checkpoint. The triggers created "
+            "by the operation have to be in place.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('old_model_name', nargs='?',
+                            help='The duplicated model as app_label.Model')
+        parser.add_argument('new_model_name', nargs='?',
+                            help='The new model as app_label.Model')
+        parser.add_argument('--all', action='store_true',
+                            help='Run all backfills that have not finished')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report the status of all backfills')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of both tables')
+        parser.add_argument('--batch-size', type=int,
+                            default=backfill.DEFAULT_BATCH_SIZE,
+                            help='Number of rows copied per transaction')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of ranges copied concurrently, the '
+                                 'ranges are then bounded by primary keys '
+                                 'instead of rows')
+        parser.add_argument('--online', action='store_true',
+                            help='Keep rows already written by the upserting '
+                                 'triggers of an online duplication')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Adapt the batch size and pause the copy '
+                                 'depending on the database load')
+        parser.add_argument('--column-map', action='append', default=[],
+                            metavar='COLUMN=EXPRESSION',
+                            help='Column mapping of the duplication, can be '
+                                 'repeated')
+        parser.add_argument('--partition-column', action='append',
+                            default=[], dest='partition_columns',
+                            help='Partition key column of the new table, can '
+                                 'be repeated')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        if options['status']:
+            self.write_status(connection)
+            return
+
+        try:
+            mapping = builder.get_mapping(
+                builder.parse_column_map(options['column_map']),
+                options['partition_columns'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['all']:
+            model_pairs = [
+                (get_model_by_table(job.old_table),
+                 get_model_by_table(job.new_table))
+                for job in checkpoint.get_backfill_jobs(
+                    connection, unfinished_only=True)]
+
+            if mapping and len(model_pairs) > 1:
+                raise CommandError('A column mapping can only be used for a '
+                                   'single backfill.')
+        elif options['old_model_name'] and options['new_model_name']:
+            model_pairs = [(apps.get_model(options['old_model_name']),
+                            apps.get_model(options['new_model_name']))]
+        else:
+            raise CommandError('Pass the old and new model name or --all.')
+
+        for old_model, new_model in model_pairs:
+            self.run_backfill(connection, old_model, new_model, mapping,
+                              options)
+
+    def run_backfill(self, connection, old_model, new_model, mapping,
+                     options):
+        state = checkpoint.get_checkpoint(connection, old_model, new_model)
+        if state is None:
+            raise CommandError(
+                'No backfill checkpoint for {} -> {}, the duplication has to '
+                'be created with resumable=True or defer_backfill=True.'.format(
+                    old_model._meta.db_table, new_model._meta.db_table))
+
+        rows_copied = backfill.copy_model_data(
+            connection, old_model, new_model, options['batch_size'],
+            keep_existing=options['online'], workers=options['workers'],
+            resumable=True, throttle_options=options['throttle'],
+            mapping=mapping, keyset=True)
+
+        state = checkpoint.get_checkpoint(connection, old_model, new_model)
+        self.stdout.write('{} -> {}: copied {} rows, {} rows in total.'.format(
+            old_model._meta.db_table, new_model._meta.db_table, rows_copied,
+            state.rows_copied))
+
+        # Restore the indexes deferred by a duplication with
+        # defer_indexes=True.
+        if indexes.get_deferred_objects(connection, new_model._meta.db_table):
+            restored = indexes.restore_indexes(connection, new_model)
+            self.stdout.write('Restored {} deferred indexes and '
+                              'constraints.'.format(restored))
+
+    def write_status(self, connection):
+        jobs = checkpoint.get_backfill_jobs(connection)
+        if not jobs:
+            self.stdout.write('No backfills.')
+            return
+
+        for job in jobs:
+            self.stdout.write(
+                '{} -> {}: {}, {} rows copied, last primary key {}, updated '
+                '{}'.format(job.old_table, job.new_table,
+                            'finished' if job.finished else 'pending',
+                            job.rows_copied, job.last_pk, job.updated_at))
@@ -0,0 +1,152 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.exceptions import AmbiguityError
+from django.db.migrations.loader import MigrationLoader
+
+from removalist import planner
+from removalist.operations import (CreateTableDuplication, get_batch_size,
+                                   get_model_pairs)
+
+
+def format_size(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return '{:.0f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} TB'.format(size)
+
+
+def format_duration(duration):
+    if duration is None:
+        return 'brief'
+    return '{:.3f}s'.format(duration)
+
+
+class Command(BaseCommand):
+    help = ("Plan the CreateTableDuplication operations of a migration "
+            "without running them: report the table sizes, the query plan "
+            "of the copy and the locks that will be taken, with durations "
+            "estimated from copying a few sample ranges in transactions "
+            "that are rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label',
+                            help='App label of the migration')
+        parser.add_argument('migration_name',
+                            help='Name of the migration, a unique prefix is '
+                                 'enough')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of the tables')
+        parser.add_argument('--samples', type=int,
+                            default=planner.DEFAULT_SAMPLES,
+                            help='Number of primary key ranges copied to '
+                                 'time the copy, 0 to skip')
+        parser.add_argument('--json', action='store_true',
+                            help='Output the plans as JSON')
+        parser.add_argument('--sql', action='store_true',
+                            help='Include the generated SQL statements')
+
+    def get_operations(self, loader, app_label, migration_name):
+        try:
+            migration = loader.get_migration_by_prefix(app_label,
+                                                       migration_name)
+        except (AmbiguityError, KeyError) as exc:
+            raise CommandError(str(exc))
+
+        # Operations are planned with the models as they are right before
+        # the operation, like when the migration is applied.
+        state = loader.project_state((migration.app_label, migration.name),
+                                     at_end=False)
+
+        for operation in migration.operations:
+            if isinstance(operation, CreateTableDuplication):
+                yield operation, state.clone()
+            operation.state_forwards(migration.app_label, state)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        loader = MigrationLoader(connection)
+
+        plans = []
+        for operation, state in self.get_operations(
+                loader, options['app_label'], options['migration_name']):
+            for old_model, new_model in get_model_pairs(
+                    state, operation.model_name_pairs):
+                plans.append(planner.plan_model_pair(
+                    connection, old_model, new_model,
+                    batch_size=get_batch_size(
+                        operation.batch_size, online=operation.online,
+                        workers=operation.workers,
+                        resumable=operation.resumable,
+                        throttle=operation.throttle,
+                        asynchronous=operation.asynchronous,
+                        defer_indexes=operation.defer_indexes,
+                        logical_decoding=operation.logical_decoding),
+                    online=operation.online,
+                    statement_triggers=operation.statement_triggers,
+                    mapping=operation.mapping,
+                    samples=options['samples']))
+
+        if not plans:
+            raise CommandError('No CreateTableDuplication operations found.')
+
+        if not options['sql']:
+            for plan in plans:
+                del plan['statements']
+
+        if options['json']:
+            self.stdout.write(json.dumps(plans, indent=2, default=str))
+            return
+
+        for plan in plans:
+            self.write_plan(plan)
+
+    def write_plan(self, plan):
+        self.stdout.write('{old_table} -> {new_table}'.format(**plan))
+
+        for key in ('old_table', 'new_table'):
+            stats = plan['{}_stats'.format(key)]
+            if stats is None:
+                self.stdout.write('  {}: does not exist yet'.format(
+                    plan[key]))
+                continue
+
+            self.stdout.write(
+                '  {}: ~{} rows, {} table, {} total, {} indexes'.format(
+                    plan[key], stats['estimated_rows'],
+                    format_size(stats['table_size']),
+                    format_size(stats['total_size']), stats['indexes']))
+
+        if plan['batch_size']:
+            self.stdout.write('  Copy in {} batches of {} primary keys'.format(
+                plan['batches'], plan['batch_size']))
+        else:
+            self.stdout.write('  Copy in one statement while locked')
+
+        if plan['sample']:
+            self.stdout.write(
+                '  Sampled {ranges} ranges: {rows} rows in '
+                '{duration:.3f}s'.format(**plan['sample']))
+            self.stdout.write('  Estimated copy duration: {}'.format(
+                format_duration(plan['estimated_copy_duration'])))
+
+        self.stdout.write('  Locks (waiting up to {} for the oldest open '
+                          'transaction):'.format(
+                              format_duration(plan['estimated_lock_wait'])))
+        for lock in plan['locks']:
+            self.stdout.write('    {phase}: {mode} on {table}, '.format(
+                **lock) + format_duration(lock['duration']))
+
+        if plan['explain']:
+            self.stdout.write('  Query plan:')
+            for line in plan['explain'].splitlines():
+                self.stdout.write('    ' + line)
+
+        for name, statements in sorted(plan.get('statements', {}).items()):
+            if not isinstance(statements, list):
+                statements = [statements]
+            self.stdout.write('  SQL ({}):'.format(name))
+            for statement in statements:
+                self.stdout.write(statement)
@@ -0,0 +1,93 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from removalist import builder, changelog, decoding
+
+
+class Command(BaseCommand):
+    help = ("Apply the changes recorded for an asynchronous table "
+            "duplication, or decoded from the replication slot of a "
+            "duplication with logical decoding, to the new table, reporting "
+            "the sync lag, until interrupted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('old_model_name',
+                            help='The duplicated model as app_label.Model')
+        parser.add_argument('new_model_name',
+                            help='The new model as app_label.Model')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of both tables')
+        parser.add_argument('--batch-size', type=int,
+                            default=changelog.DEFAULT_CHANGELOG_BATCH_SIZE,
+                            help='Number of changelog entries or decoded '
+                                 'changes applied per transaction')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait for new changes once the '
+                                 'changelog is drained')
+        parser.add_argument('--until-caught-up', action='store_true',
+                            help='Exit once the changelog is drained')
+        parser.add_argument('--timeout', type=float, default=None,
+                            help='Give up catching up after this many '
+                                 'seconds, together with --until-caught-up')
+        parser.add_argument('--column-map', action='append', default=[],
+                            metavar='COLUMN=EXPRESSION',
+                            help='Column mapping of the duplication, can be '
+                                 'repeated')
+        parser.add_argument('--partition-column', action='append',
+                            default=[], dest='partition_columns',
+                            help='Partition key column of the new table, can '
+                                 'be repeated')
+
+    def handle(self, *args, **options):
+        old_model = apps.get_model(options['old_model_name'])
+        new_model = apps.get_model(options['new_model_name'])
+
+        connection = connections[options['database']]
+
+        try:
+            mapping = builder.get_mapping(
+                builder.parse_column_map(options['column_map']),
+                options['partition_columns'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if decoding.slot_exists(connection, old_model, new_model):
+            sync, apply_batch = decoding, decoding.apply_decoded_batch
+        elif changelog.changelog_exists(connection, old_model, new_model):
+            sync, apply_batch = changelog, changelog.apply_changelog_batch
+        else:
+            raise CommandError(
+                'No changelog or replication slot for {} -> {}, the '
+                'duplication has to be created with asynchronous=True or '
+                'logical_decoding=True.'.format(
+                    old_model._meta.db_table, new_model._meta.db_table))
+
+        if options['until_caught_up']:
+            if not sync.wait_until_caught_up(
+                    connection, old_model, new_model,
+                    timeout=options['timeout'],
+                    batch_size=options['batch_size'], mapping=mapping):
+                raise CommandError('Sync did not catch up within {} '
+                                   'seconds.'.format(options['timeout']))
+
+            self.stdout.write('Sync caught up.')
+            return
+
+        reported_at = None
+
+        while True:
+            applied = apply_batch(connection, old_model, new_model,
+                                  options['batch_size'], mapping)
+
+            # Report the lag at most once per interval, counting the pending
+            # entries isn't free.
+            if reported_at is None or (time.time() - reported_at >
+                                       options['interval']):
+                sync.emit_sync_lag(connection, old_model, new_model)
+                reported_at = time.time()
+
+            if applied < options['batch_size']:
+                time.sleep(options['interval'])
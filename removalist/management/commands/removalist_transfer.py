@@ -0,0 +1,57 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from removalist import transfer
+
+
+class Command(BaseCommand):
+    help = ("Stream the data of a model's table into the table of another "
+            "model in a different database using binary COPY and keep it in "
+            "sync from a changelog until --finish is passed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('old_model_name',
+                            help='The model to copy from as app_label.Model')
+        parser.add_argument('new_model_name',
+                            help='The model to copy to as app_label.Model')
+        parser.add_argument('--source', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of the old table')
+        parser.add_argument('--target', required=True,
+                            help='Database alias of the new table')
+        parser.add_argument('--batch-size', type=int,
+                            default=transfer.DEFAULT_CATCH_UP_BATCH_SIZE,
+                            help='Number of changelog entries per catch-up '
+                                 'batch')
+        parser.add_argument('--max-chunks', type=int,
+                            default=transfer.DEFAULT_MAX_CHUNKS,
+                            help='Number of COPY data chunks buffered in '
+                                 'memory between the databases')
+        parser.add_argument('--catch-up-only', action='store_true',
+                            help='Only apply the changes recorded since the '
+                                 'last run')
+        parser.add_argument('--finish', action='store_true',
+                            help='Apply the remaining changes and remove the '
+                                 'changelog trigger')
+
+    def handle(self, *args, **options):
+        old_model = apps.get_model(options['old_model_name'])
+        new_model = apps.get_model(options['new_model_name'])
+
+        source = connections[options['source']]
+        target = connections[options['target']]
+
+        if options['catch_up_only'] or options['finish']:
+            entries = transfer.catch_up(source, target, old_model, new_model,
+                                        options['batch_size'],
+                                        options['max_chunks'])
+        else:
+            entries = transfer.transfer_model_data(
+                old_model, new_model, options['source'], options['target'],
+                options['batch_size'], options['max_chunks'])
+
+        self.stdout.write('Applied {} changelog entries.'.format(entries))
+
+        if options['finish']:
+            transfer.stop_capture(source, old_model, new_model)
+            self.stdout.write('Removed changelog trigger.')
@@ -0,0 +1,67 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from removalist import trigger_stats
+
+COLUMNS = ('old_table', 'new_table', 'event', 'calls', 'total_time',
+           'self_time', 'mean_time')
+
+
+class Command(BaseCommand):
+    help = ("Report the calls and execution time in milliseconds of the "
+            "triggers syncing duplicated tables, per table and event, from "
+            "pg_stat_user_functions. This requires track_functions to be "
+            "set to 'pl' or 'all'.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of the tables')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Report the cost over this many seconds '
+                                 'instead of since the last statistics reset')
+        parser.add_argument('--format', choices=('text', 'json', 'csv'),
+                            default='text', help='Output format')
+        parser.add_argument('--emit', action='store_true',
+                            help='Also emit a trigger_cost event per trigger '
+                                 'to the metrics hooks')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        track_functions = trigger_stats.get_track_functions(connection)
+        if track_functions == 'none':
+            raise CommandError(
+                "track_functions is 'none', the trigger functions are not "
+                "tracked. Set it to 'pl' to collect their statistics.")
+
+        costs = trigger_stats.get_trigger_costs(connection)
+        if options['interval']:
+            time.sleep(options['interval'])
+            costs = trigger_stats.get_cost_difference(
+                costs, trigger_stats.get_trigger_costs(connection))
+
+        if options['emit']:
+            trigger_stats.emit_trigger_costs(costs,
+                                             interval=options['interval'])
+
+        rows = [trigger_stats.get_cost_data(cost) for cost in costs]
+
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(rows, indent=2))
+        elif options['format'] == 'csv':
+            writer = csv.DictWriter(self.stdout, COLUMNS,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        elif not rows:
+            self.stdout.write('No removalist triggers.')
+        else:
+            for row in rows:
+                self.stdout.write(
+                    '{old_table} -> {new_table} {event}: {calls} calls, '
+                    '{total_time} ms total, {self_time} ms self, '
+                    '{mean_time} ms per call'.format(**row))
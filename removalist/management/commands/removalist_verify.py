@@ -0,0 +1,65 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from removalist import verify
+
+
+class Command(BaseCommand):
+    help = ("Compare the data in the table of a model with the table it is "
+            "duplicated into, e.g. before releasing the triggers. Exits with "
+            "an error if the tables differ.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('old_model_name',
+                            help='The duplicated model as app_label.Model')
+        parser.add_argument('new_model_name',
+                            help='The new model as app_label.Model')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias of both tables')
+        parser.add_argument('--batch-size', type=int,
+                            default=verify.DEFAULT_VERIFY_BATCH_SIZE,
+                            help='Number of primary keys per compared range')
+        parser.add_argument('--workers', type=int,
+                            default=verify.DEFAULT_VERIFY_WORKERS,
+                            help='Number of ranges compared concurrently')
+        parser.add_argument('--row-compare-size', type=int,
+                            default=verify.DEFAULT_ROW_COMPARE_SIZE,
+                            help='Size of mismatching ranges that are '
+                                 'compared row by row')
+        parser.add_argument('--max-reported', type=int, default=20,
+                            help='Number of differing primary keys listed '
+                                 'per kind of difference')
+
+    def handle(self, *args, **options):
+        old_model = apps.get_model(options['old_model_name'])
+        new_model = apps.get_model(options['new_model_name'])
+
+        report = verify.verify_model_data(
+            connections[options['database']], old_model, new_model,
+            options['batch_size'], options['workers'],
+            options['row_compare_size'])
+
+        self.stdout.write('Checked {} ranges, {} mismatching.'.format(
+            report.ranges_checked, report.mismatched_ranges))
+
+        differences = [('Missing in new table', report.missing_pks),
+                       ('Only in new table', report.extra_pks),
+                       ('Changed', report.changed_pks)]
+
+        for label, pks in differences:
+            if not pks:
+                continue
+
+            listed = ', '.join(str(pk) for pk in pks[:options['max_reported']])
+            if len(pks) > options['max_reported']:
+                listed += ', ...'
+
+            self.stdout.write('{} ({} rows): {}'.format(label, len(pks),
+                                                        listed))
+
+        if not verify.is_consistent(report):
+            raise CommandError('{} and {} differ.'.format(
+                old_model._meta.db_table, new_model._meta.db_table))
+
+        self.stdout.write('Tables are consistent.')
@@ -1,50 +1,783 @@
+import time
+
 import structlog
 
 from django.db.migrations.operations.base import Operation
+from django.db.migrations.state import StateApps
 
-from . import builder
+from . import (backfill, builder, changelog, checkpoint, cutover, decoding,
+               foreign_keys, indexes, instrumentation, locking)
 
 log = structlog.get_logger('removalist.operations')
 
 
-def execute_create_triggers(schema_editor, old_model, new_model):
+class SQLNotCollectable(Exception):
+    """
+    Raised when the SQL of an operation that runs statements through its own
+    connection, e.g. to copy data in batches, is collected by
+    ``sqlmigrate``.
+    """
+
+
+def check_collect_sql(schema_editor, description):
+    """
+    Raise `SQLNotCollectable` if *schema_editor* only collects the SQL of
+    the migration instead of executing it. Statements that don't go through
+    `schema_editor.execute` would otherwise be run against the database.
+    """
+    if schema_editor.collect_sql:
+        raise SQLNotCollectable(
+            '{} runs statements outside of the schema editor and can\'t be '
+            'shown as SQL, apply the migration with migrate '
+            'instead.'.format(description))
+
+
+def create_triggers(schema_editor, old_model, new_model, upsert=False,
+                    statement_level=False, changed_columns_only=False,
+                    mapping=None):
+    """
+    Execute the statements creating the insert, update and delete triggers
+    that sync the table of *old_model* into the table of *new_model*,
+    according to the *mapping* of a differently shaped new table (see
+    `builder.get_mapping`). This doesn't start or commit a transaction.
+    """
+    tables = instrumentation.get_table_data(old_model, new_model)
+    mapping = mapping or {}
+
+    instrumentation.execute_timed(
+        schema_editor,
+        builder.create_insert_trigger(old_model, new_model, upsert=upsert,
+                                      statement_level=statement_level,
+                                      **mapping),
+        'create_insert_trigger', **tables)
+    instrumentation.execute_timed(
+        schema_editor,
+        builder.create_update_trigger(
+            old_model, new_model, upsert=upsert,
+            statement_level=statement_level,
+            changed_columns_only=changed_columns_only, **mapping),
+        'create_update_trigger', **tables)
+    instrumentation.execute_timed(
+        schema_editor,
+        builder.create_delete_trigger(old_model, new_model,
+                                      statement_level=statement_level,
+                                      **mapping),
+        'create_delete_trigger', **tables)
+
+
+def execute_create_triggers(schema_editor, old_model, new_model,
+                            batch_size=None, online=False,
+                            statement_triggers=False,
+                            changed_columns_only=False, workers=None,
+                            resumable=False, throttle=None,
+                            asynchronous=False, mapping=None,
+                            defer_indexes=False, defer_backfill=False,
+                            lock_retry=None, logical_decoding=False):
     """
     Execute all the SQL statements required to copy data between the tables
     underlying the *old_model* and *new_model*. This will create a new
     transaction and imposes a write lock on the entire table for the duration
     of the data sync and setup of the triggers.
+
+    If *batch_size* is given, the triggers are set up first and the existing
+    data is copied afterwards in ranges of *batch_size* primary keys, each of
+    them committed separately. No table lock is held during the copy.
+
+    With *online* set, the insert and update triggers upsert into the new
+    table and the batched copy skips rows that the triggers already wrote,
+    so concurrent updates never wait for the copy. *batch_size* defaults to
+    `backfill.DEFAULT_BATCH_SIZE` in this mode.
+
+    Setting *statement_triggers* creates ``FOR EACH STATEMENT`` triggers that
+    sync all rows changed by a statement at once instead of row by row.
+    *changed_columns_only* makes the update trigger only write the columns
+    that have changed.
+
+    With more than one of *workers*, the batched copy is split across that
+    many threads, each using a separate database connection.
+
+    With *resumable* set, the batched copy stores its progress in the
+    checkpoint table. When run again after being interrupted, the triggers
+    are kept and the copy continues after the last committed range.
+
+    *throttle* enables load-aware throttling of the batched copy, either
+    with the defaults if ``True`` or with a dict of `throttle.Throttle`
+    arguments.
+
+    With *asynchronous* set, a changelog trigger is created instead of the
+    sync triggers and the changes recorded during the batched copy are
+    applied at the end (see `changelog`).
+
+    With *logical_decoding* set, no triggers are created at all. The changes
+    to the old table are read from a logical replication slot created
+    before the batched copy and applied at the end (see `decoding`).
+
+    A *mapping* (see `builder.get_mapping`) describes how the rows are
+    written to a new table with different columns or a partition key, both
+    by the triggers and by the copy.
+
+    With *defer_indexes* set, the secondary indexes and foreign keys of the
+    new table are dropped before the batched copy and re-created afterwards
+    without blocking writes (see `indexes`).
+
+    With *defer_backfill* set, only the triggers are created and the
+    backfill is registered in the checkpoint table, to be run by the
+    ``removalist_backfill`` management command.
+
+    The transactions taking table locks give up waiting for them after a
+    ``lock_timeout`` and are retried according to *lock_retry* (see
+    `locking.get_lock_retry`).
+
+    The progress is reported through `instrumentation.emit`.
+    """
+    execute_create_triggers_for_pairs(
+        schema_editor, [(old_model, new_model)], batch_size=batch_size,
+        online=online, statement_triggers=statement_triggers,
+        changed_columns_only=changed_columns_only, workers=workers,
+        resumable=resumable, throttle=throttle, asynchronous=asynchronous,
+        mapping=mapping, defer_indexes=defer_indexes,
+        defer_backfill=defer_backfill, lock_retry=lock_retry,
+        logical_decoding=logical_decoding)
+
+
+def get_lock_data(step, model_pairs):
+    return {'step': step,
+            'old_tables': [old_model._meta.db_table
+                           for old_model, _ in model_pairs]}
+
+
+def get_batch_size(batch_size, online=False, workers=None, resumable=False,
+                   throttle=None, asynchronous=False, defer_indexes=False,
+                   logical_decoding=False):
+    """
+    Return the batch size used by `execute_create_triggers` with the given
+    options, ``None`` for a copy of the whole table while it is locked.
     """
-    schema_editor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ;')
+    if (online or resumable or throttle or asynchronous or defer_indexes or
+            logical_decoding or (workers and workers > 1)):
+        return batch_size or backfill.DEFAULT_BATCH_SIZE
 
-    # We want to acquire an exclusive lock on the old table while we are copying
-    # the data over to the new table, avoiding entries being added before the
-    # new triggers are being setup.
-    schema_editor.execute(
-        'LOCK TABLE {} IN EXCLUSIVE MODE;'.format(old_model._meta.db_table))
+    return batch_size
 
-    schema_editor.execute(builder.copy_model_data(old_model, new_model))
 
-    schema_editor.execute(builder.create_insert_trigger(old_model, new_model))
-    schema_editor.execute(builder.create_update_trigger(old_model, new_model))
-    schema_editor.execute(builder.create_delete_trigger(old_model, new_model))
+def execute_create_triggers_for_pairs(schema_editor, model_pairs,
+                                      batch_size=None, online=False,
+                                      statement_triggers=False,
+                                      changed_columns_only=False,
+                                      workers=None, resumable=False,
+                                      throttle=None, asynchronous=False,
+                                      mapping=None, defer_indexes=False,
+                                      defer_backfill=False, lock_retry=None,
+                                      logical_decoding=False):
+    """
+    Same as `execute_create_triggers` for a list of ``(old_model,
+    new_model)`` *model_pairs*. The triggers of all pairs are created in a
+    single transaction and the data is copied in the order of the foreign
+    keys between the new tables. In the batched modes, the data of pairs that
+    don't depend on each other is copied concurrently.
+    """
+    if len(model_pairs) > 1:
+        model_pairs = [pair
+                       for level in backfill.get_backfill_levels(model_pairs)
+                       for pair in level]
+
+    started_at = time.time()
+
+    # The checkpoint of a deferred backfill is the record of the job.
+    resumable = resumable or defer_backfill
+
+    batch_size = get_batch_size(batch_size, online=online, workers=workers,
+                                resumable=resumable, throttle=throttle,
+                                asynchronous=asynchronous,
+                                defer_indexes=defer_indexes,
+                                logical_decoding=logical_decoding)
+
+    for old_model, new_model in model_pairs:
+        instrumentation.emit(
+            'duplication_started', batch_size=batch_size, online=online,
+            workers=workers,
+            **instrumentation.get_table_data(old_model, new_model))
+
+    if batch_size:
+        connection = schema_editor.connection
+        check_collect_sql(schema_editor, 'A batched backfill')
+
+        if defer_indexes:
+            indexes.create_deferred_table(connection)
+
+        started_pairs = []
+        if resumable:
+            checkpoint.create_checkpoint_table(connection)
+
+            # A checkpoint is created together with the triggers, so pairs
+            # that have one already had their triggers created by an
+            # earlier run that has been interrupted.
+            started_pairs = [
+                (old_model, new_model) for old_model, new_model in model_pairs
+                if checkpoint.get_checkpoint(connection, old_model,
+                                             new_model) is not None]
+
+        # The slot has to be created before the copy starts, outside of a
+        # transaction that writes. A slot left behind by an interrupted run
+        # has recorded all changes since and is kept.
+        if logical_decoding:
+            decoding.check_logical_decoding(connection)
+            for old_model, new_model in model_pairs:
+                decoding.create_slot(connection, old_model, new_model)
+
+        def setup_pairs():
+            for old_model, new_model in model_pairs:
+                if (old_model, new_model) in started_pairs:
+                    log.info('resuming backfill',
+                             **instrumentation.get_table_data(old_model,
+                                                              new_model))
+                    continue
+
+                if defer_indexes:
+                    indexes.defer_indexes(connection, new_model)
+
+                if asynchronous:
+                    changelog.create_changelog(schema_editor, old_model,
+                                               new_model)
+                elif not logical_decoding:
+                    create_triggers(schema_editor, old_model, new_model,
+                                    upsert=online,
+                                    statement_level=statement_triggers,
+                                    changed_columns_only=changed_columns_only,
+                                    mapping=mapping)
+                if resumable:
+                    checkpoint.start_checkpoint(schema_editor, old_model,
+                                                new_model)
+
+        locking.run_transaction(
+            schema_editor.execute, setup_pairs, lock_retry,
+            connection=schema_editor.connection,
+            **get_lock_data('create_triggers', model_pairs))
+
+        if defer_backfill:
+            for old_model, new_model in model_pairs:
+                instrumentation.emit(
+                    'backfill_registered',
+                    **instrumentation.get_table_data(old_model, new_model))
+            return
 
-    schema_editor.execute('COMMIT;')
+        backfill.copy_model_pairs(schema_editor.connection, model_pairs,
+                                  batch_size,
+                                  keep_existing=online and not (
+                                      asynchronous or logical_decoding),
+                                  workers=workers, resumable=resumable,
+                                  throttle_options=throttle, mapping=mapping)
 
+        if asynchronous:
+            for old_model, new_model in model_pairs:
+                changelog.apply_changelog(schema_editor.connection,
+                                          old_model, new_model,
+                                          mapping=mapping)
+        elif logical_decoding:
+            for old_model, new_model in model_pairs:
+                decoding.apply_decoded_changes(connection, old_model,
+                                               new_model, mapping=mapping)
 
-def execute_drop_triggers(schema_editor, old_model, new_model):
+        if defer_indexes:
+            for old_model, new_model in model_pairs:
+                indexes.restore_indexes(connection, new_model,
+                                        lock_retry=lock_retry)
+    else:
+        def copy_pairs():
+            # We want to acquire an exclusive lock on the old table while we
+            # are copying the data over to the new table, avoiding entries
+            # being added before the new triggers are being setup.
+            for old_model, new_model in model_pairs:
+                tables = instrumentation.get_table_data(old_model, new_model)
+
+                lock_wait_time = instrumentation.execute_timed(
+                    schema_editor,
+                    'LOCK TABLE {} IN EXCLUSIVE MODE;'.format(
+                        old_model._meta.db_table),
+                    'lock_table', **tables)
+                instrumentation.emit('lock_acquired', mode='EXCLUSIVE',
+                                     lock_wait_time=round(lock_wait_time, 6),
+                                     **tables)
+
+            for old_model, new_model in model_pairs:
+                instrumentation.execute_timed(
+                    schema_editor,
+                    builder.copy_model_data(old_model, new_model,
+                                            **(mapping or {})),
+                    'copy_model_data',
+                    **instrumentation.get_table_data(old_model, new_model))
+
+            for old_model, new_model in model_pairs:
+                create_triggers(schema_editor, old_model, new_model,
+                                statement_level=statement_triggers,
+                                changed_columns_only=changed_columns_only,
+                                mapping=mapping)
+
+        locking.run_transaction(
+            schema_editor.execute, copy_pairs, lock_retry,
+            begin='BEGIN ISOLATION LEVEL REPEATABLE READ;',
+            connection=schema_editor.connection,
+            **get_lock_data('copy', model_pairs))
+
+    for old_model, new_model in model_pairs:
+        instrumentation.emit(
+            'duplication_finished',
+            duration=round(time.time() - started_at, 3),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def execute_drop_triggers(schema_editor, old_model, new_model,
+                          lock_retry=None):
     """
     Execute all the SQL statements required to drop the triggers setup for the
     table sync in `execute_create_triggers`. The statements will be executed
     in a transaction and will only be committed if the can all be applied
-    successfully.
+    successfully. Waiting for the locks of the statements is bounded
+    according to *lock_retry* (see `locking.get_lock_retry`).
+    """
+    execute_drop_triggers_for_pairs(schema_editor, [(old_model, new_model)],
+                                    lock_retry=lock_retry)
+
+
+def execute_drop_triggers_for_pairs(schema_editor, model_pairs,
+                                    track_changes=False, lock_retry=None):
     """
-    schema_editor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ;')
+    Same as `execute_drop_triggers` for a list of ``(old_model, new_model)``
+    *model_pairs*, dropping all triggers in one transaction. With
+    *track_changes* set, a changelog trigger is created in the same
+    transaction that records all rows changed in the old table from then on
+    (see `execute_resync_triggers_for_pairs`).
+    """
+    started_at = time.time()
+
+    def drop_pairs():
+        for old_model, new_model in model_pairs:
+            tables = instrumentation.get_table_data(old_model, new_model)
 
-    schema_editor.execute(builder.drop_insert_trigger(old_model, new_model))
-    schema_editor.execute(builder.drop_update_trigger(old_model, new_model))
-    schema_editor.execute(builder.drop_delete_trigger(old_model, new_model))
+            instrumentation.execute_timed(
+                schema_editor,
+                builder.drop_insert_trigger(old_model, new_model),
+                'drop_insert_trigger', **tables)
+            instrumentation.execute_timed(
+                schema_editor,
+                builder.drop_update_trigger(old_model, new_model),
+                'drop_update_trigger', **tables)
+            instrumentation.execute_timed(
+                schema_editor,
+                builder.drop_delete_trigger(old_model, new_model),
+                'drop_delete_trigger', **tables)
 
-    schema_editor.execute('COMMIT;')
+            checkpoint.clear_checkpoint(schema_editor, old_model, new_model)
+
+            if track_changes:
+                changelog.create_changelog(schema_editor, old_model,
+                                           new_model)
+
+    locking.run_transaction(
+        schema_editor.execute, drop_pairs, lock_retry,
+        begin='BEGIN ISOLATION LEVEL REPEATABLE READ;',
+        connection=schema_editor.connection,
+        **get_lock_data('drop_triggers', model_pairs))
+
+    for old_model, new_model in model_pairs:
+        instrumentation.emit(
+            'triggers_dropped',
+            duration=round(time.time() - started_at, 3),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def execute_finish_changelog_sync_for_pairs(schema_editor, model_pairs,
+                                            keep_changelog=False,
+                                            timeout=None, mapping=None,
+                                            lock_retry=None):
+    """
+    Bring the new tables of the asynchronously synced ``(old_model,
+    new_model)`` *model_pairs* up to date and stop the sync. Most of the
+    changelog is applied without a lock, waiting up to *timeout* seconds
+    for the sync to catch up. The remaining entries are then applied while
+    the old tables are locked and the changelog trigger is dropped in the
+    same transaction, unless *keep_changelog* is set to continue recording
+    changes (see `ReleaseTableDuplication`). Waiting for the locks is
+    bounded according to *lock_retry* (see `locking.get_lock_retry`).
+    """
+    started_at = time.time()
+    connection = schema_editor.connection
+    check_collect_sql(schema_editor, 'Finishing an asynchronous sync')
+
+    for old_model, new_model in model_pairs:
+        changelog.wait_until_caught_up(connection, old_model, new_model,
+                                       timeout=timeout, mapping=mapping)
+
+    def finish_pairs():
+        for old_model, new_model in model_pairs:
+            changelog.finish_changelog_sync(schema_editor, old_model,
+                                            new_model, mapping=mapping)
+
+            if not keep_changelog:
+                instrumentation.execute_timed(
+                    schema_editor,
+                    builder.drop_changelog_trigger(old_model, new_model),
+                    'drop_changelog_trigger',
+                    **instrumentation.get_table_data(old_model, new_model))
+
+    locking.run_transaction(
+        schema_editor.execute, finish_pairs, lock_retry,
+        connection=schema_editor.connection,
+        **get_lock_data('finish_changelog_sync', model_pairs))
+
+    for old_model, new_model in model_pairs:
+        instrumentation.emit(
+            'changelog_sync_finished',
+            duration=round(time.time() - started_at, 3),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def execute_drop_changelog_sync_for_pairs(schema_editor, model_pairs,
+                                          lock_retry=None):
+    """
+    Drop the changelog triggers and tables of the asynchronously synced
+    ``(old_model, new_model)`` *model_pairs* without applying them.
+    """
+    def drop_pairs():
+        for old_model, new_model in model_pairs:
+            instrumentation.execute_timed(
+                schema_editor,
+                builder.drop_changelog_trigger(old_model, new_model),
+                'drop_changelog_trigger',
+                **instrumentation.get_table_data(old_model, new_model))
+
+            checkpoint.clear_checkpoint(schema_editor, old_model, new_model)
+
+    locking.run_transaction(
+        schema_editor.execute, drop_pairs, lock_retry,
+        connection=schema_editor.connection,
+        **get_lock_data('drop_changelog_sync', model_pairs))
+
+
+def execute_finish_decoding_sync_for_pairs(schema_editor, model_pairs,
+                                           keep_slot=False, timeout=None,
+                                           mapping=None, lock_retry=None):
+    """
+    Bring the new tables of the ``(old_model, new_model)`` *model_pairs*
+    synced by logical decoding up to date and stop the sync, like
+    `execute_finish_changelog_sync_for_pairs`. The replication slots are
+    dropped after the commit, unless *keep_slot* is set to continue
+    decoding changes.
+    """
+    started_at = time.time()
+    connection = schema_editor.connection
+    check_collect_sql(schema_editor, 'Finishing a logical decoding sync')
+
+    for old_model, new_model in model_pairs:
+        decoding.wait_until_caught_up(connection, old_model, new_model,
+                                      timeout=timeout, mapping=mapping)
+
+    def finish_pairs():
+        for old_model, new_model in model_pairs:
+            decoding.finish_decoding_sync(schema_editor, old_model,
+                                          new_model, mapping=mapping)
+
+    locking.run_transaction(
+        schema_editor.execute, finish_pairs, lock_retry,
+        connection=schema_editor.connection,
+        **get_lock_data('finish_decoding_sync', model_pairs))
+
+    for old_model, new_model in model_pairs:
+        if not keep_slot:
+            decoding.drop_slot(connection, old_model, new_model)
+            checkpoint.clear_checkpoint(schema_editor, old_model, new_model)
+
+        instrumentation.emit(
+            'decoding_sync_finished',
+            duration=round(time.time() - started_at, 3),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def execute_drop_decoding_sync_for_pairs(schema_editor, model_pairs):
+    """
+    Drop the replication slots of the ``(old_model, new_model)``
+    *model_pairs* synced by logical decoding without applying them.
+    """
+    check_collect_sql(schema_editor, 'Dropping a replication slot')
+
+    for old_model, new_model in model_pairs:
+        decoding.drop_slot(schema_editor.connection, old_model, new_model)
+        checkpoint.clear_checkpoint(schema_editor, old_model, new_model)
+
+
+def execute_resync_triggers_for_pairs(schema_editor, model_pairs,
+                                      batch_size=None, mapping=None,
+                                      lock_retry=None):
+    """
+    Re-create the triggers for the ``(old_model, new_model)``
+    *model_pairs* whose changes have been tracked since their triggers were
+    dropped, and only copy the rows recorded in the changelog instead of the
+    whole table.
+
+    The upserting triggers replace the changelog trigger in one transaction,
+    so every change is either in the changelog or synced by the triggers.
+    The changelog is then applied in batches of *batch_size* and dropped.
+    """
+    check_collect_sql(schema_editor, 'Resyncing from a changelog')
+
+    started_at = time.time()
+    batch_size = batch_size or changelog.DEFAULT_CHANGELOG_BATCH_SIZE
+
+    def resync_pairs():
+        for old_model, new_model in model_pairs:
+            create_triggers(schema_editor, old_model, new_model, upsert=True,
+                            mapping=mapping)
+
+            instrumentation.execute_timed(
+                schema_editor,
+                builder.drop_changelog_trigger(old_model, new_model,
+                                               keep_table=True),
+                'drop_changelog_trigger',
+                **instrumentation.get_table_data(old_model, new_model))
+
+    locking.run_transaction(
+        schema_editor.execute, resync_pairs, lock_retry,
+        connection=schema_editor.connection,
+        **get_lock_data('resync_triggers', model_pairs))
+
+    for old_model, new_model in model_pairs:
+        entries = changelog.apply_changelog(schema_editor.connection,
+                                            old_model, new_model, batch_size,
+                                            mapping=mapping)
+        schema_editor.execute(builder.drop_changelog_trigger(old_model,
+                                                             new_model))
+
+        instrumentation.emit(
+            'duplication_resynced',
+            entries=entries,
+            duration=round(time.time() - started_at, 3),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def execute_cutover_for_pairs(schema_editor, model_pairs, swap=cutover.VIEW,
+                              asynchronous=False, logical_decoding=False,
+                              sync_timeout=None, mapping=None, prewarm=False,
+                              lock_retry=None):
+    """
+    Stop the sync of the ``(old_model, new_model)`` *model_pairs* and put
+    the new tables in place of the old ones (see `cutover`).
+
+    The backfill has to be finished and an *asynchronous* or
+    *logical_decoding* sync has to catch up within *sync_timeout* seconds,
+    otherwise `checkpoint.BackfillNotFinished` or `cutover.SyncNotCaughtUp`
+    is raised before anything is locked. With *prewarm* set, the new tables
+    are loaded into the cache next. The remaining changes are then applied,
+    the sync is stopped and the tables are swapped in one transaction,
+    retried on lock timeouts according to *lock_retry*. Unless it is set
+    to ``False``, the lock waits are bounded even without *lock_retry* or
+    the ``REMOVALIST_LOCK_RETRY`` setting, as long as the connection isn't
+    in an atomic block that a retry would roll back.
+    """
+    started_at = time.time()
+    connection = schema_editor.connection
+    check_collect_sql(schema_editor, 'A cutover')
+
+    if lock_retry is None and not connection.in_atomic_block:
+        lock_retry = locking.get_lock_retry() or True
+
+    for old_model, new_model in model_pairs:
+        checkpoint.check_backfill_finished(connection, old_model, new_model)
+
+        if asynchronous:
+            caught_up = changelog.wait_until_caught_up(
+                connection, old_model, new_model, timeout=sync_timeout,
+                mapping=mapping)
+        elif logical_decoding:
+            caught_up = decoding.wait_until_caught_up(
+                connection, old_model, new_model, timeout=sync_timeout,
+                mapping=mapping)
+        else:
+            caught_up = True
+
+        if not caught_up:
+            raise cutover.SyncNotCaughtUp(
+                'The sync of {} -> {} did not catch up within {} '
+                'seconds.'.format(old_model._meta.db_table,
+                                  new_model._meta.db_table, sync_timeout))
+
+    if prewarm:
+        for old_model, new_model in model_pairs:
+            cutover.prewarm(connection, new_model)
+
+    def cutover_pairs():
+        for old_model, new_model in model_pairs:
+            cutover.lock_tables(schema_editor, old_model, new_model)
+
+        for old_model, new_model in model_pairs:
+            tables = instrumentation.get_table_data(old_model, new_model)
+
+            if asynchronous:
+                changelog.finish_changelog_sync(schema_editor, old_model,
+                                                new_model, mapping=mapping)
+                instrumentation.execute_timed(
+                    schema_editor,
+                    builder.drop_changelog_trigger(old_model, new_model),
+                    'drop_changelog_trigger', **tables)
+            elif logical_decoding:
+                decoding.finish_decoding_sync(schema_editor, old_model,
+                                              new_model, mapping=mapping)
+            else:
+                for event in ('insert', 'update', 'delete'):
+                    instrumentation.execute_timed(
+                        schema_editor,
+                        builder.drop_trigger(event, old_model, new_model),
+                        'drop_{}_trigger'.format(event), **tables)
+
+            checkpoint.clear_checkpoint(schema_editor, old_model, new_model)
+            cutover.swap_tables(schema_editor, old_model, new_model, swap)
+
+    lock_started_at = time.time()
+    locking.run_transaction(schema_editor.execute, cutover_pairs, lock_retry,
+                            connection=schema_editor.connection,
+                            **get_lock_data('cutover', model_pairs))
+    lock_duration = time.time() - lock_started_at
+
+    for old_model, new_model in model_pairs:
+        if logical_decoding:
+            decoding.drop_slot(connection, old_model, new_model)
+
+        instrumentation.emit(
+            'cutover_finished', swap=swap,
+            lock_duration=round(lock_duration, 3),
+            duration=round(time.time() - started_at, 3),
+            archive_table=cutover.get_archive_table_name(old_model),
+            **instrumentation.get_table_data(old_model, new_model))
+
+
+def get_model_key(model, app_label=None, model_key=None):
+    """
+    Return the ``(app_label, model_name)`` key in `ProjectState.models` of
+    the *model* class or reference, e.g. ``'app_label.Model'``, made in the
+    model with the *model_key* of the app *app_label*.
+    """
+    if hasattr(model, '_meta'):
+        return model._meta.app_label, model._meta.model_name
+
+    if model == 'self':
+        return model_key
+
+    if '.' in model:
+        app_label, model = model.split('.', 1)
+
+    return app_label, model.lower()
+
+
+def get_related_model_keys(state, model_keys):
+    """
+    Return the keys of the models of *model_keys* in the migration *state*
+    together with the keys of all models they refer to, directly or
+    indirectly, through relations or as their bases. Those are required to
+    render the models.
+    """
+    related_keys = set()
+    pending_keys = list(model_keys)
+
+    while pending_keys:
+        model_key = pending_keys.pop()
+        if model_key in related_keys or model_key not in state.models:
+            continue
+
+        related_keys.add(model_key)
+        model_state = state.models[model_key]
+
+        # Bases are model references or classes like models.Model.
+        references = [base for base in model_state.bases
+                      if not isinstance(base, type) or hasattr(base, '_meta')]
+
+        fields = model_state.fields
+        if isinstance(fields, dict):
+            fields = fields.items()
+
+        for _, field in fields:
+            remote_field = getattr(field, 'remote_field', None)
+            if remote_field is None:
+                continue
+
+            references.append(remote_field.model)
+            if getattr(remote_field, 'through', None):
+                references.append(remote_field.through)
+
+        pending_keys.extend(get_model_key(reference, model_key[0], model_key)
+                            for reference in references)
+
+    return related_keys
+
+
+def render_models(state, model_names):
+    """
+    Return the apps of the migration *state* with only the models of
+    *model_names* and the models they depend on rendered. Rendering all
+    models of a project with ``state.apps`` takes seconds for large
+    projects, the duplicated models usually only depend on a few others. The
+    apps of a state that has been rendered already are reused.
+    """
+    if 'apps' in vars(state):
+        return state.apps
+
+    model_keys = get_related_model_keys(
+        state, [get_model_key(model_name) for model_name in model_names])
+
+    return StateApps(state.real_apps,
+                     {model_key: state.models[model_key]
+                      for model_key in model_keys})
+
+
+def get_model_pairs(state, model_name_pairs):
+    """
+    Look up the ``(old_model, new_model)`` pairs for the
+    *model_name_pairs* in the apps of the migration *state*, rendering only
+    the models involved (see `render_models`). Pairs with an old model that
+    is no longer available are skipped.
+    """
+    model_pairs = []
+    apps = render_models(state, [model_name
+                                 for model_name_pair in model_name_pairs
+                                 for model_name in model_name_pair])
+
+    for old_model_name, new_model_name in model_name_pairs:
+        try:
+            old_model = apps.get_model(old_model_name)
+        except LookupError:
+            log.warning("old model no longer available, we assume it's because "
+                        "you are removing the model. If not, there's an issue "
+                        "and you should check it out.",
+                        old_model=old_model_name,
+                        new_model=new_model_name)
+            continue
+
+        new_model = apps.get_model(new_model_name)
+        model_pairs.append((old_model, new_model))
+
+    return model_pairs
+
+
+def get_model_name_pairs(old_model_name, new_model_name, pairs):
+    if pairs:
+        if old_model_name or new_model_name:
+            raise ValueError('pass either old and new model name or a list '
+                             'of pairs, not both')
+        return [tuple(pair) for pair in pairs]
+
+    if not (old_model_name and new_model_name):
+        raise ValueError('old and new model name are required')
+
+    return [(old_model_name, new_model_name)]
+
+
+def check_mapping(model_name_pairs, column_map, partition_columns):
+    if (column_map or partition_columns) and len(model_name_pairs) > 1:
+        raise ValueError('column_map and partition_columns are only '
+                         'supported for a single pair of models')
+
+
+def describe_model_name_pairs(model_name_pairs):
+    return ', '.join('{} -> {}'.format(old_model_name, new_model_name)
+                     for old_model_name, new_model_name in model_name_pairs)
 
 
 class CreateTableDuplication(Operation):
@@ -64,98 +797,494 @@ class CreateTableDuplication(Operation):
         tables. After switching to the new code version only using the new
         model/table will result in potential data loss if a switch to the old
         code version is required.
+
+    Passing a *batch_size* copies the existing data in ranges of that many
+    primary keys after the triggers have been created, committing each range
+    separately instead of locking the old table for the whole copy. As this
+    commits during the migration, the migration should be marked as
+    ``atomic = False``. The copy runs on its own connection, so ``sqlmigrate``
+    raises `SQLNotCollectable` for it rather than showing the SQL.
+
+    Setting *online* additionally makes the insert and update triggers upsert
+    into the new table and copies the existing rows without overwriting the
+    ones written by the triggers. Updates on the old table don't have to wait
+    for the copy, which makes it suitable for tables under constant write
+    load.
+
+    With *statement_triggers* set, ``FOR EACH STATEMENT`` triggers with
+    transition tables are used instead of row triggers. Bulk writes on the
+    old table, e.g. ``QuerySet.update()`` or ``bulk_create()``, are then
+    synced with one statement instead of one per row. This requires
+    PostgreSQL 10 or later.
+
+    Updates that don't change a row are never synced. Setting
+    *changed_columns_only* additionally restricts the update trigger to
+    writing only the columns that differ, keeping the stored values of the
+    others, which is useful for tables with large text or JSON columns.
+
+    The batched copy can be spread over several database connections by
+    passing the number of *workers*, each copying primary key ranges
+    concurrently in a separate thread.
+
+    Instead of a single old and new model name, a list of ``(old_model_name,
+    new_model_name)`` *pairs* can be passed to duplicate several tables in
+    one operation. All triggers are created in one transaction, the data is
+    copied in the order of the foreign keys between the new tables and, in
+    the batched modes, tables that don't depend on each other are copied
+    concurrently.
+
+    Setting *resumable* stores the progress of the batched copy in the
+    ``removalist_checkpoint`` table, updated in the same transaction as each
+    copied range. If the migration is interrupted, running it again keeps
+    the existing triggers and continues the copy from the checkpoint. An
+    interrupted copy can also be finished with the ``removalist_backfill``
+    management command.
+
+    Passing *throttle* makes the batched copy yield to production load. The
+    size of the copied ranges is adapted to keep each transaction around a
+    target duration. The copy pauses with an exponential backoff while
+    replicas lag behind or other sessions wait for locks on the tables.
+    It is either ``True`` for the defaults or a dict with any of
+    ``min_batch_size``, ``max_batch_size``, ``target_duration``,
+    ``max_sleep``, ``max_replication_lag``, ``max_lock_waits`` and
+    ``check_interval``. Only pauses apply to a copy with several workers.
+
+    Setting *asynchronous* takes the sync off the write path of the old
+    table. Instead of the sync triggers, a trigger appends the primary key
+    and operation of each changed row to a changelog table. The changes are
+    applied to the new table in batches by the ``removalist_sync``
+    management command, which coalesces repeated changes to the same row
+    and reports the sync lag. `ReleaseTableDuplication` waits for the sync
+    to catch up and applies the last changes while briefly locking the old
+    table.
+
+    Setting *logical_decoding* removes the sync from the write path of the
+    old table entirely. No trigger is created, the changes are decoded from
+    the WAL through a logical replication slot with the ``test_decoding``
+    plugin, which is created before the batched copy. The changes are
+    applied in batches after the copy and by the ``removalist_sync``
+    management command, and `ReleaseTableDuplication` applies the last ones
+    while briefly locking the old table and drops the slot. This requires
+    ``wal_level = logical``. As the slot retains the WAL that hasn't been
+    applied, the sync should run until the duplication is released.
+
+    The new table doesn't need to have the same columns as the old one. A
+    *column_map* maps columns of the new table to SQL expressions that refer
+    to columns of the old table as ``{column_name}``, e.g. to rename a
+    column (``{'title': '{name}'}``), derive a value
+    (``{'name_lower': 'lower({name})'}``) or fill in a constant
+    (``{'tenant': "'default'"}``). Other new columns are copied from the old
+    column of the same name or left to their database default, and old
+    columns that don't exist in the new table are dropped. When the new
+    table is partitioned, its *partition_columns* are added to the conflict
+    target of the upserts and to the lookups of updated and deleted rows so
+    that each write only touches the partition of the row. Both options are
+    only supported for a single pair of models.
+
+    Setting *defer_indexes* speeds up the batched copy by dropping the
+    non-unique indexes and the foreign keys of the new table beforehand.
+    Once the data is copied, the indexes are re-created with ``CREATE INDEX
+    CONCURRENTLY``, the foreign keys are added ``NOT VALID`` and validated
+    in a separate step, and the new table is analyzed. The dropped objects
+    are recorded in the ``removalist_deferred_object`` table, so they are
+    restored by the ``removalist_backfill`` management command or when
+    migrating backwards after an interruption.
+
+    Setting *defer_backfill* takes the copy out of the migration. The
+    migration only creates the triggers and registers a backfill job in the
+    ``removalist_checkpoint`` table, so the deploy isn't blocked for the
+    duration of the copy. The ``removalist_backfill`` management command
+    then copies the data in the background, in batches of a bounded number
+    of rows, and reports the status of all jobs with ``--status``.
+    `ReleaseTableDuplication` refuses to run until the job has finished.
+    Deferred indexes are restored by the management command as well.
+
+    Every transaction that takes a lock on the tables, e.g. to create the
+    triggers or to lock the old table for the copy, waits for it for at
+    most a ``lock_timeout`` if *lock_retry* is passed. On a timeout the
+    transaction is rolled back and retried after a jittered exponential
+    backoff, so queries don't queue up behind a migration waiting for a
+    long-running query. It is either ``True`` for the defaults or a dict
+    with any of ``lock_timeout``, ``max_attempts``, ``min_delay`` and
+    ``max_delay``, and defaults to the ``REMOVALIST_LOCK_RETRY`` setting
+    (see `locking`).
     """
     reversible = True
 
-    def __init__(self, old_model_name, new_model_name):
+    def __init__(self, old_model_name=None, new_model_name=None,
+                 batch_size=None, online=False, statement_triggers=False,
+                 changed_columns_only=False, workers=None, pairs=None,
+                 resumable=False, throttle=None, asynchronous=False,
+                 column_map=None, partition_columns=None,
+                 defer_indexes=False, defer_backfill=False, lock_retry=None,
+                 logical_decoding=False):
+        if asynchronous and logical_decoding:
+            raise ValueError('asynchronous and logical_decoding are '
+                             'alternatives')
+
+        self.model_name_pairs = get_model_name_pairs(old_model_name,
+                                                     new_model_name, pairs)
+        check_mapping(self.model_name_pairs, column_map, partition_columns)
         self.old_model_name = old_model_name
         self.new_model_name = new_model_name
+        self.batch_size = batch_size
+        self.online = online
+        self.statement_triggers = statement_triggers
+        self.changed_columns_only = changed_columns_only
+        self.workers = workers
+        self.resumable = resumable
+        self.throttle = throttle
+        self.asynchronous = asynchronous
+        self.column_map = column_map
+        self.partition_columns = partition_columns
+        self.mapping = builder.get_mapping(column_map, partition_columns)
+        self.defer_indexes = defer_indexes
+        self.defer_backfill = defer_backfill
+        self.lock_retry = lock_retry
+        self.logical_decoding = logical_decoding
 
     def database_forwards(self, app_label, schema_editor, from_state, to_state):
-        try:
-            old_model = from_state.apps.get_model(self.old_model_name)
-        except LookupError:
-            log.warning("old model no longer available, we assume it's because "
-                        "you are removing the model. If not, there's an issue "
-                        "and you should check it out.",
-                        old_model=self.old_model_name,
-                        new_model=self.new_model_name)
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+        if not model_pairs:
             return
 
-        new_model = from_state.apps.get_model(self.new_model_name)
-
-        execute_create_triggers(schema_editor, old_model, new_model)
+        execute_create_triggers_for_pairs(
+            schema_editor, model_pairs,
+            batch_size=self.batch_size,
+            online=self.online,
+            statement_triggers=self.statement_triggers,
+            changed_columns_only=self.changed_columns_only,
+            workers=self.workers,
+            resumable=self.resumable,
+            throttle=self.throttle,
+            asynchronous=self.asynchronous,
+            mapping=self.mapping,
+            defer_indexes=self.defer_indexes,
+            defer_backfill=self.defer_backfill,
+            lock_retry=self.lock_retry,
+            logical_decoding=self.logical_decoding)
 
     def database_backwards(self, app_label, schema_editor, from_state, to_state):
-        try:
-            old_model = from_state.apps.get_model(self.old_model_name)
-        except LookupError:
-            log.warning("old model no longer available, we assume it's because "
-                        "you are removing the model. If not, there's an issue "
-                        "and you should check it out.",
-                        old_model=self.old_model_name,
-                        new_model=self.new_model_name)
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+        if not model_pairs:
             return
 
-        new_model = from_state.apps.get_model(self.new_model_name)
+        if self.asynchronous:
+            execute_drop_changelog_sync_for_pairs(schema_editor, model_pairs,
+                                                  lock_retry=self.lock_retry)
+        elif self.logical_decoding:
+            execute_drop_decoding_sync_for_pairs(schema_editor, model_pairs)
+        else:
+            execute_drop_triggers_for_pairs(schema_editor, model_pairs,
+                                            lock_retry=self.lock_retry)
 
-        execute_drop_triggers(schema_editor, old_model, new_model)
+        # A copy interrupted before the end leaves the new table without
+        # its deferred indexes.
+        if self.defer_indexes:
+            check_collect_sql(schema_editor, 'Restoring deferred indexes')
+            for old_model, new_model in model_pairs:
+                indexes.restore_indexes(schema_editor.connection, new_model,
+                                        analyze=False,
+                                        lock_retry=self.lock_retry)
 
     def state_forwards(self, app_label, state):
         """ Overriding this method is required. """
         pass
 
     def describe(self):
-        return "Create triggers for transitional model renaming: {} -> {}".format(
-            self.old_model_name,
-            self.new_model_name)
+        return "Create triggers for transitional model renaming: {}".format(
+            describe_model_name_pairs(self.model_name_pairs))
 
 
 class ReleaseTableDuplication(Operation):
     """
     Release the triggers setup in the CreateTableDuplication operation.
+
+    Like `CreateTableDuplication`, it accepts a list of ``(old_model_name,
+    new_model_name)`` *pairs* instead of a single pair of model names.
+
+    Migrating backwards re-creates the triggers and copies the whole old
+    table again. With *track_changes* set, the triggers are replaced by a
+    changelog trigger that records the primary key of every row changed in
+    the old table after the release. Migrating backwards then only copies
+    the recorded rows, so a rollback takes time proportional to the number
+    of changes. Until then every write to the old table also writes to the
+    changelog. The changelog table is left behind if the old table is
+    dropped instead.
+
+    For a duplication created with *asynchronous* set, the release waits
+    up to *sync_timeout* seconds for the sync to catch up and then applies
+    the remaining changes while the old table is locked. With
+    *track_changes*, the changelog trigger is kept in place instead, so
+    migrating backwards only has to apply the changelog again. The same
+    applies to a duplication created with *logical_decoding*, with
+    *track_changes* keeping the replication slot.
+
+    The *column_map* and *partition_columns* of the duplication have to be
+    passed again, as the changes are written to the new table when
+    finishing an asynchronous sync or migrating backwards.
+
+    Releasing a duplication whose backfill has been started but hasn't
+    finished, e.g. one created with *defer_backfill*, raises
+    `checkpoint.BackfillNotFinished` before anything is changed.
+
+    Waiting for the locks taken by the release and by migrating backwards
+    is bounded according to *lock_retry*, as for `CreateTableDuplication`.
     """
     reversible = True
 
-    def __init__(self, old_model_name, new_model_name):
+    def __init__(self, old_model_name=None, new_model_name=None, pairs=None,
+                 track_changes=False, asynchronous=False, sync_timeout=None,
+                 column_map=None, partition_columns=None, lock_retry=None,
+                 logical_decoding=False):
+        self.model_name_pairs = get_model_name_pairs(old_model_name,
+                                                     new_model_name, pairs)
+        check_mapping(self.model_name_pairs, column_map, partition_columns)
         self.old_model_name = old_model_name
         self.new_model_name = new_model_name
+        self.track_changes = track_changes
+        self.asynchronous = asynchronous
+        self.sync_timeout = sync_timeout
+        self.column_map = column_map
+        self.partition_columns = partition_columns
+        self.mapping = builder.get_mapping(column_map, partition_columns)
+        self.lock_retry = lock_retry
+        self.logical_decoding = logical_decoding
 
     def database_forwards(self, app_label, schema_editor, from_state, to_state):
-        try:
-            old_model = from_state.apps.get_model(self.old_model_name)
-        except LookupError:
-            log.warning("old model no longer available, we assume it's because "
-                        "you are removing the model. If not, there's an issue "
-                        "and you should check it out.",
-                        old_model=self.old_model_name,
-                        new_model=self.new_model_name)
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+        if not model_pairs:
             return
 
-        new_model = from_state.apps.get_model(self.new_model_name)
+        for old_model, new_model in model_pairs:
+            checkpoint.check_backfill_finished(schema_editor.connection,
+                                               old_model, new_model)
 
-        execute_drop_triggers(schema_editor, old_model, new_model)
+        if self.asynchronous:
+            execute_finish_changelog_sync_for_pairs(
+                schema_editor, model_pairs, keep_changelog=self.track_changes,
+                timeout=self.sync_timeout, mapping=self.mapping,
+                lock_retry=self.lock_retry)
+        elif self.logical_decoding:
+            execute_finish_decoding_sync_for_pairs(
+                schema_editor, model_pairs, keep_slot=self.track_changes,
+                timeout=self.sync_timeout, mapping=self.mapping,
+                lock_retry=self.lock_retry)
+        else:
+            execute_drop_triggers_for_pairs(schema_editor, model_pairs,
+                                            track_changes=self.track_changes,
+                                            lock_retry=self.lock_retry)
 
     def database_backwards(self, app_label, schema_editor, from_state, to_state):
-        try:
-            old_model = from_state.apps.get_model(self.old_model_name)
-        except LookupError:
-            log.warning("old model no longer available, we assume it's because "
-                        "you are removing the model. If not, there's an issue "
-                        "and you should check it out.",
-                        old_model=self.old_model_name,
-                        new_model=self.new_model_name)
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+        if not model_pairs:
             return
 
-        new_model = from_state.apps.get_model(self.new_model_name)
+        if self.asynchronous or self.logical_decoding:
+            self.resume_sync(schema_editor, model_pairs)
+            return
+
+        tracked_pairs = []
+        if self.track_changes:
+            tracked_pairs = [
+                (old_model, new_model) for old_model, new_model in model_pairs
+                if changelog.changelog_exists(schema_editor.connection,
+                                              old_model, new_model)]
+
+        if tracked_pairs:
+            execute_resync_triggers_for_pairs(schema_editor, tracked_pairs,
+                                              mapping=self.mapping,
+                                              lock_retry=self.lock_retry)
+
+        untracked_pairs = [pair for pair in model_pairs
+                           if pair not in tracked_pairs]
+        if untracked_pairs:
+            execute_create_triggers_for_pairs(schema_editor, untracked_pairs,
+                                              mapping=self.mapping,
+                                              lock_retry=self.lock_retry)
+
+    def resume_sync(self, schema_editor, model_pairs):
+        # A changelog or slot kept by the release has recorded all changes
+        # since, so the sync only has to continue from it.
+        if self.logical_decoding:
+            sync_exists = decoding.slot_exists
+        else:
+            sync_exists = changelog.changelog_exists
+
+        untracked_pairs = [
+            (old_model, new_model) for old_model, new_model in model_pairs
+            if not (self.track_changes and
+                    sync_exists(schema_editor.connection, old_model,
+                                new_model))]
+
+        if untracked_pairs:
+            execute_create_triggers_for_pairs(
+                schema_editor, untracked_pairs,
+                asynchronous=self.asynchronous,
+                logical_decoding=self.logical_decoding,
+                mapping=self.mapping, lock_retry=self.lock_retry)
+
+    def state_forwards(self, app_label, state):
+        """ Overriding this method is required. """
+        pass
+
+    def describe(self):
+        return "Drop triggers for transitional model renaming: {}".format(
+            describe_model_name_pairs(self.model_name_pairs))
+
+
+class CutoverTableDuplication(Operation):
+    """
+    Switch from the old tables of a `CreateTableDuplication` to the new
+    tables, instead of only releasing the triggers with
+    `ReleaseTableDuplication`.
+
+    The cutover waits up to *sync_timeout* seconds for an *asynchronous* or
+    *logical_decoding* sync to catch up and refuses to run while a backfill
+    hasn't finished. Passing *prewarm* loads the new tables and their
+    indexes into the cache with ``pg_prewarm`` beforehand. Then, in one
+    transaction, it locks the old and new tables, applies the last changes,
+    stops the sync, moves the primary key sequence of the new table past
+    every value already used and renames the old table to
+    ``<old table>_archived``. With *swap* set to ``'view'``, an updatable
+    view with the name of the old table selecting from the new table takes
+    its place, so code still using the old table keeps working. With
+    ``'rename'``, the new table itself is renamed to the name of the old
+    one.
+
+    The migration state isn't changed by the cutover. After a ``'rename'``
+    the state still describes the new model with its own table, so the
+    cutover has to be followed by a `SeparateDatabaseAndState` whose state
+    operations only delete the old model with ``DeleteModel`` and point the
+    new model at the old table with ``AlterModelTable``, matching the
+    models. Running these operations against the database would rename the
+    swapped tables again.
+
+    The locks are only waited for up to a ``lock_timeout`` and the
+    transaction is retried with a backoff according to *lock_retry* or the
+    ``REMOVALIST_LOCK_RETRY`` setting (see `locking`). Outside of an atomic
+    block, i.e. in a migration marked as ``atomic = False``, this falls
+    back to the defaults unless *lock_retry* is set to ``False``.
+
+    Foreign keys referencing the old table still reference the archived
+    table afterwards. The cutover can't be reversed, as the archived table
+    isn't kept in sync with the new table.
+    """
+    reversible = False
+
+    def __init__(self, old_model_name=None, new_model_name=None, pairs=None,
+                 swap=cutover.VIEW, asynchronous=False,
+                 logical_decoding=False, sync_timeout=None, column_map=None,
+                 partition_columns=None, prewarm=False, lock_retry=None):
+        if swap not in cutover.SWAP_MODES:
+            raise ValueError('swap has to be one of {}'.format(
+                ', '.join(cutover.SWAP_MODES)))
+        if swap == cutover.VIEW and column_map:
+            raise ValueError('a view over a new table with a column_map '
+                             'would have different columns, use '
+                             "swap='rename'")
+
+        self.model_name_pairs = get_model_name_pairs(old_model_name,
+                                                     new_model_name, pairs)
+        check_mapping(self.model_name_pairs, column_map, partition_columns)
+        self.old_model_name = old_model_name
+        self.new_model_name = new_model_name
+        self.swap = swap
+        self.asynchronous = asynchronous
+        self.logical_decoding = logical_decoding
+        self.sync_timeout = sync_timeout
+        self.column_map = column_map
+        self.partition_columns = partition_columns
+        self.mapping = builder.get_mapping(column_map, partition_columns)
+        self.prewarm = prewarm
+        self.lock_retry = lock_retry
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+        if not model_pairs:
+            return
+
+        execute_cutover_for_pairs(
+            schema_editor, model_pairs, swap=self.swap,
+            asynchronous=self.asynchronous,
+            logical_decoding=self.logical_decoding,
+            sync_timeout=self.sync_timeout, mapping=self.mapping,
+            prewarm=self.prewarm, lock_retry=self.lock_retry)
+
+    def state_forwards(self, app_label, state):
+        """ Overriding this method is required. """
+        pass
+
+    def describe(self):
+        return "Cut over to new tables for transitional model renaming: " + (
+            describe_model_name_pairs(self.model_name_pairs))
+
+
+class RetargetForeignKeys(Operation):
+    """
+    Make the foreign keys of other tables that reference the old table of a
+    duplication reference the new table instead, without blocking writes to
+    the referencing tables for longer than a catalog change.
+
+    Each referencing constraint is dropped and added again against the new
+    table as ``NOT VALID`` in a short transaction of its own, retried on
+    lock timeouts according to *lock_retry* (see `locking`). Once all of
+    them point at the new table, they are validated one at a time with
+    ``VALIDATE CONSTRAINT``, which doesn't block reads or writes (see
+    `foreign_keys`). Migrating backwards points them back at the old table.
+
+    The retargeted constraints are recorded, so only those are validated
+    and, when migrating backwards, pointed back at the old table.
+
+    The new table has to contain every referenced row as soon as it is
+    written to the old table, so the duplication has to be synced by the
+    sync triggers, not *asynchronous* or by *logical_decoding*, and its
+    backfill has to be finished. Otherwise `foreign_keys.TriggerSyncRequired`
+    or `checkpoint.BackfillNotFinished` is raised before anything is
+    changed. Like the other operations, this only changes the database. The
+    fields of the referencing models are pointed at the new model in the
+    migration state separately, e.g. with ``SeparateDatabaseAndState``. As
+    it commits during the migration, the migration should be marked as
+    ``atomic = False``.
+    """
+    reversible = True
+
+    def __init__(self, old_model_name=None, new_model_name=None, pairs=None,
+                 lock_retry=None):
+        self.model_name_pairs = get_model_name_pairs(old_model_name,
+                                                     new_model_name, pairs)
+        self.old_model_name = old_model_name
+        self.new_model_name = new_model_name
+        self.lock_retry = lock_retry
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        check_collect_sql(schema_editor, 'Retargeting foreign keys')
+        connection = schema_editor.connection
+        model_pairs = get_model_pairs(from_state, self.model_name_pairs)
+
+        for old_model, new_model in model_pairs:
+            checkpoint.check_backfill_finished(connection, old_model,
+                                               new_model)
+            foreign_keys.check_trigger_sync(connection, old_model, new_model)
+
+        for old_model, new_model in model_pairs:
+            foreign_keys.retarget_foreign_keys(connection, old_model,
+                                               new_model,
+                                               lock_retry=self.lock_retry)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        check_collect_sql(schema_editor, 'Restoring foreign keys')
 
-        execute_create_triggers(schema_editor, old_model, new_model)
+        for old_model, new_model in get_model_pairs(from_state,
+                                                    self.model_name_pairs):
+            foreign_keys.restore_foreign_keys(schema_editor.connection,
+                                              old_model, new_model,
+                                              lock_retry=self.lock_retry)
 
     def state_forwards(self, app_label, state):
         """ Overriding this method is required. """
         pass
 
     def describe(self):
-        return "Drop triggers for transitional model renaming: {} -> {}".format(
-            self.old_model_name,
-            self.new_model_name)
+        return "Retarget foreign keys for transitional model renaming: " + (
+            describe_model_name_pairs(self.model_name_pairs))
@@ -0,0 +1,221 @@
+"""
+Dry-run planning of a table duplication.
+
+The plan describes what `CreateTableDuplication` and
+`ReleaseTableDuplication` will do for a pair of models without changing any
+data: the size of the tables, the SQL that will be executed, the query plan
+of the copy and the locks that will be taken. The duration of the copy and
+of the locks held during it is estimated from a sampled timing run, which
+copies a few primary key ranges in transactions that are rolled back.
+"""
+import math
+import time
+from collections import namedtuple
+
+from . import backfill, builder
+
+DEFAULT_SAMPLES = 3
+
+# A lock taken by the duplication. The *duration* in seconds is ``None`` for
+# locks that are only held for a catalog change and released immediately.
+LockEstimate = namedtuple('LockEstimate', ['phase', 'table', 'mode',
+                                           'duration'])
+
+
+def table_exists(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL;', [table])
+        return cursor.fetchone()[0]
+
+
+def get_table_stats(connection, table):
+    """
+    Return the estimated row count, the size of the table, its total size
+    including indexes and TOAST data, and the number of indexes of *table*,
+    or ``None`` if the table doesn't exist (yet).
+    """
+    if not table_exists(connection, table):
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint, pg_relation_size(oid), '
+            'pg_total_relation_size(oid), '
+            '(SELECT count(*) FROM pg_index WHERE indrelid = pg_class.oid) '
+            'FROM pg_class WHERE oid = %s::regclass;', [table])
+        rows, table_size, total_size, index_count = cursor.fetchone()
+
+    return {'estimated_rows': max(rows, 0),
+            'table_size': table_size,
+            'total_size': total_size,
+            'indexes': index_count}
+
+
+def get_longest_transaction_age(connection):
+    """
+    Return the age in seconds of the oldest open transaction of any other
+    session. Taking a table lock has to wait for it, as it might hold a
+    conflicting lock, and every later query on the table queues up behind.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT COALESCE(MAX(EXTRACT(EPOCH FROM now() - xact_start)), 0) '
+            'FROM pg_stat_activity '
+            'WHERE xact_start IS NOT NULL AND pid <> pg_backend_pid();')
+        return float(cursor.fetchone()[0])
+
+
+def explain(connection, statement, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN {}'.format(statement), params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def get_sample_ranges(lower, upper, sample_size, samples):
+    """
+    Return up to *samples* ranges of *sample_size* primary keys spread
+    evenly between *lower* and *upper*.
+    """
+    if samples < 1:
+        return []
+
+    step = max((upper - lower + 1) // samples, sample_size)
+    return [(start, start + sample_size)
+            for start in range(lower, upper + 1, step)][:samples]
+
+
+def sample_copy(connection, statement, ranges):
+    """
+    Copy each of the primary key *ranges* with *statement* in a transaction
+    that is rolled back. Returns the number of rows copied and the duration
+    of each range in seconds.
+    """
+    rows = 0
+    durations = []
+
+    with connection.cursor() as cursor:
+        for start, end in ranges:
+            cursor.execute('BEGIN;')
+            try:
+                started_at = time.time()
+                cursor.execute(statement, [start, end])
+                durations.append(time.time() - started_at)
+                rows += max(cursor.rowcount, 0)
+            finally:
+                cursor.execute('ROLLBACK;')
+
+    return rows, durations
+
+
+def get_lock_estimates(old_table, new_table, batch_size, copy_duration,
+                       batch_duration, online=False):
+    if batch_size:
+        row_lock = 'FOR KEY SHARE' if online else 'FOR SHARE'
+        return [
+            LockEstimate('create_triggers', old_table, 'SHARE ROW EXCLUSIVE',
+                         None),
+            LockEstimate('copy_batch', old_table,
+                         'ROW SHARE ({} on copied rows)'.format(row_lock),
+                         batch_duration),
+            LockEstimate('copy_batch', new_table, 'ROW EXCLUSIVE',
+                         batch_duration),
+            LockEstimate('release', old_table, 'ACCESS EXCLUSIVE', None),
+        ]
+
+    return [
+        LockEstimate('copy', old_table, 'EXCLUSIVE', copy_duration),
+        LockEstimate('copy', new_table, 'ROW EXCLUSIVE', copy_duration),
+        LockEstimate('release', old_table, 'ACCESS EXCLUSIVE', None),
+    ]
+
+
+def plan_model_pair(connection, old_model, new_model, batch_size=None,
+                    online=False, statement_triggers=False, mapping=None,
+                    samples=DEFAULT_SAMPLES):
+    """
+    Return the plan of the duplication of *old_model* into *new_model* with
+    the given operation options as a dict. Nothing is written, but up to
+    *samples* ranges of primary keys are copied to time the copy, each in a
+    transaction that is rolled back. Without a *batch_size*, the ranges are
+    sampled with `backfill.DEFAULT_BATCH_SIZE` primary keys and the copy is
+    estimated as a single statement holding the table lock.
+    """
+    mapping = mapping or {}
+    old_table = old_model._meta.db_table
+    new_table = new_model._meta.db_table
+
+    statements = {
+        'create_triggers': [
+            builder.create_trigger(event, old_model, new_model,
+                                   upsert=online,
+                                   statement_level=statement_triggers,
+                                   **mapping)
+            for event in ('insert', 'update', 'delete')],
+    }
+
+    if batch_size:
+        statements['copy'] = builder.copy_model_data_range(
+            old_model, new_model, keep_existing=online, **mapping)
+    else:
+        statements['copy'] = builder.copy_model_data(old_model, new_model,
+                                                     **mapping)
+
+    plan = {
+        'old_table': old_table,
+        'new_table': new_table,
+        'batch_size': batch_size,
+        'old_table_stats': get_table_stats(connection, old_table),
+        'new_table_stats': get_table_stats(connection, new_table),
+        'statements': statements,
+        'explain': None,
+        'sample': None,
+        'batches': None,
+        'estimated_copy_duration': None,
+        'estimated_batch_duration': None,
+        'estimated_lock_wait': get_longest_transaction_age(connection),
+    }
+
+    lower, upper = None, None
+    if plan['old_table_stats'] is not None:
+        lower, upper = backfill.get_pk_bounds(connection, old_model)
+
+    if plan['new_table_stats'] is not None and lower is not None:
+        sample_size = batch_size or backfill.DEFAULT_BATCH_SIZE
+        range_statement = builder.copy_model_data_range(
+            old_model, new_model, keep_existing=online, **mapping)
+
+        if batch_size:
+            plan['explain'] = explain(connection, range_statement,
+                                      [lower, lower + batch_size])
+        else:
+            plan['explain'] = explain(connection, statements['copy'])
+
+        ranges = get_sample_ranges(lower, upper, sample_size, samples)
+        rows, durations = sample_copy(connection, range_statement, ranges)
+
+        if durations:
+            plan['sample'] = {'ranges': len(durations), 'rows': rows,
+                              'duration': round(sum(durations), 6)}
+
+            batches = int(math.ceil((upper - lower + 1) / sample_size))
+            batch_duration = sum(durations) / len(durations)
+            plan['batches'] = batches
+
+            # Gaps in the primary keys make the estimate from the number of
+            # ranges too high, the row count is more accurate if known.
+            estimated_rows = plan['old_table_stats']['estimated_rows']
+            if rows and estimated_rows:
+                copy_duration = sum(durations) * estimated_rows / rows
+            else:
+                copy_duration = batch_duration * batches
+            plan['estimated_copy_duration'] = round(copy_duration, 3)
+            if batch_size:
+                plan['estimated_batch_duration'] = round(batch_duration, 6)
+
+    plan['locks'] = [
+        lock._asdict() for lock in get_lock_estimates(
+            old_table, new_table, batch_size,
+            plan['estimated_copy_duration'],
+            plan['estimated_batch_duration'], online)]
+
+    return plan
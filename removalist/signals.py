@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent for every instrumentation event emitted while duplicating tables. The
+# receiver gets the ``event`` name (e.g. ``backfill_progress``) and all data
+# of the event as keyword arguments.
+duplication_event = Signal()
@@ -1,8 +1,13 @@
-INSERT INTO {{ new_db_table_name }} (
-    SELECT{% for column_name in new_column_names %}
-        {{ column_name }}{% if not forloop.last %},{% endif %}{% endfor %}
-    FROM {{ old_db_table_name }})
-ON CONFLICT ({{ pk_name }}) DO
+INSERT INTO {{ new_db_table_name }} ({% if column_map %}{% for column in columns %}
+    {{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}) ({% endif %}
+    SELECT{% for column in columns %}
+        {{ column.value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    FROM {{ old_db_table_name }}{% if pk_range %}
+    WHERE {{ pk_name }} >= %s AND {{ pk_name }} < %s
+    FOR {% if keep_existing %}KEY {% endif %}SHARE{% elif pk_list %}
+    WHERE {{ pk_name }} = ANY(%s)
+    FOR SHARE{% endif %})
+ON CONFLICT ({{ conflict_target }}) DO{% if keep_existing %} NOTHING;{% else %}
     UPDATE
-        SET{% for column_name in new_column_names %}{% if column_name not in new_unique_column_names %}
-            {{ column_name }} = EXCLUDED.{{ column_name }}{% if not forloop.last %},{% endif %}{% endif %}{% endfor %};
+        SET{% for column in columns %}{% if not column.unique %}
+            {{ column.name }} = EXCLUDED.{{ column.name }}{% if not forloop.last %},{% endif %}{% endif %}{% endfor %};{% endif %}
@@ -0,0 +1,37 @@
+CREATE TABLE IF NOT EXISTS {{ changelog_table_name }} (
+    id BIGSERIAL PRIMARY KEY,
+    row_pk {{ pk_type }} NOT NULL,
+    operation CHAR(1) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_changelog()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO {{ changelog_table_name }} (row_pk, operation)
+        VALUES (OLD.{{ pk_name }}, 'D');
+
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND NEW.{{ pk_name }} <> OLD.{{ pk_name }} THEN
+        INSERT INTO {{ changelog_table_name }} (row_pk, operation)
+        VALUES (OLD.{{ pk_name }}, 'D');
+    END IF;
+
+    INSERT INTO {{ changelog_table_name }} (row_pk, operation)
+    VALUES (NEW.{{ pk_name }}, LEFT(TG_OP, 1));
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_changelog_trigger
+    AFTER INSERT OR UPDATE OR DELETE
+    ON {{ old_db_table_name }}
+    FOR EACH ROW
+    EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_changelog();
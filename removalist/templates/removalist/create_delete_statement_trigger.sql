@@ -0,0 +1,21 @@
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_delete()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    DELETE FROM {{ new_db_table_name }}
+    USING deleted_rows
+    WHERE deleted_rows.{{ pk_name }} = {{ new_db_table_name }}.{{ pk_name }}{% for column in partition_columns %}
+        AND {{ new_db_table_name }}.{{ column.name }} = {{ column.deleted_value }}{% endfor %};
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_delete_trigger
+    AFTER DELETE
+    ON {{ old_db_table_name }}
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_delete();
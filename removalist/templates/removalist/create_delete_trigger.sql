@@ -3,7 +3,8 @@ RETURNS TRIGGER AS
 $BODY$
 BEGIN
     DELETE FROM {{ new_db_table_name }}
-    WHERE OLD.{{ pk_name }} = {{ pk_name }};
+    WHERE OLD.{{ pk_name }} = {{ pk_name }}{% for column in partition_columns %}
+        AND {{ column.name }} = {{ column.old_value }}{% endfor %};
 
     RETURN OLD;
 END;
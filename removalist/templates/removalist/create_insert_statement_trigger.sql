@@ -0,0 +1,27 @@
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_insert()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    INSERT INTO {{ new_db_table_name }} ({% for column in columns %}
+        {{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}
+    )
+    SELECT{% for column in columns %}
+        {{ column.value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    FROM inserted_rows{% if upsert %}
+    ON CONFLICT ({{ conflict_target }}) DO
+        UPDATE
+        SET{% for column in columns %}{% if not column.unique %}
+            {{ column.name }} = EXCLUDED.{{ column.name }}{% if not forloop.last %},{% endif %}{% endif %}{% endfor %}{% endif %};
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_insert_trigger
+  AFTER INSERT
+  ON {{ old_db_table_name }}
+  REFERENCING NEW TABLE AS inserted_rows
+  FOR EACH STATEMENT
+  EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_insert();
@@ -2,12 +2,16 @@ CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_in
 RETURNS TRIGGER AS
 $BODY$
 BEGIN
-    INSERT INTO {{ new_db_table_name }} ({% for column_name in new_column_names %}
-        {{ column_name }}{% if not forloop.last %},{% endif %}{% endfor %}
+    INSERT INTO {{ new_db_table_name }} ({% for column in columns %}
+        {{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}
     )
-    VALUES ({% for column_name in new_column_names %}
-        NEW.{{ column_name }}{% if not forloop.last %},{% endif %}{% endfor %}
-    );
+    VALUES ({% for column in columns %}
+        {{ column.new_value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    ){% if upsert %}
+    ON CONFLICT ({{ conflict_target }}) DO
+        UPDATE
+        SET{% for column in columns %}{% if not column.unique %}
+            {{ column.name }} = EXCLUDED.{{ column.name }}{% if not forloop.last %},{% endif %}{% endif %}{% endfor %}{% endif %};
 
     RETURN NEW;
 END;
@@ -0,0 +1,46 @@
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    assignments text[];
+BEGIN
+    SELECT array_remove(ARRAY[{% for column in updatable_columns %}
+        CASE WHEN bool_or({{ column.updated_value }} IS DISTINCT FROM target.{{ column.name }})
+            THEN $sync${{ column.name }} = {% if upsert %}EXCLUDED.{{ column.name }}{% else %}{{ column.updated_value }}{% endif %}$sync$ END{% if not forloop.last %},{% endif %}{% endfor %}
+    ], NULL)
+    INTO assignments
+    FROM updated_rows
+    JOIN {{ new_db_table_name }} AS target
+        ON target.{{ pk_name }} = updated_rows.{{ pk_name }}{% for column in partition_columns %}
+        AND target.{{ column.name }} = {{ column.updated_value }}{% endfor %};
+{% if upsert %}
+    EXECUTE $sync$INSERT INTO {{ new_db_table_name }} ({% for column in columns %}{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})
+        SELECT {% for column in columns %}{{ column.value }}{% if not forloop.last %}, {% endif %}{% endfor %}
+        FROM updated_rows
+        ON CONFLICT ({{ conflict_target }}) DO $sync$
+        || CASE WHEN assignments = '{}' THEN 'NOTHING'
+                ELSE 'UPDATE SET ' || array_to_string(assignments, ', ')
+                    || $sync$ WHERE ({% for column in updatable_columns %}{{ new_db_table_name }}.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})
+            IS DISTINCT FROM ({% for column in updatable_columns %}EXCLUDED.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})$sync$ END;{% else %}
+    IF assignments <> '{}' THEN
+        EXECUTE $sync$UPDATE {{ new_db_table_name }} AS target SET $sync$
+            || array_to_string(assignments, ', ')
+            || $sync$ FROM updated_rows
+        WHERE target.{{ pk_name }} = updated_rows.{{ pk_name }}{% for column in partition_columns %}
+            AND target.{{ column.name }} = {{ column.updated_value }}{% endfor %}
+            AND ({% for column in updatable_columns %}target.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})
+                IS DISTINCT FROM ({% for column in updatable_columns %}{{ column.updated_value }}{% if not forloop.last %}, {% endif %}{% endfor %})$sync$;
+    END IF;{% endif %}
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_update_trigger
+    AFTER UPDATE
+    ON {{ old_db_table_name }}
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_update();
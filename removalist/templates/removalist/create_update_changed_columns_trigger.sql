@@ -0,0 +1,45 @@
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    new_row {{ new_db_table_name }}%ROWTYPE;
+    old_row {{ new_db_table_name }}%ROWTYPE;
+    assignments text[] := '{}';
+BEGIN{% for column in columns %}
+    new_row.{{ column.name }} := {{ column.new_value }};{% endfor %}{% if upsert %}
+
+    SELECT * INTO old_row
+    FROM {{ new_db_table_name }}
+    WHERE {{ pk_name }} = new_row.{{ pk_name }}{% for column in partition_columns %}
+        AND {{ column.name }} = new_row.{{ column.name }}{% endfor %};{% else %}{% for column in columns %}
+    old_row.{{ column.name }} := {{ column.old_value }};{% endfor %}{% endif %}
+{% for column in updatable_columns %}
+    IF new_row.{{ column.name }} IS DISTINCT FROM old_row.{{ column.name }} THEN
+        assignments := array_append(assignments, '{{ column.name }} = {% if upsert %}EXCLUDED.{{ column.name }}{% else %}($1).{{ column.name }}{% endif %}');
+    END IF;{% endfor %}
+{% if upsert %}
+    EXECUTE 'INSERT INTO {{ new_db_table_name }} ({% for column in columns %}{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %}) '
+        || 'VALUES ({% for column in columns %}($1).{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %}) '
+        || 'ON CONFLICT ({{ conflict_target }}) DO '
+        || CASE WHEN assignments = '{}' THEN 'NOTHING'
+                ELSE 'UPDATE SET ' || array_to_string(assignments, ', ') END
+        USING new_row;{% else %}
+    IF assignments <> '{}' THEN
+        EXECUTE 'UPDATE {{ new_db_table_name }} SET '
+            || array_to_string(assignments, ', ')
+            || ' WHERE {{ pk_name }} = ($1).{{ pk_name }}{% for column in partition_columns %} AND {{ column.name }} = ($2).{{ column.name }}{% endfor %}'
+            USING new_row, old_row;
+    END IF;{% endif %}
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_update_trigger
+    AFTER UPDATE
+    ON {{ old_db_table_name }}
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_update();
@@ -0,0 +1,37 @@
+CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN{% if upsert %}
+    INSERT INTO {{ new_db_table_name }} ({% for column in columns %}
+        {{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}
+    )
+    SELECT{% for column in columns %}
+        {{ column.value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    FROM updated_rows
+    ON CONFLICT ({{ conflict_target }}) DO
+        UPDATE
+        SET{% for column in updatable_columns %}
+            {{ column.name }} = EXCLUDED.{{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}
+        WHERE ({% for column in updatable_columns %}{{ new_db_table_name }}.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})
+            IS DISTINCT FROM ({% for column in updatable_columns %}EXCLUDED.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %});{% else %}
+    UPDATE {{ new_db_table_name }} AS target
+    SET{% for column in updatable_columns %}
+        {{ column.name }} = {{ column.updated_value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    FROM updated_rows
+    WHERE target.{{ pk_name }} = updated_rows.{{ pk_name }}{% for column in partition_columns %}
+        AND target.{{ column.name }} = {{ column.updated_value }}{% endfor %}
+        AND ({% for column in updatable_columns %}target.{{ column.name }}{% if not forloop.last %}, {% endif %}{% endfor %})
+            IS DISTINCT FROM ({% for column in updatable_columns %}{{ column.updated_value }}{% if not forloop.last %}, {% endif %}{% endfor %});{% endif %}
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_update_trigger
+    AFTER UPDATE
+    ON {{ old_db_table_name }}
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_update();
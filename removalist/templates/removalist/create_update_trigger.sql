@@ -1,11 +1,22 @@
 CREATE OR REPLACE FUNCTION {{ old_db_table_name }}_to_{{ new_db_table_name }}_update()
 RETURNS TRIGGER AS
 $BODY$
-BEGIN
+BEGIN{% if upsert %}
+    INSERT INTO {{ new_db_table_name }} ({% for column in columns %}
+        {{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %}
+    )
+    VALUES ({% for column in columns %}
+        {{ column.new_value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    )
+    ON CONFLICT ({{ conflict_target }}) DO
+        UPDATE
+        SET{% for column in updatable_columns %}
+            {{ column.name }} = EXCLUDED.{{ column.name }}{% if not forloop.last %},{% endif %}{% endfor %};{% else %}
     UPDATE {{ new_db_table_name }}
-    SET{% for column_name in new_column_names %}{% if column_name not in new_unique_column_names %}
-        {{ column_name }} = NEW.{{ column_name }}{% if not forloop.last %},{% endif %}{% endif %}{% endfor %}
-    WHERE {{ pk_name }} = NEW.{{ pk_name }};
+    SET{% for column in updatable_columns %}
+        {{ column.name }} = {{ column.new_value }}{% if not forloop.last %},{% endif %}{% endfor %}
+    WHERE {{ pk_name }} = NEW.{{ pk_name }}{% for column in partition_columns %}
+        AND {{ column.name }} = {{ column.old_value }}{% endfor %};{% endif %}
 
     RETURN NEW;
 END;
@@ -17,4 +28,5 @@ CREATE TRIGGER {{ old_db_table_name }}_to_{{ new_db_table_name }}_update_trigger
     AFTER UPDATE
     ON {{ old_db_table_name }}
     FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
     EXECUTE PROCEDURE {{ old_db_table_name }}_to_{{ new_db_table_name }}_update();
@@ -0,0 +1,6 @@
+DELETE FROM {{ new_db_table_name }}
+WHERE {{ pk_name }} = ANY(%s)
+    AND NOT EXISTS (
+        SELECT 1 FROM {{ old_db_table_name }}
+        WHERE {{ old_db_table_name }}.{{ pk_name }} = {{ new_db_table_name }}.{{ pk_name }}
+    );
@@ -0,0 +1,6 @@
+DROP TRIGGER IF EXISTS {{ old_db_table_name }}_to_{{ new_db_table_name }}_changelog_trigger
+     ON {{ old_db_table_name }};
+
+DROP FUNCTION IF EXISTS {{ old_db_table_name }}_to_{{ new_db_table_name }}_changelog();
+{% if not keep_table %}
+DROP TABLE IF EXISTS {{ changelog_table_name }};{% endif %}
@@ -0,0 +1,158 @@
+"""
+Load-aware throttling of batched backfills.
+
+A `Throttle` adapts the number of primary keys copied per transaction and
+the pause between transactions to the load on the database. It grows the
+batches while copying a range stays below the target duration and shrinks
+them when it takes longer. When replicas fall behind or other sessions wait
+for locks on the copied tables, it halves the batch size and backs off
+exponentially, up to the configured ceilings.
+"""
+import threading
+import time
+
+from . import instrumentation
+
+DEFAULT_TARGET_DURATION = 0.5
+DEFAULT_MAX_SLEEP = 30.0
+DEFAULT_MAX_REPLICATION_LAG = 10.0
+DEFAULT_MAX_LOCK_WAITS = 0
+DEFAULT_CHECK_INTERVAL = 5.0
+MIN_SLEEP = 0.1
+
+
+def get_replication_lag(connection):
+    """
+    Return the replay lag in seconds of the replica that is furthest behind,
+    or ``0`` if no replica is connected.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) '
+                       'FROM pg_stat_replication;')
+        return float(cursor.fetchone()[0])
+
+
+def get_lock_waits(connection, tables):
+    """
+    Return the number of lock requests on any of *tables* that are waiting
+    to be granted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM pg_locks '
+                       'WHERE NOT granted AND relation = ANY(%s::regclass[]);',
+                       [list(tables)])
+        return cursor.fetchone()[0]
+
+
+class Throttle(object):
+    """
+    Adapt the batch size between *min_batch_size* and *max_batch_size* so
+    that copying a range takes about *target_duration* seconds, and pause up
+    to *max_sleep* seconds between ranges while the replication lag exceeds
+    *max_replication_lag* seconds or more than *max_lock_waits* lock
+    requests wait on the old or new table. The load is queried at most every
+    *check_interval* seconds. A throttle can be shared by several workers.
+    """
+
+    def __init__(self, old_model, new_model, batch_size,
+                 min_batch_size=None, max_batch_size=None,
+                 target_duration=DEFAULT_TARGET_DURATION,
+                 max_sleep=DEFAULT_MAX_SLEEP,
+                 max_replication_lag=DEFAULT_MAX_REPLICATION_LAG,
+                 max_lock_waits=DEFAULT_MAX_LOCK_WAITS,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.tables = (old_model._meta.db_table, new_model._meta.db_table)
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size or max(batch_size // 100, 1)
+        self.max_batch_size = max_batch_size or batch_size * 10
+        self.target_duration = target_duration
+        self.max_sleep = max_sleep
+        self.max_replication_lag = max_replication_lag
+        self.max_lock_waits = max_lock_waits
+        self.check_interval = check_interval
+
+        self.sleep = 0
+        self.last_check = None
+        self.lock = threading.Lock()
+
+    def get_overload(self, connection):
+        """
+        Return the reason why the database is considered overloaded or
+        ``None``.
+        """
+        if self.max_replication_lag is not None:
+            lag = get_replication_lag(connection)
+            if lag > self.max_replication_lag:
+                return 'replication_lag'
+
+        if self.max_lock_waits is not None:
+            lock_waits = get_lock_waits(connection, self.tables)
+            if lock_waits > self.max_lock_waits:
+                return 'lock_waits'
+
+        return None
+
+    def clamp(self, batch_size):
+        return int(min(max(batch_size, self.min_batch_size),
+                       self.max_batch_size))
+
+    def update(self, connection, duration):
+        """
+        Adjust the batch size and the pause after copying a range took
+        *duration* seconds. Returns the number of seconds to pause before
+        copying the next range.
+        """
+        with self.lock:
+            now = time.time()
+            checked = (self.last_check is None or
+                       now - self.last_check >= self.check_interval)
+
+            reason = None
+            if checked:
+                self.last_check = now
+                reason = self.get_overload(connection)
+
+            if reason:
+                self.batch_size = self.clamp(self.batch_size // 2)
+                self.sleep = min(max(self.sleep * 2, MIN_SLEEP),
+                                 self.max_sleep)
+
+                instrumentation.emit('backfill_throttled',
+                                     old_table=self.tables[0],
+                                     new_table=self.tables[1],
+                                     reason=reason,
+                                     batch_size=self.batch_size,
+                                     sleep=self.sleep)
+
+            # While backing off, the load has to be checked again before
+            # speeding up.
+            elif checked or not self.sleep:
+                if duration > 0:
+                    # Never more than double the batch size at once, the
+                    # duration of very small ranges is mostly overhead.
+                    factor = min(self.target_duration / duration, 2.0)
+                    self.batch_size = self.clamp(self.batch_size * factor)
+
+                self.sleep = self.sleep / 2 if self.sleep > MIN_SLEEP else 0
+
+            return self.sleep
+
+    def wait(self, connection, duration):
+        sleep = self.update(connection, duration)
+        if sleep:
+            time.sleep(sleep)
+
+
+def get_throttle(old_model, new_model, batch_size, options):
+    """
+    Return a `Throttle` for *options* as passed to the duplication
+    operations: ``None`` or ``False`` for no throttling, ``True`` for the
+    defaults or a dict of `Throttle` arguments.
+    """
+    if not options:
+        return None
+
+    if options is True:
+        options = {}
+
+    return Throttle(old_model, new_model, batch_size, **options)
@@ -0,0 +1,281 @@
+import threading
+import time
+
+import structlog
+
+from django.db import connections
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Full, Queue
+
+from . import builder
+
+log = structlog.get_logger(__name__)
+
+DEFAULT_MAX_CHUNKS = 64
+DEFAULT_CATCH_UP_BATCH_SIZE = 10000
+
+
+class CopyBuffer(object):
+    """
+    A bounded in-memory pipe connecting a ``COPY ... TO STDOUT`` on one
+    connection with a ``COPY ... FROM STDIN`` on another. The producer writes
+    the raw COPY data as it arrives and blocks once *max_chunks* chunks are
+    waiting to be read, so memory use doesn't depend on the table size.
+    """
+
+    def __init__(self, max_chunks=DEFAULT_MAX_CHUNKS):
+        self.chunks = Queue(maxsize=max_chunks)
+        self.pending = b''
+        self.finished = False
+        self.aborted = False
+
+    def put(self, chunk):
+        while True:
+            if self.aborted:
+                raise IOError('copy buffer has been aborted')
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def write(self, data):
+        self.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.put(None)
+
+    def abort(self):
+        """
+        Stop the transfer from the reading side. A producer waiting for free
+        space in the buffer raises an `IOError` instead of blocking forever.
+        """
+        self.aborted = True
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except Empty:
+                break
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.pending) < size):
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.finished = True
+            else:
+                self.pending += chunk
+
+        if size < 0:
+            size = len(self.pending)
+
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def stream_copy(source_cursor, copy_out_statement, target_cursor,
+                copy_in_statement, max_chunks=DEFAULT_MAX_CHUNKS):
+    """
+    Stream the output of *copy_out_statement* executed on *source_cursor*
+    into *copy_in_statement* executed on *target_cursor*. The source side
+    runs in a separate thread writing into a `CopyBuffer`. Returns the number
+    of rows reported by the target.
+    """
+    buffer = CopyBuffer(max_chunks)
+    errors = []
+
+    def copy_out():
+        try:
+            source_cursor.copy_expert(copy_out_statement, buffer)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            if not buffer.aborted:
+                buffer.close()
+
+    producer = threading.Thread(target=copy_out, name='removalist-copy-out')
+    producer.start()
+
+    try:
+        target_cursor.copy_expert(copy_in_statement, buffer)
+    except Exception:
+        buffer.abort()
+        raise
+    finally:
+        producer.join()
+
+    if errors:
+        raise errors[0]
+
+    return target_cursor.rowcount
+
+
+def get_copy_statements(old_model, new_model, pk_filter=None):
+    """
+    Return the ``COPY ... TO STDOUT`` statement reading the rows of
+    *old_model* and the ``COPY ... FROM STDIN`` statement writing them into
+    the table of *new_model*, both in binary format. *pk_filter* is an
+    optional SQL condition restricting the rows read from the old table.
+    """
+    column_names = [f.get_attname_column()[0] for f in old_model._meta.fields]
+    columns = ', '.join(column_names)
+
+    query = 'SELECT {} FROM {}'.format(columns, old_model._meta.db_table)
+    if pk_filter:
+        query = '{} WHERE {}'.format(query, pk_filter)
+
+    copy_out_statement = 'COPY ({}) TO STDOUT (FORMAT binary);'.format(query)
+    copy_in_statement = 'COPY {} ({}) FROM STDIN (FORMAT binary);'.format(
+        new_model._meta.db_table, columns)
+
+    return copy_out_statement, copy_in_statement
+
+
+def start_capture(source, old_model, new_model):
+    """
+    Create the changelog trigger on the old table in the *source* database
+    that records all changes happening while the data is transferred.
+    """
+    pk_type = old_model._meta.pk.rel_db_type(source)
+
+    with source.cursor() as cursor:
+        cursor.execute('BEGIN;')
+        cursor.execute(builder.create_changelog_trigger(old_model, new_model,
+                                                        pk_type))
+        cursor.execute('COMMIT;')
+
+
+def stop_capture(source, old_model, new_model):
+    with source.cursor() as cursor:
+        cursor.execute(builder.drop_changelog_trigger(old_model, new_model))
+
+
+def copy_table(source, target, old_model, new_model,
+               max_chunks=DEFAULT_MAX_CHUNKS):
+    """
+    Copy all rows of the old table in *source* into the new table in
+    *target* using a single streamed binary COPY. The new table is expected
+    to be empty.
+    """
+    copy_out_statement, copy_in_statement = get_copy_statements(old_model,
+                                                                new_model)
+    started_at = time.time()
+
+    with source.cursor() as source_cursor, target.cursor() as target_cursor:
+        target_cursor.execute('BEGIN;')
+        rows_copied = stream_copy(source_cursor, copy_out_statement,
+                                  target_cursor, copy_in_statement,
+                                  max_chunks)
+        target_cursor.execute('COMMIT;')
+
+    log.info('table copied',
+             old_table=old_model._meta.db_table,
+             new_table=new_model._meta.db_table,
+             rows_copied=rows_copied,
+             elapsed=round(time.time() - started_at, 3))
+
+    return rows_copied
+
+
+def apply_changelog_batch(source, target, old_model, new_model,
+                          batch_size=DEFAULT_CATCH_UP_BATCH_SIZE,
+                          max_chunks=DEFAULT_MAX_CHUNKS):
+    """
+    Apply the oldest *batch_size* changelog entries to the new table. All
+    rows with a recorded change are deleted from the new table and streamed
+    again from the current state of the old table, so repeated changes to
+    the same row are only transferred once. Returns the number of changelog
+    entries processed.
+    """
+    changelog_table_name = builder.get_changelog_table_name(old_model,
+                                                            new_model)
+    pk_column = old_model._meta.pk.column
+
+    with source.cursor() as cursor:
+        cursor.execute(
+            'SELECT id, row_pk FROM {} ORDER BY id LIMIT %s;'.format(
+                changelog_table_name),
+            [batch_size])
+        entries = cursor.fetchall()
+
+    if not entries:
+        return 0
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pks = sorted(set(row_pk for _, row_pk in entries))
+
+    with source.cursor() as source_cursor, target.cursor() as target_cursor:
+        pk_filter = source_cursor.mogrify(
+            '{} = ANY(%s)'.format(pk_column), [pks]).decode()
+        copy_out_statement, copy_in_statement = get_copy_statements(
+            old_model, new_model, pk_filter)
+
+        target_cursor.execute('BEGIN;')
+        target_cursor.execute(
+            'DELETE FROM {} WHERE {} = ANY(%s);'.format(
+                new_model._meta.db_table, pk_column),
+            [pks])
+        stream_copy(source_cursor, copy_out_statement,
+                    target_cursor, copy_in_statement, max_chunks)
+        target_cursor.execute('COMMIT;')
+
+        # Entries are deleted by ID rather than up to the last one because
+        # IDs are assigned before commit and a lower one might only become
+        # visible after reading this batch.
+        source_cursor.execute(
+            'DELETE FROM {} WHERE id = ANY(%s);'.format(changelog_table_name),
+            [entry_ids])
+
+    log.info('changelog batch applied',
+             old_table=old_model._meta.db_table,
+             new_table=new_model._meta.db_table,
+             entries=len(entries),
+             rows=len(pks))
+
+    return len(entries)
+
+
+def catch_up(source, target, old_model, new_model,
+             batch_size=DEFAULT_CATCH_UP_BATCH_SIZE,
+             max_chunks=DEFAULT_MAX_CHUNKS):
+    """
+    Apply changelog batches until the changelog has been drained. Returns
+    the total number of changelog entries processed.
+    """
+    entries_applied = 0
+
+    while True:
+        applied = apply_changelog_batch(source, target, old_model, new_model,
+                                        batch_size, max_chunks)
+        entries_applied += applied
+
+        if applied < batch_size:
+            return entries_applied
+
+
+def transfer_model_data(old_model, new_model, source_alias, target_alias,
+                        batch_size=DEFAULT_CATCH_UP_BATCH_SIZE,
+                        max_chunks=DEFAULT_MAX_CHUNKS):
+    """
+    Transfer all rows of the table of *old_model* in the database
+    *source_alias* into the table of *new_model* in the database
+    *target_alias*.
+
+    A changelog trigger is installed on the old table first, then all rows
+    are streamed with a binary COPY and finally all changes recorded during
+    the copy are applied. The changelog trigger stays in place so that
+    `catch_up` can be called again until writes to the old table have
+    stopped and `stop_capture` removes it. Both tables need to have the same
+    column types for the binary format to be compatible.
+    """
+    source = connections[source_alias]
+    target = connections[target_alias]
+
+    start_capture(source, old_model, new_model)
+    copy_table(source, target, old_model, new_model, max_chunks)
+
+    return catch_up(source, target, old_model, new_model, batch_size,
+                    max_chunks)
@@ -0,0 +1,128 @@
+"""
+Cost of the triggers installed by removalist.
+
+The trigger functions are named ``<old table>_to_<new table>_<event>``
+after the templates, with *event* being ``insert``, ``update``, ``delete``
+or ``changelog``. Their calls and execution times are read from
+``pg_stat_user_functions``, which is only populated with the
+``track_functions`` setting set to ``pl`` or ``all``. The times are
+cumulative since the statistics were last reset, comparing two snapshots
+gives the cost over an interval.
+"""
+from collections import namedtuple
+
+from . import instrumentation
+
+EVENTS = ('insert', 'update', 'delete', 'changelog')
+
+# Calls and times in milliseconds of the trigger function syncing *event*
+# from *old_table* to *new_table*. *self_time* excludes the time spent in
+# other functions called by the trigger.
+TriggerCost = namedtuple('TriggerCost', ['old_table', 'new_table', 'event',
+                                         'function', 'calls', 'total_time',
+                                         'self_time'])
+
+TRIGGER_COSTS_STATEMENT = """
+SELECT
+    old_table.relname,
+    function.proname,
+    COALESCE(stats.calls, 0),
+    COALESCE(stats.total_time, 0),
+    COALESCE(stats.self_time, 0)
+FROM pg_trigger AS trigger
+JOIN pg_class AS old_table ON old_table.oid = trigger.tgrelid
+JOIN pg_proc AS function ON function.oid = trigger.tgfoid
+LEFT JOIN pg_stat_user_functions AS stats ON stats.funcid = function.oid
+WHERE NOT trigger.tgisinternal
+    -- PostgreSQL truncates the trigger names like any other identifier.
+    AND trigger.tgname = left(function.proname || '_trigger', 63)
+ORDER BY old_table.relname, function.proname;"""
+
+
+def get_track_functions(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW track_functions;')
+        return cursor.fetchone()[0]
+
+
+def parse_function_name(old_table, function):
+    """
+    Return the new table and the event of the trigger *function* on
+    *old_table*, or ``None`` if it doesn't follow the naming of the
+    removalist templates.
+    """
+    prefix = '{}_to_'.format(old_table)
+
+    for event in EVENTS:
+        suffix = '_{}'.format(event)
+        if (function.startswith(prefix) and function.endswith(suffix) and
+                len(function) > len(prefix) + len(suffix)):
+            return function[len(prefix):-len(suffix)], event
+
+    return None
+
+
+def get_trigger_costs(connection):
+    """
+    Return a `TriggerCost` for every trigger installed by removalist in the
+    database of *connection*.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(TRIGGER_COSTS_STATEMENT)
+        rows = cursor.fetchall()
+
+    costs = []
+    for old_table, function, calls, total_time, self_time in rows:
+        parsed = parse_function_name(old_table, function)
+        if parsed is None:
+            continue
+
+        new_table, event = parsed
+        costs.append(TriggerCost(old_table, new_table, event, function,
+                                 calls, float(total_time), float(self_time)))
+
+    return costs
+
+
+def get_cost_difference(before, after):
+    """
+    Return the costs of the triggers in *after* minus their costs in the
+    earlier snapshot *before*. Triggers that have been created in between
+    are returned as they are.
+    """
+    previous = {cost.function: cost for cost in before}
+
+    differences = []
+    for cost in after:
+        earlier = previous.get(cost.function)
+        if earlier is not None:
+            cost = cost._replace(
+                calls=cost.calls - earlier.calls,
+                total_time=cost.total_time - earlier.total_time,
+                self_time=cost.self_time - earlier.self_time)
+        differences.append(cost)
+
+    return differences
+
+
+def get_cost_data(cost):
+    """
+    Return the *cost* as a dict including the mean time per call in
+    milliseconds, e.g. to export it.
+    """
+    data = cost._asdict()
+    data['total_time'] = round(cost.total_time, 3)
+    data['self_time'] = round(cost.self_time, 3)
+    data['mean_time'] = (round(cost.total_time / cost.calls, 6)
+                         if cost.calls else None)
+    return data
+
+
+def emit_trigger_costs(costs, **data):
+    """
+    Emit a ``trigger_cost`` event for each of *costs*, so they reach the
+    metrics hooks (see `instrumentation`).
+    """
+    for cost in costs:
+        instrumentation.emit('trigger_cost', **dict(get_cost_data(cost),
+                                                    **data))
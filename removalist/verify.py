@@ -0,0 +1,234 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+try:
+    from queue import Empty, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Queue
+
+from . import backfill, instrumentation
+
+DEFAULT_VERIFY_BATCH_SIZE = 100000
+DEFAULT_VERIFY_WORKERS = 4
+# Ranges with at most this many primary keys are compared row by row instead
+# of being split any further.
+DEFAULT_ROW_COMPARE_SIZE = 1000
+DRILL_DOWN_SPLITS = 10
+
+# The primary keys that are only in the old table (missing), only in the new
+# table (extra) or in both tables with different values (changed).
+VerificationReport = namedtuple('VerificationReport', [
+    'missing_pks', 'extra_pks', 'changed_pks', 'ranges_checked',
+    'mismatched_ranges'])
+
+
+def is_consistent(report):
+    return not (report.missing_pks or report.extra_pks or report.changed_pks)
+
+
+def get_row_hash_expression(old_model):
+    # Both tables are hashed with the column order of the old model, so the
+    # column order in the new table doesn't matter.
+    column_names = [f.get_attname_column()[1] for f in old_model._meta.fields]
+    return 'md5(ROW({})::text)'.format(', '.join(column_names))
+
+
+def get_range_checksum_statement(model, row_hash):
+    """
+    Return the statement aggregating the row hashes of all rows of *model*
+    with a primary key in a half-open range passed as two query parameters
+    into a row count and a single checksum.
+    """
+    return ("SELECT count(*), md5(string_agg({row_hash}, '' ORDER BY {pk})) "
+            "FROM {table} WHERE {pk} >= %s AND {pk} < %s;").format(
+                row_hash=row_hash,
+                pk=model._meta.pk.column,
+                table=model._meta.db_table)
+
+
+def get_row_hashes_statement(model, row_hash):
+    return ('SELECT {pk}, {row_hash} FROM {table} '
+            'WHERE {pk} >= %s AND {pk} < %s;').format(
+                row_hash=row_hash,
+                pk=model._meta.pk.column,
+                table=model._meta.db_table)
+
+
+def get_verify_bounds(connection, old_model, new_model):
+    """
+    Return the smallest and largest primary key over both tables, or
+    ``(None, None)`` if both are empty.
+    """
+    bounds = [bound
+              for bound in (backfill.get_pk_bounds(connection, old_model) +
+                            backfill.get_pk_bounds(connection, new_model))
+              if bound is not None]
+
+    if not bounds:
+        return None, None
+
+    return min(bounds), max(bounds)
+
+
+def iter_sub_ranges(start, end, splits=DRILL_DOWN_SPLITS):
+    step = max((end - start + splits - 1) // splits, 1)
+    for sub_start in range(start, end, step):
+        yield sub_start, min(sub_start + step, end)
+
+
+class RangeVerifier(object):
+    """
+    Compare the rows of *old_model* and *new_model* within primary key
+    ranges. All queries for a range run in a single ``REPEATABLE READ``
+    snapshot, so changes that the triggers apply to both tables at once
+    don't show up as differences. Mismatching ranges are split up until
+    they are small enough to be compared row by row.
+    """
+
+    def __init__(self, old_model, new_model,
+                 row_compare_size=DEFAULT_ROW_COMPARE_SIZE):
+        row_hash = get_row_hash_expression(old_model)
+
+        self.old_checksum_statement = get_range_checksum_statement(old_model,
+                                                                   row_hash)
+        self.new_checksum_statement = get_range_checksum_statement(new_model,
+                                                                   row_hash)
+        self.old_rows_statement = get_row_hashes_statement(old_model, row_hash)
+        self.new_rows_statement = get_row_hashes_statement(new_model, row_hash)
+        self.row_compare_size = row_compare_size
+
+    def compare_rows(self, cursor, start, end):
+        cursor.execute(self.old_rows_statement, [start, end])
+        old_rows = dict(cursor.fetchall())
+        cursor.execute(self.new_rows_statement, [start, end])
+        new_rows = dict(cursor.fetchall())
+
+        missing = sorted(set(old_rows) - set(new_rows))
+        extra = sorted(set(new_rows) - set(old_rows))
+        changed = sorted(pk for pk in set(old_rows) & set(new_rows)
+                         if old_rows[pk] != new_rows[pk])
+
+        return missing, extra, changed
+
+    def compare_range(self, cursor, start, end):
+        """
+        Return the missing, extra and changed primary keys within
+        ``[start, end)`` and the number of mismatching ranges found on the
+        way.
+        """
+        cursor.execute(self.old_checksum_statement, [start, end])
+        old_checksum = cursor.fetchone()
+        cursor.execute(self.new_checksum_statement, [start, end])
+        new_checksum = cursor.fetchone()
+
+        if tuple(old_checksum) == tuple(new_checksum):
+            return [], [], [], 0
+
+        if end - start <= self.row_compare_size:
+            missing, extra, changed = self.compare_rows(cursor, start, end)
+            return missing, extra, changed, 1
+
+        missing, extra, changed, mismatched = [], [], [], 1
+
+        for sub_start, sub_end in iter_sub_ranges(start, end):
+            result = self.compare_range(cursor, sub_start, sub_end)
+            missing += result[0]
+            extra += result[1]
+            changed += result[2]
+            mismatched += result[3]
+
+        return missing, extra, changed, mismatched
+
+    def verify(self, connection, start, end):
+        with connection.cursor() as cursor:
+            cursor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;')
+            try:
+                return self.compare_range(cursor, start, end)
+            finally:
+                cursor.execute('COMMIT;')
+
+
+def verify_ranges_from_queue(alias, verifier, ranges, results):
+    """
+    Verify the primary key ranges taken from the *ranges* queue until it is
+    empty, using a connection to the database *alias* that is exclusive to
+    the current thread. The result of each range is appended to *results*.
+    """
+    connection = connections[alias]
+
+    try:
+        while True:
+            try:
+                start, end = ranges.get_nowait()
+            except Empty:
+                break
+
+            results.append(verifier.verify(connection, start, end))
+    finally:
+        connection.close()
+
+
+def verify_model_data(connection, old_model, new_model,
+                      batch_size=DEFAULT_VERIFY_BATCH_SIZE,
+                      workers=DEFAULT_VERIFY_WORKERS,
+                      row_compare_size=DEFAULT_ROW_COMPARE_SIZE):
+    """
+    Compare the data in the tables of *old_model* and *new_model* and return
+    a `VerificationReport`. The primary key space is split into ranges of
+    *batch_size* that are compared by an md5 checksum over all rows of the
+    range, computed in the database. The ranges are checked concurrently by
+    *workers* threads, each with a database connection of its own, and only
+    ranges with a different checksum are compared in more detail.
+    """
+    started_at = time.time()
+    lower, upper = get_verify_bounds(connection, old_model, new_model)
+    tables = instrumentation.get_table_data(old_model, new_model)
+
+    if lower is None:
+        report = VerificationReport([], [], [], 0, 0)
+    else:
+        verifier = RangeVerifier(old_model, new_model, row_compare_size)
+
+        ranges = Queue()
+        for pk_range in backfill.iter_pk_ranges(lower, upper, batch_size):
+            ranges.put(pk_range)
+        ranges_checked = ranges.qsize()
+
+        results = []
+
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(verify_ranges_from_queue,
+                                    connection.alias, verifier, ranges,
+                                    results)
+                    for _ in range(workers)]
+                for future in futures:
+                    future.result()
+        else:
+            while not ranges.empty():
+                start, end = ranges.get_nowait()
+                results.append(verifier.verify(connection, start, end))
+
+        report = VerificationReport(
+            missing_pks=sorted(pk for r in results for pk in r[0]),
+            extra_pks=sorted(pk for r in results for pk in r[1]),
+            changed_pks=sorted(pk for r in results for pk in r[2]),
+            ranges_checked=ranges_checked,
+            mismatched_ranges=sum(r[3] for r in results))
+
+    instrumentation.emit(
+        'verification_finished',
+        consistent=is_consistent(report),
+        missing_rows=len(report.missing_pks),
+        extra_rows=len(report.extra_pks),
+        changed_rows=len(report.changed_pks),
+        ranges_checked=report.ranges_checked,
+        mismatched_ranges=report.mismatched_ranges,
+        elapsed=round(time.time() - started_at, 3),
+        **tables)
+
+    return report
@@ -4,7 +4,7 @@ import sys
 from setuptools import setup, find_packages
 from setuptools.command.test import test as TestCommand
 
-requires = ['django', 'structlog']
+requires = ['django', 'structlog', 'futures; python_version < "3"']
 tests_require = ['pytest', 'pytest-cache', 'pytest-cov', 'factory-boy']
 
 
@@ -0,0 +1,73 @@
+"""
+Benchmarks for the trigger overhead and the backfill of the duplication.
+
+They require a PostgreSQL database and are only run if
+``REMOVALIST_BENCHMARK`` is set in the environment::
+
+    REMOVALIST_BENCHMARK=1 py.test tests/benchmarks
+
+Each result is appended as a JSON object on a line of its own to the file
+in ``REMOVALIST_BENCHMARK_OUTPUT`` (``benchmark-results.jsonl`` by default)
+to allow tracking them across releases.
+"""
+import json
+import os
+import time
+
+import django
+import pytest
+
+from django.db import connection
+
+from ..sample_app.models import OldUser
+
+benchmark = pytest.mark.skipif(not os.environ.get('REMOVALIST_BENCHMARK'),
+                               reason='REMOVALIST_BENCHMARK is not set')
+
+
+def get_int_list(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return [int(v) for v in value.split(',')]
+
+
+def get_postgres_version():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW server_version;')
+        return cursor.fetchone()[0]
+
+
+def record(name, params, metrics):
+    """
+    Append the *metrics* measured by the benchmark *name* with *params* to
+    the results file.
+    """
+    result = {
+        'benchmark': name,
+        'params': params,
+        'metrics': metrics,
+        'timestamp': time.time(),
+        'django_version': django.get_version(),
+        'postgres_version': get_postgres_version(),
+    }
+
+    path = os.environ.get('REMOVALIST_BENCHMARK_OUTPUT',
+                          'benchmark-results.jsonl')
+    with open(path, 'a') as results_file:
+        results_file.write(json.dumps(result, sort_keys=True) + '\n')
+
+    return result
+
+
+def populate_old_users(group, rows):
+    """
+    Insert *rows* users into the old table with a single set-based
+    statement, which is fast enough for tens of millions of rows.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {} (text, number, group_id) '
+            "SELECT 'User ' || n, n, %s FROM generate_series(1, %s) AS n;"
+            .format(OldUser._meta.db_table),
+            [group.id, rows])
@@ -0,0 +1,97 @@
+"""
+Measure how the backfill of the different duplication modes scales with the
+size of the old table and how long locks are held while doing so.
+"""
+import time
+
+import pytest
+
+from django.db import connection
+
+from removalist import operations
+from removalist.signals import duplication_event
+
+from ..sample_app.factories import GroupFactory
+from ..sample_app.models import NewUser, OldUser
+from ..sample_app.triggers import drop_triggers
+from . import benchmark, get_int_list, populate_old_users, record
+
+SIZES = get_int_list('REMOVALIST_BENCHMARK_SIZES',
+                     [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+
+MODES = {
+    'locked': {},
+    'batched': {'batch_size': 10000},
+    'online': {'online': True, 'batch_size': 10000},
+    'parallel': {'online': True, 'batch_size': 10000, 'workers': 4},
+}
+
+pytestmark = benchmark
+
+
+class EventRecorder(object):
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, signal, sender, event, **data):
+        self.events.append((time.time(), event, data))
+
+    def get(self, name):
+        return [(timestamp, data) for timestamp, event, data in self.events
+                if event == name]
+
+    def get_max_lock_hold_time(self):
+        """
+        The exclusive table lock is held from acquiring it until the end of
+        the duplication, the row locks of the batched copy for the duration
+        of a batch and the locks taken by the trigger DDL for the duration
+        of the statement.
+        """
+        hold_times = [data['duration']
+                      for _, data in self.get('statement_executed')
+                      if data['statement'].startswith('create_')]
+        hold_times += [data['batch_duration']
+                       for _, data in self.get('backfill_progress')]
+
+        locks = self.get('lock_acquired')
+        if locks:
+            finished_at = self.get('duplication_finished')[-1][0]
+            hold_times.append(finished_at - locks[0][0])
+
+        return max(hold_times) if hold_times else None
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('mode', sorted(MODES))
+@pytest.mark.parametrize('rows', SIZES)
+def test_backfill_scaling(rows, mode):
+    drop_triggers()
+    populate_old_users(GroupFactory(), rows)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE {};'.format(OldUser._meta.db_table))
+
+    recorder = EventRecorder()
+    duplication_event.connect(recorder)
+
+    try:
+        started_at = time.time()
+        with connection.schema_editor(atomic=False) as schema_editor:
+            operations.execute_create_triggers(schema_editor, OldUser,
+                                               NewUser, **MODES[mode])
+        duration = time.time() - started_at
+    finally:
+        duplication_event.disconnect(recorder)
+
+    lock_waits = [data['lock_wait_time']
+                  for _, data in recorder.get('lock_acquired')]
+
+    record('backfill',
+           {'mode': mode, 'rows': rows},
+           {'duration': duration,
+            'rows_per_second': rows / duration,
+            'lock_wait_time': max(lock_waits) if lock_waits else 0,
+            'max_lock_hold_time': recorder.get_max_lock_hold_time()})
+
+    assert NewUser.objects.count() == rows
@@ -0,0 +1,55 @@
+"""
+Compare the throughput of bulk writes on the old table with row level and
+statement level sync triggers.
+"""
+import os
+import time
+
+import pytest
+
+from django.db.models import F
+
+from ..sample_app.factories import GroupFactory
+from ..sample_app.models import NewUser, OldUser
+from ..sample_app.triggers import replace_triggers
+from . import benchmark, record
+
+ROWS = int(os.environ.get('REMOVALIST_BENCHMARK_ROWS', 100000))
+
+pytestmark = benchmark
+
+
+def run_bulk_writes(rows):
+    group = GroupFactory()
+    timings = {}
+
+    started_at = time.time()
+    OldUser.objects.bulk_create(
+        OldUser(text='User {}'.format(n), number=n, group=group)
+        for n in range(rows))
+    timings['insert'] = time.time() - started_at
+
+    started_at = time.time()
+    OldUser.objects.update(number=F('number') + 1)
+    timings['update'] = time.time() - started_at
+
+    started_at = time.time()
+    OldUser.objects.all().delete()
+    timings['delete'] = time.time() - started_at
+
+    return timings
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize('level', ('row', 'statement'))
+def test_bulk_write_throughput_by_trigger_level(level):
+    replace_triggers(statement_level=(level == 'statement'))
+
+    timings = run_bulk_writes(ROWS)
+
+    record('bulk_writes',
+           {'trigger_level': level, 'rows': ROWS},
+           {'{}_rows_per_second'.format(event): ROWS / duration
+            for event, duration in timings.items()})
+
+    assert NewUser.objects.count() == 0
@@ -0,0 +1,65 @@
+"""
+Measure the overhead the sync triggers add to single row writes on the old
+table, the way a web application usually writes to it.
+"""
+import os
+import time
+
+import pytest
+
+from ..sample_app.factories import GroupFactory, OldUserFactory
+from ..sample_app.models import NewUser, OldUser
+from ..sample_app.triggers import drop_triggers, replace_triggers
+from . import benchmark, record
+
+ROWS = int(os.environ.get('REMOVALIST_BENCHMARK_ROWS', 10000))
+
+pytestmark = benchmark
+
+TRIGGERS = {
+    'none': None,
+    'row': {},
+    'row_changed_columns_only': {'changed_columns_only': True},
+    'row_upsert': {'upsert': True},
+    'statement': {'statement_level': True},
+}
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize('triggers', sorted(TRIGGERS))
+def test_single_row_write_throughput(triggers):
+    if TRIGGERS[triggers] is None:
+        drop_triggers()
+    else:
+        replace_triggers(**TRIGGERS[triggers])
+
+    group = GroupFactory()
+
+    started_at = time.time()
+    users = [OldUserFactory(group=group) for _ in range(ROWS)]
+    insert_duration = time.time() - started_at
+
+    started_at = time.time()
+    for user in users:
+        user.text = 'Updated {}'.format(user.text)
+        user.save()
+    update_duration = time.time() - started_at
+
+    started_at = time.time()
+    for user in users:
+        user.save()
+    noop_update_duration = time.time() - started_at
+
+    started_at = time.time()
+    for user in users:
+        OldUser.objects.filter(pk=user.pk).delete()
+    delete_duration = time.time() - started_at
+
+    record('single_row_writes',
+           {'triggers': triggers, 'rows': ROWS},
+           {'insert_rows_per_second': ROWS / insert_duration,
+            'update_rows_per_second': ROWS / update_duration,
+            'noop_update_rows_per_second': ROWS / noop_update_duration,
+            'delete_rows_per_second': ROWS / delete_duration})
+
+    assert NewUser.objects.count() == 0
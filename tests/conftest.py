@@ -0,0 +1,12 @@
+import pytest
+
+from removalist import builder
+
+
+@pytest.fixture(autouse=True)
+def statement_cache():
+    # Statements rendered by one test must not hide template or model
+    # changes made by another.
+    builder.clear_statement_cache()
+    yield
+    builder.clear_statement_cache()
@@ -0,0 +1,30 @@
+from django.db import connection
+
+from removalist import builder
+
+from .models import NewUser, OldUser
+
+
+def drop_triggers():
+    with connection.cursor() as cursor:
+        for event in ('insert', 'update', 'delete'):
+            cursor.execute(builder.drop_trigger(event, OldUser, NewUser))
+
+
+def replace_triggers(**options):
+    """
+    Replace the sync triggers between `OldUser` and `NewUser` with ones
+    created with the given *options* (see `builder.create_trigger`).
+    """
+    drop_triggers()
+
+    with connection.cursor() as cursor:
+        for event in ('insert', 'update', 'delete'):
+            trigger_options = dict(options)
+            if event != 'update':
+                trigger_options.pop('changed_columns_only', None)
+            if event == 'delete':
+                trigger_options.pop('upsert', None)
+
+            cursor.execute(builder.create_trigger(event, OldUser, NewUser,
+                                                  **trigger_options))
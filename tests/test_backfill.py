@@ -0,0 +1,236 @@
+from unittest import mock
+
+import pytest
+
+from removalist import backfill
+
+
+def test_pk_ranges_cover_lower_and_upper_bound():
+    ranges = list(backfill.iter_pk_ranges(1, 25, 10))
+    assert ranges == [(1, 11), (11, 21), (21, 31)]
+
+
+def test_pk_ranges_for_single_row():
+    assert list(backfill.iter_pk_ranges(7, 7, 10)) == [(7, 17)]
+
+
+def test_pk_ranges_require_positive_batch_size():
+    with pytest.raises(ValueError):
+        list(backfill.iter_pk_ranges(1, 10, 0))
+
+
+def test_batched_copy_commits_each_range():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(1, 25), (30,)]
+    cursor.rowcount = 10
+
+    with mock.patch('removalist.backfill.builder') as builder:
+        rows_copied = backfill.copy_model_data_in_batches(
+            connection, mock.Mock(), mock.Mock(), batch_size=10)
+
+    statement = builder.copy_model_data_range.return_value
+
+    assert rows_copied == 30
+    assert cursor.execute.call_args_list[2:] == [
+        mock.call('BEGIN;'),
+        mock.call(statement, [1, 11]),
+        mock.call('COMMIT;'),
+        mock.call('BEGIN;'),
+        mock.call(statement, [11, 21]),
+        mock.call('COMMIT;'),
+        mock.call('BEGIN;'),
+        mock.call(statement, [21, 31]),
+        mock.call('COMMIT;')]
+
+
+def test_failed_range_is_rolled_back():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.execute.side_effect = [None, RuntimeError('copy failed'), None]
+    backfill_checkpoint = mock.Mock()
+
+    with pytest.raises(RuntimeError):
+        backfill.copy_range(connection, 'statement', 1, 11,
+                            backfill_checkpoint=backfill_checkpoint)
+
+    assert cursor.execute.call_args_list == [
+        mock.call('BEGIN;'),
+        mock.call('statement', [1, 11]),
+        mock.call('ROLLBACK;')]
+    assert backfill_checkpoint.commit.call_count == 0
+
+
+def test_batched_copy_of_empty_table():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (None, None)
+
+    with mock.patch('removalist.backfill.builder') as builder:
+        rows_copied = backfill.copy_model_data_in_batches(
+            connection, mock.Mock(), mock.Mock(), batch_size=10)
+
+    assert rows_copied == 0
+    assert builder.copy_model_data_range.call_count == 0
+
+
+def test_parallel_copy_distributes_ranges_over_workers():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (1, 100)
+
+    worker_connection = mock.MagicMock()
+    worker_cursor = (
+        worker_connection.cursor.return_value.__enter__.return_value)
+    worker_cursor.rowcount = 10
+
+    with mock.patch('removalist.backfill.builder') as builder, \
+            mock.patch('removalist.backfill.connections') as connections:
+        connections.__getitem__.return_value = worker_connection
+
+        rows_copied = backfill.copy_model_data_in_parallel(
+            connection, mock.Mock(), mock.Mock(), workers=3, batch_size=10)
+
+    statement = builder.copy_model_data_range.return_value
+    copied_ranges = sorted(
+        args[1] for args, _ in worker_cursor.execute.call_args_list
+        if args[0] is statement)
+
+    assert rows_copied == 100
+    assert copied_ranges == [[start, start + 10]
+                             for start in range(1, 101, 10)]
+    connections.__getitem__.assert_called_with(connection.alias)
+    assert worker_connection.close.call_count == 3
+
+
+def make_model(db_table, related_models=()):
+    model = mock.Mock()
+    model._meta.db_table = db_table
+    model._meta.fields = [mock.Mock(related_model=None)] + [
+        mock.Mock(related_model=related_model)
+        for related_model in related_models]
+    return model
+
+
+def make_related_model(db_table):
+    # The level grouping only follows foreign keys to model classes.
+    return type('Model', (object, ), {'_meta': mock.Mock(db_table=db_table)})
+
+
+def test_backfill_levels_follow_foreign_keys_between_new_tables():
+    group = (make_model('old_group'), make_model('new_group'))
+    user = (make_model('old_user'),
+            make_model('new_user', [make_related_model('new_group')]))
+    tag = (make_model('old_tag'),
+           make_model('new_tag', [make_related_model('other_table')]))
+
+    levels = backfill.get_backfill_levels([user, group, tag])
+
+    assert levels == [[group, tag], [user]]
+
+
+def test_backfill_levels_with_circular_foreign_keys():
+    first = (make_model('old_first'),
+             make_model('new_first', [make_related_model('new_second')]))
+    second = (make_model('old_second'),
+              make_model('new_second', [make_related_model('new_first')]))
+
+    assert backfill.get_backfill_levels([first, second]) == [[first, second]]
+
+
+def test_copy_model_pairs_copies_each_level_concurrently():
+    connection = mock.MagicMock()
+    group = (make_model('old_group'), make_model('new_group'))
+    user = (make_model('old_user'),
+            make_model('new_user', [make_related_model('new_group')]))
+    tag = (make_model('old_tag'), make_model('new_tag'))
+
+    with mock.patch('removalist.backfill.copy_model_data') as copy, \
+            mock.patch('removalist.backfill.connections') as connections:
+        copy.return_value = 10
+
+        rows_copied = backfill.copy_model_pairs(connection,
+                                                [user, group, tag],
+                                                batch_size=10)
+
+    copied_pairs = [args[1:3] for args, _ in copy.call_args_list]
+
+    assert rows_copied == 30
+    assert set(copied_pairs[:2]) == {group, tag}
+    assert copied_pairs[2] == user
+    assert copy.call_args_list[2][0][0] is connection
+    assert connections.__getitem__.return_value.close.call_count == 2
+
+
+def test_resumable_copy_continues_from_checkpoint():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(1, 25), (30,)]
+    cursor.rowcount = 10
+
+    backfill_checkpoint = mock.Mock()
+    backfill_checkpoint.resume.return_value = 21
+
+    with mock.patch('removalist.backfill.builder') as builder, \
+            mock.patch('removalist.backfill.checkpoint') as checkpoint:
+        checkpoint.BackfillCheckpoint.return_value = backfill_checkpoint
+
+        rows_copied = backfill.copy_model_data(
+            connection, mock.Mock(), mock.Mock(), batch_size=10,
+            resumable=True)
+
+    statement = builder.copy_model_data_range.return_value
+
+    assert rows_copied == 10
+    assert cursor.execute.call_args_list[2:] == [
+        mock.call('BEGIN;'),
+        mock.call(statement, [21, 31]),
+        mock.call('COMMIT;')]
+    backfill_checkpoint.record.assert_called_once_with(cursor, 21, 31, 10)
+    backfill_checkpoint.commit.assert_called_once_with(21, 31)
+    backfill_checkpoint.finish.assert_called_once_with(connection)
+
+
+def test_throttled_copy_uses_current_batch_size():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(1, 25), (30,)]
+    cursor.rowcount = 5
+
+    backfill_throttle = mock.Mock(batch_size=5)
+
+    def wait(connection, duration):
+        backfill_throttle.batch_size *= 2
+
+    backfill_throttle.wait.side_effect = wait
+
+    with mock.patch('removalist.backfill.builder') as builder:
+        backfill.copy_model_data_in_batches(
+            connection, mock.Mock(), mock.Mock(),
+            backfill_throttle=backfill_throttle)
+
+    statement = builder.copy_model_data_range.return_value
+    copied_ranges = [args[1] for args, _ in cursor.execute.call_args_list
+                     if args[0] is statement]
+
+    assert copied_ranges == [[1, 6], [6, 16], [16, 36]]
+    assert backfill_throttle.wait.call_count == 3
+
+
+def test_keyset_ranges_contain_batch_size_rows():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    # Primary keys with gaps: the 10th row after 1 is 40, after 40 it's 95.
+    cursor.fetchone.side_effect = [(40, ), (95, ), None]
+
+    model = mock.Mock()
+    model._meta.pk.column = 'id'
+    model._meta.db_table = 'testapp_oldmodel'
+
+    ranges = list(backfill.iter_keyset_pk_ranges(connection, model, 1, 120,
+                                                 10))
+
+    assert ranges == [(1, 40), (40, 95), (95, 121)]
+    assert cursor.execute.call_args_list[0] == mock.call(
+        'SELECT id FROM testapp_oldmodel WHERE id >= %s ORDER BY id '
+        'OFFSET %s LIMIT 1;', [1, 10])
@@ -1,3 +1,5 @@
+from unittest import mock
+
 import pytest
 
 from django.db import models
@@ -23,6 +25,19 @@ class OldModel(models.Model):
         db_table = 'testapp_oldmodel'
 
 
+class ReshapedModel(models.Model):
+    title = models.TextField()
+    number = models.IntegerField()
+    region = models.CharField(max_length=2)
+
+    class Meta:
+        db_table = 'testapp_reshapedmodel'
+
+
+MAPPING = {'column_map': {'title': 'upper({text})', 'region': "'eu'"},
+           'partition_columns': ['number']}
+
+
 def test_create_context_for_new_model():
     context = builder.get_context_from_model(NewModel, 'new')
 
@@ -50,6 +65,15 @@ def test_create_trigger_statement_generation(event):
     assert statement == globals()['CREATE_{}_TRIGGERS'.format(event.upper())]
 
 
+def test_update_context_excludes_unique_columns():
+    context = builder.get_context_from_model(NewModel, 'new',
+                                             ignore_unique=True)
+
+    assert context['new_updatable_column_names'] == ['text',
+                                                     'number',
+                                                     'group_id']
+
+
 @pytest.mark.parametrize('event', ('insert', 'update', 'delete'))
 def test_drop_trigger_statement_generation(event):
     statement = builder.drop_trigger(event, OldModel, NewModel)
@@ -60,11 +84,208 @@ def test_drop_trigger_statement_generation(event):
     assert statement == globals()['DROP_{}_TRIGGERS'.format(event.upper())]
 
 
+@pytest.mark.parametrize('event', ('insert', 'update'))
+def test_create_upsert_trigger_statement_generation(event):
+    statement = builder.create_trigger(event, OldModel, NewModel, upsert=True)
+    assert statement == globals()['CREATE_{}_UPSERT_TRIGGERS'.format(
+        event.upper())]
+
+
+@pytest.mark.parametrize('event', ('insert', 'update', 'delete'))
+def test_create_statement_trigger_generation(event):
+    statement = builder.create_trigger(event, OldModel, NewModel,
+                                       statement_level=True)
+    assert statement == globals()['CREATE_{}_STATEMENT_TRIGGERS'.format(
+        event.upper())]
+
+
+def test_create_upsert_statement_trigger_generation():
+    statement = builder.create_update_trigger(OldModel, NewModel, upsert=True,
+                                              statement_level=True)
+    assert statement == CREATE_UPDATE_UPSERT_STATEMENT_TRIGGERS
+
+
+@pytest.mark.parametrize('upsert', (False, True))
+@pytest.mark.parametrize('statement_level', (False, True))
+def test_create_changed_columns_only_update_trigger(upsert, statement_level):
+    statement = builder.create_update_trigger(
+        OldModel, NewModel, upsert=upsert, statement_level=statement_level,
+        changed_columns_only=True)
+
+    name = 'CREATE_UPDATE_{}CHANGED_COLUMNS_{}TRIGGERS'.format(
+        'UPSERT_' if upsert else '',
+        'STATEMENT_' if statement_level else '')
+    assert statement == globals()[name]
+
+
+def test_model_signature():
+    signature = builder.get_model_signature(NewModel)
+
+    assert signature == builder.ModelSignature(
+        db_table='testapp_newmodel',
+        column_names=('id', 'text', 'number', 'group_id'),
+        unique_column_names=('id',),
+        pk_name='id')
+    assert hash(signature) == hash(builder.get_model_signature(NewModel))
+
+
+def test_statements_are_only_rendered_once():
+    with mock.patch('removalist.builder.get_template',
+                    wraps=builder.get_template) as get_template:
+        first = builder.create_update_trigger(OldModel, NewModel)
+        second = builder.create_update_trigger(OldModel, NewModel)
+        builder.create_update_trigger(OldModel, NewModel, upsert=True)
+
+    assert first == second == CREATE_UPDATE_TRIGGERS
+    assert get_template.call_count == 2
+
+
+def test_statement_cache_is_shared_by_models_with_same_signature():
+    statement = builder.copy_model_data(OldModel, NewModel)
+
+    rendered_old_model = mock.Mock(_meta=OldModel._meta)
+    with mock.patch('removalist.builder.get_template') as get_template:
+        cached_statement = builder.copy_model_data(rendered_old_model,
+                                                   NewModel)
+
+    assert cached_statement == statement
+    assert get_template.call_count == 0
+
+
+def test_least_recently_used_statements_are_evicted():
+    with mock.patch('removalist.builder.STATEMENT_CACHE_SIZE', 2):
+        builder.create_update_trigger(OldModel, NewModel)
+        builder.create_delete_trigger(OldModel, NewModel)
+        builder.create_update_trigger(OldModel, NewModel)
+        builder.create_insert_trigger(OldModel, NewModel)
+
+        with mock.patch('removalist.builder.get_template',
+                        wraps=builder.get_template) as get_template:
+            builder.create_update_trigger(OldModel, NewModel)
+            builder.create_insert_trigger(OldModel, NewModel)
+            assert get_template.call_count == 0
+
+            builder.create_delete_trigger(OldModel, NewModel)
+            assert get_template.call_count == 1
+
+    assert len(builder.statement_cache) == 2
+
+
+def test_changelog_trigger_statements():
+    statement = builder.create_changelog_trigger(OldModel, NewModel, 'integer')
+    assert statement == CREATE_CHANGELOG_TRIGGER
+
+    statement = builder.drop_changelog_trigger(OldModel, NewModel)
+    assert statement == DROP_CHANGELOG_TRIGGER
+
+
 def test_copy_table_statement():
     statement = builder.copy_model_data(OldModel, NewModel)
     assert statement == globals()['COPY_TABLE']
 
 
+def test_copy_table_range_statement():
+    statement = builder.copy_model_data_range(OldModel, NewModel)
+    assert statement == globals()['COPY_TABLE_RANGE']
+
+
+def test_copy_table_range_statement_keeping_existing_rows():
+    statement = builder.copy_model_data_range(OldModel, NewModel,
+                                              keep_existing=True)
+    assert statement == globals()['COPY_TABLE_RANGE_KEEP_EXISTING']
+
+
+def test_copy_table_rows_statement():
+    statement = builder.copy_model_data_for_pks(OldModel, NewModel)
+    assert statement == COPY_TABLE_ROWS
+
+
+def test_delete_missing_rows_statement():
+    statement = builder.delete_missing_rows(OldModel, NewModel)
+    assert statement == DELETE_MISSING_ROWS
+
+
+def test_drop_changelog_trigger_keeping_table():
+    statement = builder.drop_changelog_trigger(OldModel, NewModel,
+                                               keep_table=True)
+    assert 'DROP TABLE' not in statement
+    assert 'DROP TRIGGER' in statement
+
+
+def test_columns_are_mapped_from_old_columns():
+    columns = builder.get_columns(builder.get_model_signature(OldModel),
+                                  builder.get_model_signature(ReshapedModel),
+                                  MAPPING['column_map'])
+
+    assert [column.name for column in columns] == ['id', 'title', 'number',
+                                                   'region']
+    assert columns[1].value == 'upper(text)'
+    assert columns[1].new_value == 'upper(NEW.text)'
+    assert columns[1].deleted_value == 'upper(deleted_rows.text)'
+    assert columns[3].old_value == "'eu'"
+
+
+def test_unmapped_new_columns_are_left_to_their_default():
+    columns = builder.get_columns(builder.get_model_signature(OldModel),
+                                  builder.get_model_signature(ReshapedModel))
+
+    assert [column.name for column in columns] == ['id', 'number']
+
+
+@pytest.mark.parametrize('column_map', ({'missing': '{text}'},
+                                        {'title': '{missing}'}))
+def test_invalid_column_map(column_map):
+    with pytest.raises(ValueError):
+        builder.copy_model_data(OldModel, ReshapedModel,
+                                column_map=column_map)
+
+
+def test_partition_column_has_to_be_written():
+    with pytest.raises(ValueError):
+        builder.copy_model_data(OldModel, ReshapedModel,
+                                column_map={'title': '{text}'},
+                                partition_columns=['region_code'])
+
+
+def test_mapped_copy_table_range_statement():
+    statement = builder.copy_model_data_range(OldModel, ReshapedModel,
+                                              **MAPPING)
+    assert statement == COPY_TABLE_RANGE_MAPPED
+
+
+def test_mapped_update_trigger_statement():
+    statement = builder.create_update_trigger(OldModel, ReshapedModel,
+                                              **MAPPING)
+    assert statement == CREATE_UPDATE_MAPPED_TRIGGERS
+
+
+def test_mapped_update_statement_trigger_statement():
+    statement = builder.create_update_trigger(OldModel, ReshapedModel,
+                                              statement_level=True, **MAPPING)
+    assert statement == CREATE_UPDATE_MAPPED_STATEMENT_TRIGGERS
+
+
+def test_mapped_delete_trigger_statement():
+    statement = builder.create_delete_trigger(OldModel, ReshapedModel,
+                                              **MAPPING)
+    assert statement == CREATE_DELETE_MAPPED_TRIGGERS
+
+
+def test_parse_column_map():
+    assert builder.parse_column_map(["title=upper({text})",
+                                     "region = 'eu'"]) == {
+        'title': 'upper({text})', 'region': "'eu'"}
+
+    with pytest.raises(ValueError):
+        builder.parse_column_map(['title'])
+
+
+def test_get_mapping():
+    assert builder.get_mapping() is None
+    assert builder.get_mapping(partition_columns=['number']) == {
+        'column_map': None, 'partition_columns': ['number']}
+
+
 CREATE_INSERT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_insert()
 RETURNS TRIGGER AS
 $BODY$
@@ -88,6 +309,42 @@ $BODY$
 LANGUAGE plpgsql;
 
 
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_insert_trigger
+  AFTER INSERT
+  ON testapp_oldmodel
+  FOR EACH ROW
+  EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_insert();
+"""
+
+CREATE_INSERT_UPSERT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_insert()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    INSERT INTO testapp_newmodel (
+        id,
+        text,
+        number,
+        group_id
+    )
+    VALUES (
+        NEW.id,
+        NEW.text,
+        NEW.number,
+        NEW.group_id
+    )
+    ON CONFLICT (id) DO
+        UPDATE
+        SET
+            text = EXCLUDED.text,
+            number = EXCLUDED.number,
+            group_id = EXCLUDED.group_id;
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
 CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_insert_trigger
   AFTER INSERT
   ON testapp_oldmodel
@@ -123,6 +380,44 @@ CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
     AFTER UPDATE
     ON testapp_oldmodel
     FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_UPDATE_UPSERT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    INSERT INTO testapp_newmodel (
+        id,
+        text,
+        number,
+        group_id
+    )
+    VALUES (
+        NEW.id,
+        NEW.text,
+        NEW.number,
+        NEW.group_id
+    )
+    ON CONFLICT (id) DO
+        UPDATE
+        SET
+            text = EXCLUDED.text,
+            number = EXCLUDED.number,
+            group_id = EXCLUDED.group_id;
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
     EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
 """
 
@@ -172,3 +467,501 @@ ON CONFLICT (id) DO
             number = EXCLUDED.number,
             group_id = EXCLUDED.group_id;
 """
+
+COPY_TABLE_RANGE = """INSERT INTO testapp_newmodel (
+    SELECT
+        id,
+        text,
+        number,
+        group_id
+    FROM testapp_oldmodel
+    WHERE id >= %s AND id < %s
+    FOR SHARE)
+ON CONFLICT (id) DO
+    UPDATE
+        SET
+            text = EXCLUDED.text,
+            number = EXCLUDED.number,
+            group_id = EXCLUDED.group_id;
+"""
+
+COPY_TABLE_RANGE_KEEP_EXISTING = """INSERT INTO testapp_newmodel (
+    SELECT
+        id,
+        text,
+        number,
+        group_id
+    FROM testapp_oldmodel
+    WHERE id >= %s AND id < %s
+    FOR KEY SHARE)
+ON CONFLICT (id) DO NOTHING;
+"""
+
+COPY_TABLE_ROWS = """INSERT INTO testapp_newmodel (
+    SELECT
+        id,
+        text,
+        number,
+        group_id
+    FROM testapp_oldmodel
+    WHERE id = ANY(%s)
+    FOR SHARE)
+ON CONFLICT (id) DO
+    UPDATE
+        SET
+            text = EXCLUDED.text,
+            number = EXCLUDED.number,
+            group_id = EXCLUDED.group_id;
+"""
+
+DELETE_MISSING_ROWS = """DELETE FROM testapp_newmodel
+WHERE id = ANY(%s)
+    AND NOT EXISTS (
+        SELECT 1 FROM testapp_oldmodel
+        WHERE testapp_oldmodel.id = testapp_newmodel.id
+    );
+"""
+
+CREATE_INSERT_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_insert()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    INSERT INTO testapp_newmodel (
+        id,
+        text,
+        number,
+        group_id
+    )
+    SELECT
+        id,
+        text,
+        number,
+        group_id
+    FROM inserted_rows;
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_insert_trigger
+  AFTER INSERT
+  ON testapp_oldmodel
+  REFERENCING NEW TABLE AS inserted_rows
+  FOR EACH STATEMENT
+  EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_insert();
+"""
+
+CREATE_UPDATE_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    UPDATE testapp_newmodel AS target
+    SET
+        text = updated_rows.text,
+        number = updated_rows.number,
+        group_id = updated_rows.group_id
+    FROM updated_rows
+    WHERE target.id = updated_rows.id
+        AND (target.text, target.number, target.group_id)
+            IS DISTINCT FROM (updated_rows.text, updated_rows.number, updated_rows.group_id);
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_UPDATE_UPSERT_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    INSERT INTO testapp_newmodel (
+        id,
+        text,
+        number,
+        group_id
+    )
+    SELECT
+        id,
+        text,
+        number,
+        group_id
+    FROM updated_rows
+    ON CONFLICT (id) DO
+        UPDATE
+        SET
+            text = EXCLUDED.text,
+            number = EXCLUDED.number,
+            group_id = EXCLUDED.group_id
+        WHERE (testapp_newmodel.text, testapp_newmodel.number, testapp_newmodel.group_id)
+            IS DISTINCT FROM (EXCLUDED.text, EXCLUDED.number, EXCLUDED.group_id);
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_DELETE_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_delete()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    DELETE FROM testapp_newmodel
+    USING deleted_rows
+    WHERE deleted_rows.id = testapp_newmodel.id;
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_delete_trigger
+    AFTER DELETE
+    ON testapp_oldmodel
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_delete();
+"""
+
+CREATE_UPDATE_CHANGED_COLUMNS_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    new_row testapp_newmodel%ROWTYPE;
+    old_row testapp_newmodel%ROWTYPE;
+    assignments text[] := '{}';
+BEGIN
+    new_row.id := NEW.id;
+    new_row.text := NEW.text;
+    new_row.number := NEW.number;
+    new_row.group_id := NEW.group_id;
+    old_row.id := OLD.id;
+    old_row.text := OLD.text;
+    old_row.number := OLD.number;
+    old_row.group_id := OLD.group_id;
+
+    IF new_row.text IS DISTINCT FROM old_row.text THEN
+        assignments := array_append(assignments, 'text = ($1).text');
+    END IF;
+    IF new_row.number IS DISTINCT FROM old_row.number THEN
+        assignments := array_append(assignments, 'number = ($1).number');
+    END IF;
+    IF new_row.group_id IS DISTINCT FROM old_row.group_id THEN
+        assignments := array_append(assignments, 'group_id = ($1).group_id');
+    END IF;
+
+    IF assignments <> '{}' THEN
+        EXECUTE 'UPDATE testapp_newmodel SET '
+            || array_to_string(assignments, ', ')
+            || ' WHERE id = ($1).id'
+            USING new_row, old_row;
+    END IF;
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_UPDATE_UPSERT_CHANGED_COLUMNS_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    new_row testapp_newmodel%ROWTYPE;
+    old_row testapp_newmodel%ROWTYPE;
+    assignments text[] := '{}';
+BEGIN
+    new_row.id := NEW.id;
+    new_row.text := NEW.text;
+    new_row.number := NEW.number;
+    new_row.group_id := NEW.group_id;
+
+    SELECT * INTO old_row
+    FROM testapp_newmodel
+    WHERE id = new_row.id;
+
+    IF new_row.text IS DISTINCT FROM old_row.text THEN
+        assignments := array_append(assignments, 'text = EXCLUDED.text');
+    END IF;
+    IF new_row.number IS DISTINCT FROM old_row.number THEN
+        assignments := array_append(assignments, 'number = EXCLUDED.number');
+    END IF;
+    IF new_row.group_id IS DISTINCT FROM old_row.group_id THEN
+        assignments := array_append(assignments, 'group_id = EXCLUDED.group_id');
+    END IF;
+
+    EXECUTE 'INSERT INTO testapp_newmodel (id, text, number, group_id) '
+        || 'VALUES (($1).id, ($1).text, ($1).number, ($1).group_id) '
+        || 'ON CONFLICT (id) DO '
+        || CASE WHEN assignments = '{}' THEN 'NOTHING'
+                ELSE 'UPDATE SET ' || array_to_string(assignments, ', ') END
+        USING new_row;
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_UPDATE_CHANGED_COLUMNS_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    assignments text[];
+BEGIN
+    SELECT array_remove(ARRAY[
+        CASE WHEN bool_or(updated_rows.text IS DISTINCT FROM target.text)
+            THEN $sync$text = updated_rows.text$sync$ END,
+        CASE WHEN bool_or(updated_rows.number IS DISTINCT FROM target.number)
+            THEN $sync$number = updated_rows.number$sync$ END,
+        CASE WHEN bool_or(updated_rows.group_id IS DISTINCT FROM target.group_id)
+            THEN $sync$group_id = updated_rows.group_id$sync$ END
+    ], NULL)
+    INTO assignments
+    FROM updated_rows
+    JOIN testapp_newmodel AS target
+        ON target.id = updated_rows.id;
+
+    IF assignments <> '{}' THEN
+        EXECUTE $sync$UPDATE testapp_newmodel AS target SET $sync$
+            || array_to_string(assignments, ', ')
+            || $sync$ FROM updated_rows
+        WHERE target.id = updated_rows.id
+            AND (target.text, target.number, target.group_id)
+                IS DISTINCT FROM (updated_rows.text, updated_rows.number, updated_rows.group_id)$sync$;
+    END IF;
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_UPDATE_UPSERT_CHANGED_COLUMNS_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+DECLARE
+    assignments text[];
+BEGIN
+    SELECT array_remove(ARRAY[
+        CASE WHEN bool_or(updated_rows.text IS DISTINCT FROM target.text)
+            THEN $sync$text = EXCLUDED.text$sync$ END,
+        CASE WHEN bool_or(updated_rows.number IS DISTINCT FROM target.number)
+            THEN $sync$number = EXCLUDED.number$sync$ END,
+        CASE WHEN bool_or(updated_rows.group_id IS DISTINCT FROM target.group_id)
+            THEN $sync$group_id = EXCLUDED.group_id$sync$ END
+    ], NULL)
+    INTO assignments
+    FROM updated_rows
+    JOIN testapp_newmodel AS target
+        ON target.id = updated_rows.id;
+
+    EXECUTE $sync$INSERT INTO testapp_newmodel (id, text, number, group_id)
+        SELECT id, text, number, group_id
+        FROM updated_rows
+        ON CONFLICT (id) DO $sync$
+        || CASE WHEN assignments = '{}' THEN 'NOTHING'
+                ELSE 'UPDATE SET ' || array_to_string(assignments, ', ')
+                    || $sync$ WHERE (testapp_newmodel.text, testapp_newmodel.number, testapp_newmodel.group_id)
+            IS DISTINCT FROM (EXCLUDED.text, EXCLUDED.number, EXCLUDED.group_id)$sync$ END;
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_update();
+"""
+
+CREATE_CHANGELOG_TRIGGER = """CREATE TABLE IF NOT EXISTS testapp_oldmodel_to_testapp_newmodel_changelog (
+    id BIGSERIAL PRIMARY KEY,
+    row_pk integer NOT NULL,
+    operation CHAR(1) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_newmodel_changelog()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO testapp_oldmodel_to_testapp_newmodel_changelog (row_pk, operation)
+        VALUES (OLD.id, 'D');
+
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND NEW.id <> OLD.id THEN
+        INSERT INTO testapp_oldmodel_to_testapp_newmodel_changelog (row_pk, operation)
+        VALUES (OLD.id, 'D');
+    END IF;
+
+    INSERT INTO testapp_oldmodel_to_testapp_newmodel_changelog (row_pk, operation)
+    VALUES (NEW.id, LEFT(TG_OP, 1));
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_newmodel_changelog_trigger
+    AFTER INSERT OR UPDATE OR DELETE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_newmodel_changelog();
+"""
+
+DROP_CHANGELOG_TRIGGER = """DROP TRIGGER IF EXISTS testapp_oldmodel_to_testapp_newmodel_changelog_trigger
+     ON testapp_oldmodel;
+
+DROP FUNCTION IF EXISTS testapp_oldmodel_to_testapp_newmodel_changelog();
+
+DROP TABLE IF EXISTS testapp_oldmodel_to_testapp_newmodel_changelog;
+"""
+
+COPY_TABLE_RANGE_MAPPED = """INSERT INTO testapp_reshapedmodel (
+    id,
+    title,
+    number,
+    region) (
+    SELECT
+        id,
+        upper(text),
+        number,
+        'eu'
+    FROM testapp_oldmodel
+    WHERE id >= %s AND id < %s
+    FOR SHARE)
+ON CONFLICT (id, number) DO
+    UPDATE
+        SET
+            title = EXCLUDED.title,
+            number = EXCLUDED.number,
+            region = EXCLUDED.region;
+"""
+
+CREATE_UPDATE_MAPPED_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_reshapedmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    UPDATE testapp_reshapedmodel
+    SET
+        title = upper(NEW.text),
+        number = NEW.number,
+        region = 'eu'
+    WHERE id = NEW.id
+        AND number = OLD.number;
+
+    RETURN NEW;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_reshapedmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_reshapedmodel_update();
+"""
+
+CREATE_UPDATE_MAPPED_STATEMENT_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_reshapedmodel_update()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    UPDATE testapp_reshapedmodel AS target
+    SET
+        title = upper(updated_rows.text),
+        number = updated_rows.number,
+        region = 'eu'
+    FROM updated_rows
+    WHERE target.id = updated_rows.id
+        AND target.number = updated_rows.number
+        AND (target.title, target.number, target.region)
+            IS DISTINCT FROM (upper(updated_rows.text), updated_rows.number, 'eu');
+
+    RETURN NULL;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_reshapedmodel_update_trigger
+    AFTER UPDATE
+    ON testapp_oldmodel
+    REFERENCING NEW TABLE AS updated_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_reshapedmodel_update();
+"""
+
+CREATE_DELETE_MAPPED_TRIGGERS = """CREATE OR REPLACE FUNCTION testapp_oldmodel_to_testapp_reshapedmodel_delete()
+RETURNS TRIGGER AS
+$BODY$
+BEGIN
+    DELETE FROM testapp_reshapedmodel
+    WHERE OLD.id = id
+        AND number = OLD.number;
+
+    RETURN OLD;
+END;
+$BODY$
+LANGUAGE plpgsql;
+
+
+CREATE TRIGGER testapp_oldmodel_to_testapp_reshapedmodel_delete_trigger
+    AFTER DELETE
+    ON testapp_oldmodel
+    FOR EACH ROW
+    EXECUTE PROCEDURE testapp_oldmodel_to_testapp_reshapedmodel_delete();
+"""
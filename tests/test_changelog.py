@@ -0,0 +1,92 @@
+from unittest import mock
+
+import pytest
+
+from django.db import DatabaseError
+
+from removalist import changelog
+
+from .test_builder import NewModel, OldModel
+
+
+def test_apply_changelog_batch_copies_each_row_once():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [(1, 7), (2, 3), (3, 7)]
+
+    with mock.patch('removalist.changelog.builder') as builder:
+        builder.get_changelog_table_name.return_value = 'changelog'
+
+        assert changelog.apply_changelog_batch(connection, OldModel,
+                                               NewModel, 10) == 3
+
+    assert cursor.execute.call_args_list == [
+        mock.call('BEGIN;'),
+        mock.call('SELECT id, row_pk FROM changelog ORDER BY id LIMIT %s;',
+                  [10]),
+        mock.call(builder.delete_missing_rows.return_value, [[3, 7]]),
+        mock.call(builder.copy_model_data_for_pks.return_value, [[3, 7]]),
+        mock.call('DELETE FROM changelog WHERE id = ANY(%s);', [[1, 2, 3]]),
+        mock.call('COMMIT;')]
+
+
+def test_apply_changelog_batch_rolls_back_on_error():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = DatabaseError('deadlock detected')
+
+    with mock.patch('removalist.changelog.builder'), \
+            pytest.raises(DatabaseError):
+        changelog.apply_changelog_batch(connection, OldModel, NewModel, 10)
+
+    assert cursor.execute.call_args_list[-1] == mock.call('ROLLBACK;')
+
+
+def test_apply_changelog_until_drained():
+    with mock.patch('removalist.changelog.apply_changelog_batch') as apply, \
+            mock.patch('removalist.changelog.instrumentation'):
+        apply.side_effect = [10, 10, 4]
+
+        assert changelog.apply_changelog(mock.Mock(), OldModel, NewModel,
+                                         batch_size=10) == 24
+
+
+def test_wait_until_caught_up_applies_batches():
+    connection = mock.Mock()
+
+    with mock.patch('removalist.changelog.get_sync_lag') as get_sync_lag, \
+            mock.patch('removalist.changelog.apply_changelog_batch') as apply, \
+            mock.patch('removalist.changelog.instrumentation') as instrument:
+        get_sync_lag.side_effect = [(25, 3.0), (5, 1.0), (0, 0)]
+
+        assert changelog.wait_until_caught_up(connection, OldModel, NewModel,
+                                              batch_size=20)
+
+    assert apply.call_count == 2
+    assert instrument.emit.call_args_list[0][1]['pending_entries'] == 25
+    assert instrument.emit.call_args_list[0][1]['lag_seconds'] == 3.0
+
+
+def test_wait_until_caught_up_gives_up_after_timeout():
+    with mock.patch('removalist.changelog.get_sync_lag') as get_sync_lag, \
+            mock.patch('removalist.changelog.apply_changelog_batch'), \
+            mock.patch('removalist.changelog.instrumentation'):
+        get_sync_lag.return_value = (100, 60.0)
+
+        assert not changelog.wait_until_caught_up(
+            mock.Mock(), OldModel, NewModel, timeout=0)
+
+
+def test_finish_changelog_sync_locks_old_table():
+    schema_editor = mock.MagicMock()
+
+    with mock.patch('removalist.changelog.apply_changelog_entries') as apply, \
+            mock.patch('removalist.changelog.instrumentation') as instrument:
+        instrument.execute_timed.return_value = 0.1
+        apply.side_effect = [10, 3]
+
+        assert changelog.finish_changelog_sync(schema_editor, OldModel,
+                                               NewModel, batch_size=10) == 13
+
+    assert instrument.execute_timed.call_args[0][1] == (
+        'LOCK TABLE testapp_oldmodel IN EXCLUSIVE MODE;')
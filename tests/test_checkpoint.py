@@ -0,0 +1,71 @@
+from unittest import mock
+
+from removalist import checkpoint
+
+from .test_builder import NewModel, OldModel
+
+
+def make_connection(row):
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(True, ), row]
+    return connection, cursor
+
+
+def test_resume_continues_after_last_pk():
+    connection, _ = make_connection((40, 40, False))
+    backfill_checkpoint = checkpoint.BackfillCheckpoint(OldModel, NewModel)
+
+    with mock.patch('removalist.checkpoint.instrumentation') as instrumentation:
+        assert backfill_checkpoint.resume(connection, 1) == 41
+
+    instrumentation.emit.assert_called_once_with(
+        'backfill_resumed', old_table='testapp_oldmodel',
+        new_table='testapp_newmodel', last_pk=40, rows_copied=40)
+
+
+def test_resume_of_finished_backfill():
+    connection, _ = make_connection((100, 100, True))
+    backfill_checkpoint = checkpoint.BackfillCheckpoint(OldModel, NewModel)
+
+    assert backfill_checkpoint.resume(connection, 1) is None
+
+
+def test_resume_without_checkpoint_starts_one():
+    connection, cursor = make_connection(None)
+    backfill_checkpoint = checkpoint.BackfillCheckpoint(OldModel, NewModel)
+
+    assert backfill_checkpoint.resume(connection, 1) == 1
+    cursor.execute.assert_called_with(
+        checkpoint.START_CHECKPOINT_STATEMENT,
+        ['testapp_oldmodel', 'testapp_newmodel'])
+
+
+def test_checkpoint_only_moves_past_committed_ranges():
+    backfill_checkpoint = checkpoint.BackfillCheckpoint(OldModel, NewModel)
+    backfill_checkpoint.next_pk = 1
+    cursor = mock.Mock()
+
+    # The second range is done before the first one, so the checkpoint
+    # can't move yet.
+    backfill_checkpoint.record(cursor, 11, 21, 10)
+    backfill_checkpoint.commit(11, 21)
+    assert cursor.execute.call_args[0][1][0] == 0
+
+    backfill_checkpoint.record(cursor, 1, 11, 10)
+    backfill_checkpoint.commit(1, 11)
+    assert cursor.execute.call_args[0][1] == [
+        20, 10, 'testapp_oldmodel', 'testapp_newmodel']
+
+    assert backfill_checkpoint.next_pk == 21
+    assert backfill_checkpoint.committed == {}
+
+
+def test_clear_checkpoint_is_executed_with_schema_editor():
+    schema_editor = mock.Mock()
+
+    checkpoint.clear_checkpoint(schema_editor, OldModel, NewModel)
+
+    schema_editor.execute.assert_called_once_with(
+        checkpoint.CLEAR_CHECKPOINT_STATEMENT,
+        ['testapp_oldmodel', 'testapp_newmodel'])
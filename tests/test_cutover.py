@@ -0,0 +1,49 @@
+from unittest import mock
+
+from removalist import cutover
+
+from .test_builder import NewModel, OldModel
+
+
+def test_swap_with_view():
+    assert cutover.get_swap_statements(OldModel, NewModel) == [
+        'ALTER TABLE testapp_oldmodel RENAME TO testapp_oldmodel_archived;',
+        'CREATE VIEW testapp_oldmodel AS SELECT * FROM testapp_newmodel;']
+
+
+def test_swap_with_rename():
+    assert cutover.get_swap_statements(OldModel, NewModel,
+                                       cutover.RENAME) == [
+        'ALTER TABLE testapp_oldmodel RENAME TO testapp_oldmodel_archived;',
+        'ALTER TABLE testapp_newmodel RENAME TO testapp_oldmodel;']
+
+
+@mock.patch('removalist.cutover.instrumentation')
+def test_sequence_continues_after_old_sequence(instrumentation):
+    cursor = mock.Mock()
+    cursor.fetchone.side_effect = [
+        ('public.testapp_oldmodel_id_seq', 'public.testapp_newmodel_id_seq'),
+        (42,)]
+
+    assert cutover.fix_sequence(cursor, OldModel, NewModel) == 42
+    cursor.execute.assert_called_with(
+        'SELECT setval(%s, GREATEST((SELECT MAX(id) FROM testapp_newmodel), '
+        '(SELECT last_value FROM public.testapp_oldmodel_id_seq), 1));',
+        ['public.testapp_newmodel_id_seq'])
+
+
+def test_sequence_is_skipped_without_serial_primary_key():
+    cursor = mock.Mock()
+    cursor.fetchone.return_value = (None, None)
+
+    assert cutover.fix_sequence(cursor, OldModel, NewModel) is None
+    assert cursor.execute.call_count == 1
+
+
+@mock.patch('removalist.cutover.prewarm_extension_exists',
+            mock.Mock(return_value=False))
+def test_prewarm_is_skipped_without_extension():
+    connection = mock.MagicMock()
+
+    assert cutover.prewarm(connection, NewModel) is None
+    assert connection.cursor.call_count == 0
@@ -0,0 +1,184 @@
+from unittest import mock
+
+import pytest
+
+from django.db import DatabaseError
+from django.db.transaction import TransactionManagementError
+
+from removalist import decoding
+
+from .test_builder import NewModel, OldModel
+
+
+def test_slot_name_is_valid_and_bounded():
+    assert decoding.get_slot_name(OldModel, NewModel) == (
+        'removalist_testapp_oldmodel_to_testapp_newmodel')
+
+    old_model = mock.Mock()
+    old_model._meta.db_table = 'App.Old' + 'x' * 60
+    slot_name = decoding.get_slot_name(old_model, NewModel)
+
+    assert len(slot_name) == decoding.MAX_SLOT_NAME_LENGTH
+    assert slot_name.startswith('removalist_app_old')
+
+
+def test_parse_inserted_row():
+    assert decoding.parse_change(
+        "table public.testapp_oldmodel: INSERT: id[integer]:1 "
+        "text[text]:'it''s id[integer]:2' number[integer]:null") == (
+            'testapp_oldmodel', 'INSERT',
+            [('id', '1'), ('text', "it's id[integer]:2"), ('number', None)])
+
+
+def test_parse_update_with_changed_key():
+    assert decoding.parse_change(
+        'table "my.schema"."Old Table": UPDATE: old-key: id[integer]:1 '
+        'new-tuple: id[integer]:2 tags[integer[]]:\'{1,2}\'') == (
+            'Old Table', 'UPDATE',
+            [('id', '1'), ('id', '2'), ('tags', '{1,2}')])
+
+
+def test_parse_transaction_boundaries():
+    assert decoding.parse_change('BEGIN') is None
+    assert decoding.parse_change('COMMIT') is None
+
+
+def test_changed_pks_of_old_table():
+    changes = [
+        'BEGIN',
+        "table public.testapp_oldmodel: INSERT: id[integer]:7 text[text]:'a'",
+        "table public.testapp_newmodel: INSERT: id[integer]:8 text[text]:'a'",
+        'table public.testapp_oldmodel: UPDATE: old-key: id[integer]:3 '
+        "new-tuple: id[integer]:9 text[text]:'b'",
+        'table public.testapp_oldmodel: DELETE: id[integer]:7',
+        'COMMIT',
+    ]
+
+    assert decoding.get_changed_pks(OldModel, changes) == [3, 7, 9]
+
+
+def test_apply_decoded_batch_consumes_changes_after_commit():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [
+        ('0/1', 'BEGIN'),
+        ('0/2', 'table public.testapp_oldmodel: DELETE: id[integer]:7'),
+        ('0/3', 'COMMIT'),
+    ]
+
+    with mock.patch('removalist.changelog.builder') as builder:
+        assert decoding.apply_decoded_batch(connection, OldModel, NewModel,
+                                            10) == 3
+
+    slot_name = decoding.get_slot_name(OldModel, NewModel)
+    assert cursor.execute.call_args_list == [
+        mock.call('BEGIN;'),
+        mock.call("SELECT lsn, data FROM pg_logical_slot_peek_changes("
+                  "%s, NULL, %s, 'include-xids', '0', 'skip-empty-xacts', "
+                  "'1');", [slot_name, 10]),
+        mock.call(builder.delete_missing_rows.return_value, [[7]]),
+        mock.call(builder.copy_model_data_for_pks.return_value, [[7]]),
+        mock.call('COMMIT;'),
+        mock.call('SELECT pg_replication_slot_advance(%s, %s);',
+                  [slot_name, '0/3'])]
+
+
+def test_apply_decoded_batch_rolls_back_on_error():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = DatabaseError('slot is active')
+
+    with pytest.raises(DatabaseError):
+        decoding.apply_decoded_batch(connection, OldModel, NewModel, 10)
+
+    assert cursor.execute.call_args_list[-1] == mock.call('ROLLBACK;')
+
+
+@mock.patch('removalist.decoding.instrumentation.emit', mock.Mock())
+@mock.patch('removalist.decoding.get_current_lsn',
+            mock.Mock(return_value='0/10'))
+@mock.patch('removalist.decoding.slot_has_reached',
+            side_effect=[False, True])
+@mock.patch('removalist.decoding.apply_decoded_batch', side_effect=[3, 2, 5])
+def test_decoded_changes_are_applied_up_to_start_lsn(apply_batch,
+                                                     slot_has_reached):
+    connection = mock.Mock()
+
+    assert decoding.apply_decoded_changes(connection, OldModel, NewModel,
+                                          batch_size=10) == 5
+    assert apply_batch.call_count == 2
+    slot_has_reached.assert_called_with(connection, OldModel, NewModel,
+                                        '0/10')
+
+
+@mock.patch('removalist.decoding.instrumentation.emit', mock.Mock())
+@mock.patch('removalist.decoding.get_current_lsn',
+            mock.Mock(return_value='0/10'))
+@mock.patch('removalist.decoding.slot_has_reached')
+@mock.patch('removalist.decoding.apply_decoded_batch', side_effect=[10, 0])
+def test_decoded_changes_stop_once_slot_is_empty(apply_batch,
+                                                 slot_has_reached):
+    slot_has_reached.return_value = False
+
+    assert decoding.apply_decoded_changes(mock.Mock(), OldModel, NewModel,
+                                          batch_size=10) == 10
+    assert apply_batch.call_count == 2
+
+
+def test_logical_decoding_requires_wal_level():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = ('replica',)
+
+    with pytest.raises(decoding.LogicalDecodingUnavailable):
+        decoding.check_logical_decoding(connection)
+
+
+def test_sync_lag_of_missing_slot():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = None
+
+    with pytest.raises(decoding.ReplicationSlotNotFound):
+        decoding.get_sync_lag(connection, OldModel, NewModel)
+
+
+def test_slot_is_not_created_in_atomic_block():
+    connection = mock.MagicMock(in_atomic_block=True)
+
+    with pytest.raises(TransactionManagementError):
+        decoding.create_slot(connection, OldModel, NewModel)
+
+    assert connection.cursor.call_count == 0
+
+
+def test_finish_decoding_sync_fetches_changes_in_batches():
+    schema_editor = mock.MagicMock()
+    cursor = schema_editor.connection.cursor.return_value.__enter__\
+        .return_value
+    cursor.fetchall.side_effect = [
+        [('0/1', 'table public.testapp_oldmodel: DELETE: id[integer]:7'),
+         ('0/2', 'table public.testapp_oldmodel: DELETE: id[integer]:8')],
+        [('0/3', 'table public.testapp_oldmodel: DELETE: id[integer]:9')]]
+
+    with mock.patch('removalist.decoding.instrumentation') as \
+            instrumentation, \
+            mock.patch('removalist.changelog.builder') as builder:
+        instrumentation.execute_timed.return_value = 0.1
+
+        assert decoding.finish_decoding_sync(schema_editor, OldModel,
+                                             NewModel, batch_size=2) == 3
+
+    delete = builder.delete_missing_rows.return_value
+    executed = [c for c in cursor.execute.call_args_list
+                if c[0][0] != builder.copy_model_data_for_pks.return_value]
+    assert executed == [
+        mock.call('DECLARE removalist_decoded_changes NO SCROLL CURSOR FOR '
+                  "SELECT lsn, data FROM pg_logical_slot_peek_changes("
+                  "%s, NULL, %s, 'include-xids', '0', 'skip-empty-xacts', "
+                  "'1');", [decoding.get_slot_name(OldModel, NewModel), None]),
+        mock.call('FETCH FORWARD %s FROM removalist_decoded_changes;', [2]),
+        mock.call(delete, [[7, 8]]),
+        mock.call('FETCH FORWARD %s FROM removalist_decoded_changes;', [2]),
+        mock.call(delete, [[9]]),
+        mock.call('CLOSE removalist_decoded_changes;')]
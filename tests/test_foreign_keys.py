@@ -0,0 +1,154 @@
+from unittest import mock
+
+import pytest
+
+from removalist import foreign_keys
+
+from .test_builder import NewModel, OldModel
+
+DEFINITION = ('FOREIGN KEY (item_id) REFERENCES testapp_oldmodel(id) '
+              'DEFERRABLE INITIALLY DEFERRED')
+
+
+def test_retargeted_definition():
+    assert foreign_keys.get_retargeted_definition(
+        DEFINITION, 'testapp_newmodel') == (
+            'FOREIGN KEY (item_id) REFERENCES testapp_newmodel(id) '
+            'DEFERRABLE INITIALLY DEFERRED')
+    assert foreign_keys.get_retargeted_definition(
+        'FOREIGN KEY (a) REFERENCES "Other"."Old Table"(id) NOT VALID',
+        'testapp_newmodel') == (
+            'FOREIGN KEY (a) REFERENCES testapp_newmodel(id)')
+
+    with pytest.raises(ValueError):
+        foreign_keys.get_retargeted_definition('CHECK (a > 0)', 'new')
+
+
+def test_constraint_is_retargeted_not_valid():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    constraint = foreign_keys.ReferencingConstraint('testapp_item', 'item_fk',
+                                                    DEFINITION, True)
+
+    with mock.patch('removalist.foreign_keys.instrumentation'):
+        foreign_keys.retarget_constraint(connection, constraint,
+                                         'testapp_newmodel')
+
+    assert cursor.execute.call_args_list == [
+        mock.call('BEGIN;'),
+        mock.call('ALTER TABLE testapp_item DROP CONSTRAINT item_fk, '
+                  'ADD CONSTRAINT item_fk FOREIGN KEY (item_id) REFERENCES '
+                  'testapp_newmodel(id) DEFERRABLE INITIALLY DEFERRED '
+                  'NOT VALID;'),
+        mock.call('COMMIT;')]
+
+
+def test_retargeted_constraint_is_recorded():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    constraint = foreign_keys.ReferencingConstraint('testapp_item', 'item_fk',
+                                                    DEFINITION, True)
+
+    with mock.patch('removalist.foreign_keys.instrumentation'):
+        foreign_keys.retarget_constraint(
+            connection, constraint, 'testapp_newmodel',
+            record_for=('testapp_oldmodel', 'testapp_newmodel'))
+
+    assert cursor.execute.call_args_list[2] == mock.call(
+        'INSERT INTO removalist_retargeted_foreign_key (old_table, '
+        'new_table, referencing_table, name) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT DO NOTHING;',
+        ['testapp_oldmodel', 'testapp_newmodel', 'testapp_item', 'item_fk'])
+    assert cursor.execute.call_args_list[-1] == mock.call('COMMIT;')
+
+
+def test_retarget_foreign_keys_validates_retargeted_constraints():
+    old_constraint = foreign_keys.ReferencingConstraint(
+        'testapp_item', 'item_fk', DEFINITION, True)
+    new_constraint = old_constraint._replace(validated=False)
+    validated_constraint = foreign_keys.ReferencingConstraint(
+        'testapp_other', 'other_fk', DEFINITION, True)
+
+    with mock.patch('removalist.foreign_keys.create_retargeted_table'), \
+            mock.patch('removalist.foreign_keys.get_referencing_constraints',
+                       return_value=[old_constraint]) as get, \
+            mock.patch('removalist.foreign_keys.get_retargeted_constraints',
+                       return_value=[new_constraint, validated_constraint]) \
+            as get_retargeted, \
+            mock.patch('removalist.foreign_keys.retarget_constraint') as \
+            retarget, \
+            mock.patch('removalist.foreign_keys.validate_constraint') as \
+            validate:
+        manager = mock.Mock()
+        manager.attach_mock(retarget, 'retarget')
+        manager.attach_mock(validate, 'validate')
+        connection = mock.Mock()
+
+        assert foreign_keys.retarget_foreign_keys(connection, OldModel,
+                                                  NewModel) == 1
+
+    get.assert_called_once_with(connection, 'testapp_oldmodel',
+                                ['testapp_newmodel'])
+    get_retargeted.assert_called_once_with(
+        connection, 'testapp_oldmodel', 'testapp_newmodel', 'testapp_newmodel')
+    assert manager.mock_calls == [
+        mock.call.retarget(connection, old_constraint, 'testapp_newmodel',
+                           None,
+                           record_for=('testapp_oldmodel',
+                                       'testapp_newmodel')),
+        mock.call.validate(connection, new_constraint)]
+
+
+def test_restore_foreign_keys_only_restores_retargeted_constraints():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    constraint = foreign_keys.ReferencingConstraint(
+        'testapp_item', 'item_fk', DEFINITION.replace(
+            'testapp_oldmodel', 'testapp_newmodel'), True)
+    restored_constraint = constraint._replace(validated=False)
+
+    with mock.patch('removalist.foreign_keys.retargeted_table_exists',
+                    return_value=True), \
+            mock.patch('removalist.foreign_keys.get_referencing_constraints') \
+            as get, \
+            mock.patch('removalist.foreign_keys.get_retargeted_constraints',
+                       side_effect=[[constraint], [restored_constraint]]) \
+            as get_retargeted, \
+            mock.patch('removalist.foreign_keys.retarget_constraint') as \
+            retarget, \
+            mock.patch('removalist.foreign_keys.validate_constraint') as \
+            validate:
+        assert foreign_keys.restore_foreign_keys(connection, OldModel,
+                                                 NewModel) == 1
+
+    assert get.call_count == 0
+    assert get_retargeted.call_args_list == [
+        mock.call(connection, 'testapp_oldmodel', 'testapp_newmodel',
+                  'testapp_newmodel'),
+        mock.call(connection, 'testapp_oldmodel', 'testapp_newmodel',
+                  'testapp_oldmodel')]
+    retarget.assert_called_once_with(connection, constraint,
+                                     'testapp_oldmodel', None)
+    validate.assert_called_once_with(connection, restored_constraint)
+    cursor.execute.assert_called_once_with(
+        'DELETE FROM removalist_retargeted_foreign_key '
+        'WHERE old_table = %s AND new_table = %s;',
+        ['testapp_oldmodel', 'testapp_newmodel'])
+
+
+def test_retargeting_requires_sync_triggers():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (0,)
+
+    with pytest.raises(foreign_keys.TriggerSyncRequired):
+        foreign_keys.check_trigger_sync(connection, OldModel, NewModel)
+
+    assert cursor.execute.call_args[0][1] == [
+        'testapp_oldmodel', [
+            'testapp_oldmodel_to_testapp_newmodel_insert_trigger',
+            'testapp_oldmodel_to_testapp_newmodel_update_trigger',
+            'testapp_oldmodel_to_testapp_newmodel_delete_trigger']]
+
+    cursor.fetchone.return_value = (3,)
+    foreign_keys.check_trigger_sync(connection, OldModel, NewModel)
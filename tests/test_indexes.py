@@ -0,0 +1,105 @@
+from unittest import mock
+
+from removalist import indexes
+
+from .test_builder import NewModel
+
+INDEX = indexes.DeferredObject(
+    'testapp_newmodel_number_idx', indexes.INDEX,
+    'CREATE INDEX testapp_newmodel_number_idx ON public.testapp_newmodel '
+    'USING btree (number)')
+
+FOREIGN_KEY = indexes.DeferredObject(
+    'testapp_newmodel_group_id_fk', indexes.CONSTRAINT,
+    'FOREIGN KEY (group_id) REFERENCES auth_group(id) '
+    'DEFERRABLE INITIALLY DEFERRED')
+
+
+def get_statements(cursor):
+    return [c[0][0] for c in cursor.execute.call_args_list]
+
+
+def test_defer_indexes_drops_and_records_them():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (False, )
+    cursor.fetchall.side_effect = [
+        [(INDEX.name, INDEX.definition)],
+        [(FOREIGN_KEY.name, FOREIGN_KEY.definition)]]
+
+    with mock.patch('removalist.indexes.instrumentation') as instrumentation:
+        deferred = indexes.defer_indexes(connection, NewModel)
+
+    assert deferred == [INDEX, FOREIGN_KEY]
+
+    statements = get_statements(cursor)
+    assert 'DROP INDEX testapp_newmodel_number_idx;' in statements
+    assert ('ALTER TABLE testapp_newmodel DROP CONSTRAINT '
+            'testapp_newmodel_group_id_fk;') in statements
+
+    instrumentation.emit.assert_called_once_with(
+        'indexes_deferred', new_table='testapp_newmodel',
+        indexes=['testapp_newmodel_number_idx'],
+        constraints=['testapp_newmodel_group_id_fk'])
+
+
+def test_indexes_of_partitioned_tables_are_not_deferred():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (True, )
+
+    assert indexes.defer_indexes(connection, NewModel) == []
+    assert cursor.execute.call_count == 1
+
+
+def test_restore_index_builds_it_concurrently():
+    cursor = mock.Mock()
+    cursor.fetchone.return_value = None
+
+    indexes.restore_index(cursor, 'testapp_newmodel', INDEX)
+
+    assert get_statements(cursor)[-1] == (
+        'CREATE INDEX CONCURRENTLY testapp_newmodel_number_idx '
+        'ON public.testapp_newmodel USING btree (number)')
+
+
+def test_restore_index_replaces_invalid_index():
+    cursor = mock.Mock()
+    cursor.fetchone.return_value = (False, )
+
+    indexes.restore_index(cursor, 'testapp_newmodel', INDEX)
+
+    assert cursor.execute.call_args_list[0][0][1] == [
+        'testapp_newmodel', 'testapp_newmodel_number_idx']
+    statements = get_statements(cursor)
+    assert statements[1] == ('DROP INDEX CONCURRENTLY IF EXISTS '
+                             'testapp_newmodel_number_idx;')
+    assert statements[2].startswith('CREATE INDEX CONCURRENTLY')
+
+
+def test_restore_constraint_validates_it_separately():
+    cursor = mock.Mock()
+    cursor.fetchone.return_value = None
+
+    indexes.restore_constraint(cursor, 'testapp_newmodel', FOREIGN_KEY)
+
+    assert get_statements(cursor)[1:] == [
+        'ALTER TABLE testapp_newmodel ADD CONSTRAINT '
+        'testapp_newmodel_group_id_fk FOREIGN KEY (group_id) REFERENCES '
+        'auth_group(id) DEFERRABLE INITIALLY DEFERRED NOT VALID;',
+        'ALTER TABLE testapp_newmodel VALIDATE CONSTRAINT '
+        'testapp_newmodel_group_id_fk;']
+
+
+def test_restore_indexes_analyzes_table():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(True, ), (True, )]
+    cursor.fetchall.return_value = [INDEX]
+
+    with mock.patch('removalist.indexes.instrumentation'):
+        assert indexes.restore_indexes(connection, NewModel) == 1
+
+    statements = get_statements(cursor)
+    assert statements[-2].startswith('DELETE FROM removalist_deferred_object')
+    assert statements[-1] == 'ANALYZE testapp_newmodel;'
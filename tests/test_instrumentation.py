@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from removalist import instrumentation
+from removalist.signals import duplication_event
+
+hook = mock.Mock()
+
+
+def test_emit_sends_signal_and_calls_hooks():
+    receiver = mock.Mock()
+    duplication_event.connect(receiver)
+    hook.reset_mock()
+
+    try:
+        with override_settings(REMOVALIST_METRICS_HOOKS=[
+                'tests.test_instrumentation.hook']):
+            instrumentation.emit('backfill_progress', rows_copied=10)
+    finally:
+        duplication_event.disconnect(receiver)
+
+    receiver.assert_called_once_with(signal=duplication_event,
+                                     sender=None,
+                                     event='backfill_progress',
+                                     rows_copied=10)
+    hook.assert_called_once_with('backfill_progress', rows_copied=10)
+
+
+def test_failing_hook_does_not_interrupt_emit():
+    hook.reset_mock()
+    hook.side_effect = ValueError('metrics backend down')
+
+    try:
+        with override_settings(REMOVALIST_METRICS_HOOKS=[
+                'tests.test_instrumentation.hook']):
+            instrumentation.emit('backfill_progress', rows_copied=10)
+    finally:
+        hook.side_effect = None
+
+    assert hook.call_count == 1
+
+
+def test_eta_is_based_on_current_rate():
+    assert instrumentation.get_eta(100, 1000, 10) == 90.0
+    assert instrumentation.get_eta(1000, 900, 10) == 0.0
+    assert instrumentation.get_eta(0, 1000, 10) is None
+    assert instrumentation.get_eta(100, None, 10) is None
+
+
+def test_estimated_row_count_from_reltuples():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+
+    cursor.fetchone.return_value = (1234,)
+    assert instrumentation.get_estimated_row_count(connection,
+                                                   mock.Mock()) == 1234
+
+    cursor.fetchone.return_value = (-1,)
+    assert instrumentation.get_estimated_row_count(connection,
+                                                   mock.Mock()) is None
+
+
+def test_execute_timed_emits_statement_duration():
+    schema_editor = mock.Mock()
+
+    with mock.patch('removalist.instrumentation.emit') as emit:
+        duration = instrumentation.execute_timed(
+            schema_editor, 'SELECT 1;', 'select_one', old_table='old')
+
+    schema_editor.execute.assert_called_once_with('SELECT 1;')
+    emit.assert_called_once_with('statement_executed',
+                                 statement='select_one',
+                                 duration=round(duration, 6),
+                                 old_table='old')
@@ -0,0 +1,111 @@
+from unittest import mock
+
+import pytest
+from django.db import OperationalError
+from django.db.transaction import TransactionManagementError
+from django.test import override_settings
+
+from removalist import locking
+
+
+class DriverError(Exception):
+    pgcode = locking.LOCK_NOT_AVAILABLE
+
+
+def get_lock_timeout():
+    exc = OperationalError('canceling statement due to lock timeout')
+    exc.__cause__ = DriverError()
+    return exc
+
+
+def test_lock_timeout_is_detected_from_error_code():
+    assert locking.is_lock_timeout(get_lock_timeout())
+    assert not locking.is_lock_timeout(OperationalError('deadlock'))
+
+
+@mock.patch('removalist.locking.time.sleep')
+def test_transaction_is_retried_after_lock_timeout(sleep):
+    execute = mock.Mock()
+    transaction = mock.Mock(side_effect=[get_lock_timeout(), 'done'])
+
+    retry = locking.LockRetry(lock_timeout=0.5, min_delay=1.0)
+
+    assert retry.run(execute, transaction, step='create_triggers') == 'done'
+    assert execute.call_args_list == [
+        mock.call('BEGIN;'), mock.call("SET LOCAL lock_timeout = '500ms';"),
+        mock.call('ROLLBACK;'),
+        mock.call('BEGIN;'), mock.call("SET LOCAL lock_timeout = '500ms';"),
+        mock.call('COMMIT;')]
+    assert 0.5 <= sleep.call_args[0][0] <= 1.0
+
+
+@mock.patch('removalist.locking.time.sleep')
+def test_lock_timeout_is_raised_after_last_attempt(sleep):
+    execute = mock.Mock()
+    transaction = mock.Mock(side_effect=get_lock_timeout())
+
+    with pytest.raises(OperationalError):
+        locking.LockRetry(max_attempts=3).run(execute, transaction)
+
+    assert transaction.call_count == 3
+    assert sleep.call_count == 2
+    assert execute.call_args_list[-1] == mock.call('ROLLBACK;')
+
+
+def test_other_errors_are_not_retried():
+    execute = mock.Mock()
+    transaction = mock.Mock(side_effect=OperationalError('deadlock'))
+
+    with pytest.raises(OperationalError):
+        locking.LockRetry().run(execute, transaction)
+
+    assert transaction.call_count == 1
+    assert execute.call_args_list[-1] == mock.call('ROLLBACK;')
+
+
+def test_lock_retry_is_refused_in_atomic_block():
+    execute = mock.Mock()
+    connection = mock.Mock(in_atomic_block=True)
+
+    with pytest.raises(TransactionManagementError):
+        locking.run_transaction(execute, mock.Mock(), True,
+                                connection=connection)
+
+    assert execute.call_count == 0
+
+
+def test_delay_grows_up_to_max_delay():
+    retry = locking.LockRetry(min_delay=1.0, max_delay=4.0)
+
+    assert 2.0 <= retry.get_delay(3) <= 4.0
+    assert 2.0 <= retry.get_delay(10) <= 4.0
+
+
+def test_lock_retry_options():
+    assert locking.get_lock_retry() is None
+    assert locking.get_lock_retry(True).max_attempts == \
+        locking.DEFAULT_MAX_ATTEMPTS
+    assert locking.get_lock_retry({'max_attempts': 3}).max_attempts == 3
+
+    with override_settings(REMOVALIST_LOCK_RETRY={'lock_timeout': 1.0}):
+        assert locking.get_lock_retry().lock_timeout == 1.0
+
+
+def test_transaction_without_lock_retry():
+    execute = mock.Mock()
+
+    locking.run_transaction(execute, mock.Mock(), begin='BEGIN;')
+
+    assert execute.call_args_list == [mock.call('BEGIN;'),
+                                      mock.call('COMMIT;')]
+
+
+def test_transaction_without_lock_retry_is_rolled_back_on_error():
+    execute = mock.Mock()
+    transaction = mock.Mock(side_effect=OperationalError('deadlock'))
+
+    with pytest.raises(OperationalError):
+        locking.run_transaction(execute, transaction)
+
+    assert execute.call_args_list == [mock.call('BEGIN;'),
+                                      mock.call('ROLLBACK;')]
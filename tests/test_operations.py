@@ -1,7 +1,64 @@
 from unittest import mock
 
+import pytest
+
+from django.db import models
+from django.db.migrations.state import ModelState, ProjectState
+
+from removalist import checkpoint
+from removalist.foreign_keys import TriggerSyncRequired
 from removalist.operations import (CreateTableDuplication,
-                                   ReleaseTableDuplication)
+                                   CutoverTableDuplication,
+                                   ReleaseTableDuplication,
+                                   RetargetForeignKeys, SQLNotCollectable,
+                                   get_related_model_keys, render_models)
+
+
+class RenderedModel(object):
+    """
+    Compare equal to the model with the *label*, e.g. ``'app.Model'``, of
+    any rendering of the migration state.
+    """
+
+    def __init__(self, label):
+        self.label = label
+
+    def __eq__(self, other):
+        return getattr(getattr(other, '_meta', None), 'label',
+                       None) == self.label
+
+    def __repr__(self):
+        return '<RenderedModel: {}>'.format(self.label)
+
+
+OLD_MODEL = RenderedModel('testapp.OldModel')
+NEW_MODEL = RenderedModel('testapp.NewModel')
+
+
+def get_project_state():
+    state = ProjectState(real_apps=['auth', 'contenttypes'])
+    for name in ('OldModel', 'NewModel'):
+        state.add_model(ModelState('testapp', name, [
+            ('id', models.AutoField(primary_key=True)),
+            ('group', models.ForeignKey('auth.Group')),
+            ('parent', models.ForeignKey('testapp.Parent')),
+        ]))
+    state.add_model(ModelState('testapp', 'Parent', [
+        ('id', models.AutoField(primary_key=True)),
+        ('tags', models.ManyToManyField('Tag')),
+    ]))
+    state.add_model(ModelState('testapp', 'Tag', [
+        ('id', models.AutoField(primary_key=True)),
+    ]))
+    for name in ('OldUser', 'NewUser', 'OldGroup', 'NewGroup'):
+        state.add_model(ModelState('testapp', name, [
+            ('id', models.AutoField(primary_key=True)),
+        ]))
+    state.add_model(ModelState('otherapp', 'Unrelated', [
+        ('id', models.AutoField(primary_key=True)),
+        ('old', models.ForeignKey('testapp.OldModel')),
+    ]))
+    return state
 
 
 def test_create_table_duplicate_initalization():
@@ -17,34 +74,164 @@ def test_create_table_duplicate_initalization():
 
 
 def test_create_table_duplicate_forward_migration():
-    state = mock.Mock()
-    schema_editor = mock.Mock()
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
 
     op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel')
 
     with mock.patch('removalist.operations.builder') as builder:
         op.database_forwards('testapp', schema_editor, state, mock.Mock())
 
-        assert state.apps.get_model.call_count == 2
+        builder.copy_model_data.assert_called_once_with(OLD_MODEL, NEW_MODEL)
+        assert builder.create_insert_trigger.call_count == 1
+        assert builder.create_update_trigger.call_count == 1
+        assert builder.create_delete_trigger.call_count == 1
 
-        assert builder.copy_model_data.call_count == 1
+
+def test_create_table_duplicate_batched_forward_migration():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                batch_size=500)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 0
         assert builder.create_insert_trigger.call_count == 1
         assert builder.create_update_trigger.call_count == 1
         assert builder.create_delete_trigger.call_count == 1
+        backfill.copy_model_pairs.assert_called_once_with(
+            schema_editor.connection,
+            [(OLD_MODEL, NEW_MODEL)],
+            500,
+            keep_existing=False,
+            workers=None,
+            resumable=False,
+            throttle_options=None,
+            mapping=None)
+
+
+def test_batched_create_table_duplicate_refuses_to_collect_sql():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=True)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                batch_size=500)
+
+    with mock.patch('removalist.operations.builder'), \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.checkpoint') as checkpoint:
+        with pytest.raises(SQLNotCollectable):
+            op.database_forwards('testapp', schema_editor, state,
+                                 mock.Mock())
+
+        assert schema_editor.execute.call_count == 0
+        assert backfill.copy_model_pairs.call_count == 0
+        assert checkpoint.create_checkpoint_table.call_count == 0
+
+
+def test_create_table_duplicate_collects_sql():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=True)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel')
+
+    with mock.patch('removalist.operations.builder') as builder:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 1
+        assert schema_editor.connection.cursor.call_count == 0
+
+
+def test_create_table_duplicate_online_forward_migration():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                online=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 0
+        builder.create_insert_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, upsert=True, statement_level=False)
+        builder.create_update_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, upsert=True, statement_level=False,
+            changed_columns_only=False)
+
+        backfill.copy_model_pairs.assert_called_once_with(
+            schema_editor.connection,
+            [(OLD_MODEL, NEW_MODEL)],
+            backfill.DEFAULT_BATCH_SIZE,
+            keep_existing=True,
+            workers=None,
+            resumable=False,
+            throttle_options=None,
+            mapping=None)
+
+        executed = [c[0][0] for c in schema_editor.execute.call_args_list]
+        assert not [s for s in executed if 'LOCK TABLE' in str(s)]
+
+
+def test_create_table_duplicate_parallel_forward_migration():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                workers=4)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 0
+        backfill.copy_model_pairs.assert_called_once_with(
+            schema_editor.connection,
+            [(OLD_MODEL, NEW_MODEL)],
+            backfill.DEFAULT_BATCH_SIZE,
+            keep_existing=False,
+            workers=4,
+            resumable=False,
+            throttle_options=None,
+            mapping=None)
+
+
+def test_create_table_duplicate_with_statement_triggers():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                statement_triggers=True)
+
+    with mock.patch('removalist.operations.builder') as builder:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 1
+        builder.create_insert_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, upsert=False, statement_level=True)
+        builder.create_update_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, upsert=False, statement_level=True,
+            changed_columns_only=False)
+        builder.create_delete_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, statement_level=True)
 
 
 def test_create_table_duplicate_backward_migration():
-    state = mock.Mock()
-    schema_editor = mock.Mock()
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
 
     op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel')
 
     with mock.patch('removalist.operations.builder') as builder:
         op.database_backwards('testapp', schema_editor, state, mock.Mock())
 
-        assert state.apps.get_model.call_count == 2
-
-        assert builder.drop_insert_trigger.call_count == 1
+        builder.drop_insert_trigger.assert_called_once_with(OLD_MODEL,
+                                                           NEW_MODEL)
         assert builder.drop_update_trigger.call_count == 1
         assert builder.drop_delete_trigger.call_count == 1
 
@@ -61,34 +248,510 @@ def test_release_table_duplicate_initalization():
                              "testapp.OldModel -> testapp.NewModel")
 
 
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
 def test_release_table_duplicate_forward_migration():
-    state = mock.Mock()
-    schema_editor = mock.Mock()
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
 
     op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel')
 
     with mock.patch('removalist.operations.builder') as builder:
         op.database_forwards('testapp', schema_editor, state, mock.Mock())
 
-        assert state.apps.get_model.call_count == 2
-
-        assert builder.drop_insert_trigger.call_count == 1
+        builder.drop_insert_trigger.assert_called_once_with(OLD_MODEL,
+                                                           NEW_MODEL)
         assert builder.drop_update_trigger.call_count == 1
         assert builder.drop_delete_trigger.call_count == 1
 
 
 def test_release_table_duplicate_backward_migration():
-    state = mock.Mock()
-    schema_editor = mock.Mock()
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
 
     op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel')
 
     with mock.patch('removalist.operations.builder') as builder:
         op.database_backwards('testapp', schema_editor, state, mock.Mock())
 
-        assert state.apps.get_model.call_count == 2
-
-        assert builder.copy_model_data.call_count == 1
+        builder.copy_model_data.assert_called_once_with(OLD_MODEL, NEW_MODEL)
         assert builder.create_insert_trigger.call_count == 1
         assert builder.create_update_trigger.call_count == 1
         assert builder.create_delete_trigger.call_count == 1
+
+
+def test_create_table_duplicate_with_pairs():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication(pairs=[
+        ('testapp.OldUser', 'testapp.NewUser'),
+        ('testapp.OldGroup', 'testapp.NewGroup')], batch_size=500)
+
+    assert op.describe() == (
+        "Create triggers for transitional model renaming: "
+        "testapp.OldUser -> testapp.NewUser, "
+        "testapp.OldGroup -> testapp.NewGroup")
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill:
+        backfill.get_backfill_levels.side_effect = lambda pairs: [pairs]
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.create_insert_trigger.call_count == 2
+        assert builder.create_update_trigger.call_count == 2
+        assert builder.create_delete_trigger.call_count == 2
+
+        backfill.copy_model_pairs.assert_called_once_with(
+            schema_editor.connection,
+            [(RenderedModel('testapp.OldUser'),
+              RenderedModel('testapp.NewUser')),
+             (RenderedModel('testapp.OldGroup'),
+              RenderedModel('testapp.NewGroup'))],
+            500,
+            keep_existing=False,
+            workers=None,
+            resumable=False,
+            throttle_options=None,
+            mapping=None)
+
+        executed = [c[0][0] for c in schema_editor.execute.call_args_list]
+        assert executed.count('BEGIN;') == 1
+        assert executed.count('COMMIT;') == 1
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_release_table_duplicate_with_pairs():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication(pairs=[
+        ('testapp.OldUser', 'testapp.NewUser'),
+        ('testapp.OldGroup', 'testapp.NewGroup')])
+
+    with mock.patch('removalist.operations.builder') as builder:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.drop_insert_trigger.call_args_list == [
+            mock.call(RenderedModel('testapp.OldUser'),
+                      RenderedModel('testapp.NewUser')),
+            mock.call(RenderedModel('testapp.OldGroup'),
+                      RenderedModel('testapp.NewGroup'))]
+        assert builder.drop_update_trigger.call_count == 2
+        assert builder.drop_delete_trigger.call_count == 2
+
+
+def test_table_duplicate_requires_model_names_or_pairs():
+    with pytest.raises(ValueError):
+        CreateTableDuplication('testapp.OldModel')
+
+    with pytest.raises(ValueError):
+        ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                pairs=[('testapp.OldUser', 'testapp.NewUser')])
+
+
+def test_resumable_create_table_duplicate_keeps_started_triggers():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                resumable=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.checkpoint') as checkpoint:
+        checkpoint.get_checkpoint.return_value = mock.Mock()
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.create_insert_trigger.call_count == 0
+        assert checkpoint.start_checkpoint.call_count == 0
+        backfill.copy_model_pairs.assert_called_once_with(
+            schema_editor.connection,
+            [(OLD_MODEL, NEW_MODEL)],
+            backfill.DEFAULT_BATCH_SIZE,
+            keep_existing=False,
+            workers=None,
+            resumable=True,
+            throttle_options=None,
+            mapping=None)
+
+
+def test_resumable_create_table_duplicate_starts_checkpoint():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                resumable=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill'), \
+            mock.patch('removalist.operations.checkpoint') as checkpoint:
+        checkpoint.get_checkpoint.return_value = None
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.create_insert_trigger.call_count == 1
+        checkpoint.start_checkpoint.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL)
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_release_table_duplicate_tracking_changes():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                 track_changes=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.changelog') as changelog:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.drop_insert_trigger.call_count == 1
+        changelog.create_changelog.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL)
+
+
+def test_release_table_duplicate_backward_migration_resyncs_changes():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                 track_changes=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.changelog') as changelog:
+        changelog.changelog_exists.return_value = True
+
+        op.database_backwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.copy_model_data.call_count == 0
+        builder.create_insert_trigger.assert_called_once_with(
+            OLD_MODEL, NEW_MODEL, upsert=True, statement_level=False)
+        builder.drop_changelog_trigger.assert_any_call(OLD_MODEL, NEW_MODEL,
+                                                       keep_table=True)
+        changelog.apply_changelog.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL,
+            changelog.DEFAULT_CHANGELOG_BATCH_SIZE, mapping=None)
+
+
+def test_create_table_duplicate_asynchronous_forward_migration():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                asynchronous=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.changelog') as changelog:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.create_insert_trigger.call_count == 0
+        changelog.create_changelog.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL)
+        assert backfill.copy_model_pairs.call_count == 1
+        changelog.apply_changelog.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL, mapping=None)
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_release_table_duplicate_asynchronous_forward_migration():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                 asynchronous=True, sync_timeout=60)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.changelog') as changelog:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        changelog.wait_until_caught_up.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL, timeout=60,
+            mapping=None)
+        changelog.finish_changelog_sync.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL, mapping=None)
+        builder.drop_changelog_trigger.assert_called_once_with(OLD_MODEL,
+                                                               NEW_MODEL)
+        assert builder.drop_insert_trigger.call_count == 0
+
+
+def test_create_table_duplicate_with_column_map():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                batch_size=500,
+                                column_map={'title': '{name}'},
+                                partition_columns=['created'])
+
+    with mock.patch('removalist.operations.builder.render_statement') \
+            as render_statement, \
+            mock.patch('removalist.operations.backfill') as backfill:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        mapping = {'column_map': {'title': '{name}'},
+                   'partition_columns': ['created']}
+
+        assert render_statement.call_count == 3
+        for call in render_statement.call_args_list:
+            assert call[1]['column_map'] == mapping['column_map']
+            assert call[1]['partition_columns'] == ['created']
+
+        assert backfill.copy_model_pairs.call_args[1]['mapping'] == mapping
+
+
+def test_column_map_requires_single_pair():
+    with pytest.raises(ValueError):
+        CreateTableDuplication(pairs=[('a.Old', 'a.New'), ('b.Old', 'b.New')],
+                               column_map={'title': '{name}'})
+
+    with pytest.raises(ValueError):
+        ReleaseTableDuplication(pairs=[('a.Old', 'a.New'),
+                                       ('b.Old', 'b.New')],
+                                partition_columns=['created'])
+
+
+def test_create_table_duplicate_deferring_indexes():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                defer_indexes=True)
+
+    with mock.patch('removalist.operations.builder'), \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.indexes') as indexes:
+        manager = mock.Mock()
+        manager.attach_mock(indexes.defer_indexes, 'defer_indexes')
+        manager.attach_mock(backfill.copy_model_pairs, 'copy_model_pairs')
+        manager.attach_mock(indexes.restore_indexes, 'restore_indexes')
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert [c[0] for c in manager.mock_calls] == [
+            'defer_indexes', 'copy_model_pairs', 'restore_indexes']
+        indexes.restore_indexes.assert_called_once_with(
+            schema_editor.connection, NEW_MODEL, lock_retry=None)
+        assert backfill.copy_model_pairs.call_args[0][2] == \
+            backfill.DEFAULT_BATCH_SIZE
+
+
+def test_create_table_duplicate_deferring_backfill():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                defer_backfill=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.checkpoint') as checkpoint:
+        checkpoint.get_checkpoint.return_value = None
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert builder.create_insert_trigger.call_count == 1
+        checkpoint.start_checkpoint.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL)
+        assert backfill.copy_model_pairs.call_count == 0
+
+
+def test_release_table_duplicate_refuses_unfinished_backfill():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel')
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.checkpoint.get_checkpoint') as \
+            get_checkpoint:
+        get_checkpoint.return_value = checkpoint.Checkpoint(40, 40, False)
+
+        with pytest.raises(checkpoint.BackfillNotFinished):
+            op.database_forwards('testapp', schema_editor, state,
+                                 mock.Mock())
+
+        assert builder.drop_insert_trigger.call_count == 0
+        assert schema_editor.execute.call_count == 0
+
+
+def test_create_table_duplicate_with_lock_retry():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+    schema_editor.connection.in_atomic_block = False
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                lock_retry={'lock_timeout': 0.2})
+
+    with mock.patch('removalist.operations.builder'):
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        executed = [c[0][0] for c in schema_editor.execute.call_args_list]
+        assert executed[:2] == ['BEGIN ISOLATION LEVEL REPEATABLE READ;',
+                                "SET LOCAL lock_timeout = '200ms';"]
+        assert executed[-1] == 'COMMIT;'
+
+
+def test_create_table_duplicate_with_logical_decoding():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = CreateTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                logical_decoding=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.backfill') as backfill, \
+            mock.patch('removalist.operations.decoding') as decoding:
+        manager = mock.Mock()
+        manager.attach_mock(decoding.create_slot, 'create_slot')
+        manager.attach_mock(backfill.copy_model_pairs, 'copy_model_pairs')
+        manager.attach_mock(decoding.apply_decoded_changes,
+                            'apply_decoded_changes')
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert [c[0] for c in manager.mock_calls] == [
+            'create_slot', 'copy_model_pairs', 'apply_decoded_changes']
+        assert builder.create_insert_trigger.call_count == 0
+        assert backfill.copy_model_pairs.call_args[1]['keep_existing'] is False
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_release_table_duplicate_with_logical_decoding():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = ReleaseTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                 logical_decoding=True, sync_timeout=30)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.decoding') as decoding:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        decoding.wait_until_caught_up.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL, timeout=30,
+            mapping=None)
+        decoding.finish_decoding_sync.assert_called_once_with(
+            schema_editor, OLD_MODEL, NEW_MODEL, mapping=None)
+        decoding.drop_slot.assert_called_once_with(schema_editor.connection,
+                                                   OLD_MODEL, NEW_MODEL)
+        assert builder.drop_insert_trigger.call_count == 0
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_cutover_table_duplication():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+    schema_editor.connection.in_atomic_block = False
+
+    op = CutoverTableDuplication('testapp.OldModel', 'testapp.NewModel',
+                                 prewarm=True)
+
+    with mock.patch('removalist.operations.builder') as builder, \
+            mock.patch('removalist.operations.cutover') as cutover:
+        manager = mock.Mock()
+        manager.attach_mock(cutover.prewarm, 'prewarm')
+        manager.attach_mock(cutover.lock_tables, 'lock_tables')
+        manager.attach_mock(builder.drop_trigger, 'drop_trigger')
+        manager.attach_mock(cutover.swap_tables, 'swap_tables')
+
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+        assert [c[0] for c in manager.mock_calls] == [
+            'prewarm', 'lock_tables', 'drop_trigger', 'drop_trigger',
+            'drop_trigger', 'swap_tables']
+        cutover.swap_tables.assert_called_once_with(schema_editor, OLD_MODEL,
+                                                    NEW_MODEL, 'view')
+
+        executed = [c[0][0] for c in schema_editor.execute.call_args_list]
+        assert executed[1].startswith('SET LOCAL lock_timeout')
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_cutover_in_atomic_block_is_not_retried_by_default():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+    schema_editor.connection.in_atomic_block = True
+
+    op = CutoverTableDuplication('testapp.OldModel', 'testapp.NewModel')
+
+    with mock.patch('removalist.operations.builder'), \
+            mock.patch('removalist.operations.cutover'):
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+
+    executed = [c[0][0] for c in schema_editor.execute.call_args_list]
+    assert not [statement for statement in executed
+                if isinstance(statement, str) and
+                statement.startswith('SET LOCAL lock_timeout')]
+
+
+def test_cutover_table_duplication_options():
+    with pytest.raises(ValueError):
+        CutoverTableDuplication('a.Old', 'a.New', swap='synonym')
+
+    with pytest.raises(ValueError):
+        CutoverTableDuplication('a.Old', 'a.New',
+                                column_map={'title': '{name}'})
+
+    assert not CutoverTableDuplication('a.Old', 'a.New').reversible
+
+
+def test_related_models_of_duplicated_models():
+    state = get_project_state()
+
+    assert get_related_model_keys(state, [('testapp', 'oldmodel')]) == {
+        ('testapp', 'oldmodel'), ('testapp', 'parent'), ('testapp', 'tag')}
+
+
+def test_only_duplicated_models_are_rendered():
+    state = get_project_state()
+
+    apps = render_models(state, ['testapp.OldModel',
+                                'testapp.NewModel'])
+
+    assert apps.get_model('testapp.OldModel')._meta.get_field(
+        'parent').related_model is apps.get_model('testapp.Parent')
+    with pytest.raises(LookupError):
+        apps.get_model('otherapp.Unrelated')
+    assert 'apps' not in vars(state)
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_retarget_foreign_keys():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = RetargetForeignKeys('testapp.OldModel', 'testapp.NewModel')
+
+    with mock.patch('removalist.operations.foreign_keys') as foreign_keys:
+        op.database_forwards('testapp', schema_editor, state, mock.Mock())
+        op.database_backwards('testapp', schema_editor, state, mock.Mock())
+
+        foreign_keys.check_trigger_sync.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL)
+        foreign_keys.retarget_foreign_keys.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL, lock_retry=None)
+        foreign_keys.restore_foreign_keys.assert_called_once_with(
+            schema_editor.connection, OLD_MODEL, NEW_MODEL, lock_retry=None)
+
+
+@mock.patch('removalist.checkpoint.check_backfill_finished', mock.Mock())
+def test_retarget_foreign_keys_requires_trigger_sync():
+    state = get_project_state()
+    schema_editor = mock.Mock(collect_sql=False)
+
+    op = RetargetForeignKeys(pairs=[('testapp.OldUser', 'testapp.NewUser'),
+                                    ('testapp.OldModel', 'testapp.NewModel')])
+
+    with mock.patch('removalist.foreign_keys.check_trigger_sync',
+                    side_effect=[None, TriggerSyncRequired()]), \
+            mock.patch('removalist.foreign_keys.retarget_foreign_keys') as \
+            retarget_foreign_keys:
+        with pytest.raises(TriggerSyncRequired):
+            op.database_forwards('testapp', schema_editor, state,
+                                 mock.Mock())
+
+        assert retarget_foreign_keys.call_count == 0
@@ -0,0 +1,72 @@
+from unittest import mock
+
+from removalist import planner
+
+from .test_builder import NewModel, OldModel
+
+
+def test_sample_ranges_are_spread_over_the_table():
+    assert planner.get_sample_ranges(1, 1000, 10, 3) == [
+        (1, 11), (334, 344), (667, 677)]
+
+
+def test_sample_ranges_of_small_table():
+    assert planner.get_sample_ranges(1, 15, 10, 3) == [(1, 11), (11, 21)]
+    assert planner.get_sample_ranges(1, 15, 10, 0) == []
+
+
+def test_sampled_copy_is_rolled_back():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.rowcount = 10
+
+    rows, durations = planner.sample_copy(connection, 'COPY', [(1, 11),
+                                                               (11, 21)])
+
+    assert rows == 20
+    assert len(durations) == 2
+    assert cursor.execute.call_args_list == [
+        mock.call('BEGIN;'), mock.call('COPY', [1, 11]),
+        mock.call('ROLLBACK;'),
+        mock.call('BEGIN;'), mock.call('COPY', [11, 21]),
+        mock.call('ROLLBACK;')]
+
+
+def test_locked_copy_holds_exclusive_lock_for_whole_copy():
+    locks = planner.get_lock_estimates('old', 'new', None, 12.5, None)
+
+    assert locks[0] == planner.LockEstimate('copy', 'old', 'EXCLUSIVE', 12.5)
+
+
+def test_batched_copy_only_locks_rows_per_batch():
+    locks = planner.get_lock_estimates('old', 'new', 1000, 12.5, 0.2,
+                                       online=True)
+
+    assert [lock.mode for lock in locks if lock.phase == 'copy_batch'] == [
+        'ROW SHARE (FOR KEY SHARE on copied rows)', 'ROW EXCLUSIVE']
+    assert all(lock.duration in (None, 0.2) for lock in locks)
+
+
+@mock.patch('removalist.planner.get_longest_transaction_age',
+            mock.Mock(return_value=3.0))
+@mock.patch('removalist.planner.explain', mock.Mock(return_value='Seq Scan'))
+@mock.patch('removalist.planner.backfill.get_pk_bounds',
+            mock.Mock(return_value=(1, 1000)))
+@mock.patch('removalist.planner.get_table_stats')
+@mock.patch('removalist.planner.sample_copy')
+def test_plan_estimates_copy_from_sample(sample_copy, get_table_stats):
+    get_table_stats.return_value = {'estimated_rows': 500, 'table_size': 0,
+                                    'total_size': 0, 'indexes': 1}
+    sample_copy.return_value = (50, [0.5, 0.5])
+
+    plan = planner.plan_model_pair(mock.Mock(), OldModel, NewModel,
+                                   batch_size=100, samples=2)
+
+    assert plan['explain'] == 'Seq Scan'
+    assert plan['sample'] == {'ranges': 2, 'rows': 50, 'duration': 1.0}
+    assert plan['batches'] == 10
+    assert plan['estimated_copy_duration'] == 10.0
+    assert plan['estimated_batch_duration'] == 0.5
+    assert plan['estimated_lock_wait'] == 3.0
+    assert len(plan['statements']['create_triggers']) == 3
+    assert plan['locks'][1]['duration'] == 0.5
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from removalist import throttle
+
+from .test_builder import NewModel, OldModel
+
+
+def make_throttle(**options):
+    options.setdefault('check_interval', 0)
+    return throttle.Throttle(OldModel, NewModel, 1000, **options)
+
+
+def test_batch_size_follows_target_duration():
+    backfill_throttle = make_throttle(target_duration=1.0,
+                                      max_replication_lag=None,
+                                      max_lock_waits=None)
+
+    assert backfill_throttle.update(mock.Mock(), 0.5) == 0
+    assert backfill_throttle.batch_size == 2000
+
+    backfill_throttle.update(mock.Mock(), 4.0)
+    assert backfill_throttle.batch_size == 500
+
+
+def test_batch_size_stays_within_ceilings():
+    backfill_throttle = make_throttle(min_batch_size=100, max_batch_size=1500,
+                                      max_replication_lag=None,
+                                      max_lock_waits=None)
+
+    backfill_throttle.update(mock.Mock(), 0.001)
+    assert backfill_throttle.batch_size == 1500
+
+    backfill_throttle.update(mock.Mock(), 1000)
+    assert backfill_throttle.batch_size == 100
+
+
+def test_backs_off_while_replication_lags():
+    backfill_throttle = make_throttle(max_sleep=0.3, max_replication_lag=5)
+
+    with mock.patch('removalist.throttle.get_replication_lag') as get_lag, \
+            mock.patch('removalist.throttle.get_lock_waits') as get_waits, \
+            mock.patch('removalist.throttle.instrumentation') as instrument:
+        get_lag.return_value = 12.0
+        get_waits.return_value = 0
+
+        sleeps = [backfill_throttle.update(mock.Mock(), 0.5)
+                  for _ in range(3)]
+
+        assert sleeps == [0.1, 0.2, 0.3]
+        assert backfill_throttle.batch_size == 125
+        assert instrument.emit.call_args[1]['reason'] == 'replication_lag'
+
+        get_lag.return_value = 0
+        assert backfill_throttle.update(mock.Mock(), 0.5) == 0.15
+
+
+def test_backs_off_while_sessions_wait_for_locks():
+    backfill_throttle = make_throttle(max_replication_lag=None)
+
+    with mock.patch('removalist.throttle.get_lock_waits') as get_waits, \
+            mock.patch('removalist.throttle.instrumentation') as instrument:
+        get_waits.return_value = 2
+
+        assert backfill_throttle.update(mock.Mock(), 0.5) == 0.1
+
+    get_waits.assert_called_once_with(
+        mock.ANY, ('testapp_oldmodel', 'testapp_newmodel'))
+    assert instrument.emit.call_args[1]['reason'] == 'lock_waits'
+
+
+def test_keeps_backing_off_until_next_check():
+    backfill_throttle = make_throttle(check_interval=60,
+                                      max_replication_lag=None)
+
+    with mock.patch('removalist.throttle.get_lock_waits') as get_waits, \
+            mock.patch('removalist.throttle.instrumentation'):
+        get_waits.return_value = 2
+
+        assert backfill_throttle.update(mock.Mock(), 0.5) == 0.1
+        assert backfill_throttle.update(mock.Mock(), 0.01) == 0.1
+
+    assert get_waits.call_count == 1
+    assert backfill_throttle.batch_size == 500
+
+
+def test_throttle_options():
+    assert throttle.get_throttle(OldModel, NewModel, 10, None) is None
+
+    backfill_throttle = throttle.get_throttle(OldModel, NewModel, 10,
+                                              {'max_sleep': 5})
+    assert backfill_throttle.max_sleep == 5
+    assert backfill_throttle.batch_size == 10
@@ -0,0 +1,117 @@
+from unittest import mock
+
+import pytest
+
+from removalist import transfer
+
+from .test_builder import NewModel, OldModel
+
+
+class FakeSourceCursor(object):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def copy_expert(self, statement, stream):
+        for chunk in self.chunks:
+            stream.write(chunk)
+
+
+class FakeTargetCursor(object):
+    rowcount = 3
+
+    def __init__(self, read_size=5):
+        self.read_size = read_size
+        self.data = b''
+
+    def copy_expert(self, statement, stream):
+        while True:
+            data = stream.read(self.read_size)
+            if not data:
+                break
+            self.data += data
+
+
+def test_copy_buffer_returns_data_in_requested_sizes():
+    buffer = transfer.CopyBuffer(max_chunks=10)
+    buffer.write(b'abc')
+    buffer.write(b'defgh')
+    buffer.close()
+
+    assert buffer.read(4) == b'abcd'
+    assert buffer.read(4) == b'efgh'
+    assert buffer.read(4) == b''
+
+
+def test_copy_buffer_refuses_writes_after_abort():
+    buffer = transfer.CopyBuffer(max_chunks=1)
+    buffer.write(b'abc')
+    buffer.abort()
+
+    with pytest.raises(IOError):
+        buffer.write(b'def')
+
+
+def test_stream_copy_moves_all_data_through_bounded_buffer():
+    chunks = [bytes([n]) * 7 for n in range(50)]
+    target_cursor = FakeTargetCursor()
+
+    rows = transfer.stream_copy(FakeSourceCursor(chunks), 'COPY out',
+                                target_cursor, 'COPY in', max_chunks=2)
+
+    assert rows == 3
+    assert target_cursor.data == b''.join(chunks)
+
+
+def test_stream_copy_raises_errors_from_the_source():
+    source_cursor = mock.Mock()
+    source_cursor.copy_expert.side_effect = ValueError('broken')
+
+    with pytest.raises(ValueError):
+        transfer.stream_copy(source_cursor, 'COPY out',
+                             FakeTargetCursor(), 'COPY in')
+
+
+def test_copy_statements():
+    copy_out, copy_in = transfer.get_copy_statements(OldModel, NewModel,
+                                                     'id = ANY(%s)')
+
+    assert copy_out == ('COPY (SELECT id, text, number, group_id '
+                        'FROM testapp_oldmodel WHERE id = ANY(%s)) '
+                        'TO STDOUT (FORMAT binary);')
+    assert copy_in == ('COPY testapp_newmodel (id, text, number, group_id) '
+                       'FROM STDIN (FORMAT binary);')
+
+
+def test_apply_changelog_batch_transfers_each_changed_row_once():
+    source = mock.MagicMock()
+    source_cursor = source.cursor.return_value.__enter__.return_value
+    source_cursor.fetchall.return_value = [(1, 7), (2, 3), (3, 7)]
+    source_cursor.mogrify.return_value = b'id = ANY(ARRAY[3,7])'
+
+    target = mock.MagicMock()
+    target_cursor = target.cursor.return_value.__enter__.return_value
+
+    with mock.patch('removalist.transfer.stream_copy') as stream_copy:
+        applied = transfer.apply_changelog_batch(source, target,
+                                                 OldModel, NewModel)
+
+    assert applied == 3
+    assert stream_copy.call_count == 1
+    target_cursor.execute.assert_any_call(
+        'DELETE FROM testapp_newmodel WHERE id = ANY(%s);', [[3, 7]])
+    source_cursor.execute.assert_called_with(
+        'DELETE FROM testapp_oldmodel_to_testapp_newmodel_changelog '
+        'WHERE id = ANY(%s);',
+        [[1, 2, 3]])
+
+
+def test_catch_up_stops_once_changelog_is_drained():
+    with mock.patch('removalist.transfer.apply_changelog_batch') as apply:
+        apply.side_effect = [10, 10, 4]
+
+        applied = transfer.catch_up(mock.Mock(), mock.Mock(),
+                                    OldModel, NewModel, batch_size=10)
+
+    assert applied == 24
+    assert apply.call_count == 3
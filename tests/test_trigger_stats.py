@@ -0,0 +1,68 @@
+from unittest import mock
+
+from removalist import trigger_stats
+
+
+def test_function_name_is_split_into_new_table_and_event():
+    assert trigger_stats.parse_function_name(
+        'app_old_to_model', 'app_old_to_model_to_app_new_update') == (
+            'app_new', 'update')
+    assert trigger_stats.parse_function_name(
+        'app_old', 'app_old_to_app_new_changelog') == ('app_new', 'changelog')
+
+
+def test_function_name_of_other_triggers_is_ignored():
+    assert trigger_stats.parse_function_name('app_old', 'audit_insert') is None
+    assert trigger_stats.parse_function_name(
+        'app_old', 'app_old_to_insert') is None
+    assert trigger_stats.parse_function_name(
+        'app_old', 'app_old_to_app_new_truncate') is None
+
+
+def test_trigger_costs_are_read_per_table_and_event():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [
+        ('app_old', 'app_old_to_app_new_insert', 4, 2.0, 1.5),
+        ('app_old', 'audit_insert', 1, 1.0, 1.0),
+    ]
+
+    assert trigger_stats.get_trigger_costs(connection) == [
+        trigger_stats.TriggerCost('app_old', 'app_new', 'insert',
+                                  'app_old_to_app_new_insert', 4, 2.0, 1.5)]
+
+
+def test_cost_difference_between_snapshots():
+    before = [trigger_stats.TriggerCost('old', 'new', 'insert',
+                                        'old_to_new_insert', 4, 2.0, 1.5)]
+    after = [
+        trigger_stats.TriggerCost('old', 'new', 'insert', 'old_to_new_insert',
+                                  10, 5.0, 3.0),
+        trigger_stats.TriggerCost('old', 'new', 'delete', 'old_to_new_delete',
+                                  1, 0.5, 0.5),
+    ]
+
+    assert trigger_stats.get_cost_difference(before, after) == [
+        after[0]._replace(calls=6, total_time=3.0, self_time=1.5), after[1]]
+
+
+def test_cost_data_includes_mean_time():
+    cost = trigger_stats.TriggerCost('old', 'new', 'update',
+                                     'old_to_new_update', 4, 2.0, 1.5)
+
+    assert trigger_stats.get_cost_data(cost)['mean_time'] == 0.5
+    assert trigger_stats.get_cost_data(
+        cost._replace(calls=0))['mean_time'] is None
+
+
+@mock.patch('removalist.instrumentation.emit')
+def test_trigger_costs_are_emitted(emit):
+    cost = trigger_stats.TriggerCost('old', 'new', 'update',
+                                     'old_to_new_update', 4, 2.0, 1.5)
+
+    trigger_stats.emit_trigger_costs([cost], interval=60)
+
+    emit.assert_called_once_with(
+        'trigger_cost', old_table='old', new_table='new', event='update',
+        function='old_to_new_update', calls=4, total_time=2.0,
+        self_time=1.5, mean_time=0.5, interval=60)
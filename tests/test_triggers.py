@@ -1,7 +1,12 @@
 import pytest
 
+from django.db import connection
+
+from removalist import decoding
+
 from .sample_app.factories import OldUserFactory
-from .sample_app.models import NewUser
+from .sample_app.models import NewUser, OldUser
+from .sample_app.triggers import drop_triggers, replace_triggers
 
 
 @pytest.mark.django_db()
@@ -39,3 +44,92 @@ def test_delete_trigger():
 
     new_user = NewUser.objects.all().first()
     assert new_user.id == old_user_2.id
+
+
+def get_row_version(model, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT ctid::text FROM {} WHERE id = %s'.format(
+                model._meta.db_table),
+            [pk])
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db()
+def test_update_trigger_skips_unchanged_rows():
+    old_user = OldUserFactory()
+    row_version = get_row_version(NewUser, old_user.id)
+
+    old_user.save()
+
+    assert get_row_version(NewUser, old_user.id) == row_version
+
+
+def forbid_column_writes(model, column):
+    """
+    Make any update of the table of *model* that assigns *column* fail, even
+    if the value stays the same.
+    """
+    table = model._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE FUNCTION {table}_forbid_{column}() RETURNS TRIGGER AS '
+            "$$ BEGIN RAISE EXCEPTION '{column} written'; END; $$ "
+            'LANGUAGE plpgsql;'.format(table=table, column=column))
+        cursor.execute(
+            'CREATE TRIGGER {table}_forbid_{column} BEFORE UPDATE OF {column} '
+            'ON {table} FOR EACH ROW '
+            'EXECUTE PROCEDURE {table}_forbid_{column}();'.format(
+                table=table, column=column))
+
+
+@pytest.mark.django_db()
+@pytest.mark.parametrize('upsert', (False, True))
+@pytest.mark.parametrize('statement_level', (False, True))
+def test_update_trigger_only_writes_changed_columns(upsert, statement_level):
+    replace_triggers(upsert=upsert, statement_level=statement_level,
+                     changed_columns_only=True)
+
+    try:
+        old_user = OldUserFactory()
+        forbid_column_writes(NewUser, 'number')
+
+        old_user.text = 'updated text'
+        old_user.save()
+
+        assert NewUser.objects.get(id=old_user.id).text == 'updated text'
+    finally:
+        replace_triggers()
+
+
+def get_wal_level():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW wal_level;')
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_logical_decoding_sync():
+    if get_wal_level() != 'logical':
+        pytest.skip('wal_level is not logical')
+
+    drop_triggers()
+    decoding.create_slot(connection, OldUser, NewUser)
+
+    try:
+        inserted, updated, deleted = [OldUserFactory() for _ in range(3)]
+        updated.text = 'updated text'
+        updated.save()
+        deleted.delete()
+
+        assert NewUser.objects.count() == 0
+
+        decoding.apply_decoded_changes(connection, OldUser, NewUser)
+
+        assert sorted(NewUser.objects.values_list('id', flat=True)) == sorted(
+            [inserted.id, updated.id])
+        assert NewUser.objects.get(id=updated.id).text == 'updated text'
+    finally:
+        decoding.drop_slot(connection, OldUser, NewUser)
+        replace_triggers()
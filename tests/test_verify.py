@@ -0,0 +1,119 @@
+import hashlib
+from unittest import mock
+
+from removalist import verify
+
+from .test_builder import NewModel, OldModel
+
+
+class FakeCursor(object):
+    """
+    Answer the checksum and row hash statements of a `RangeVerifier` from
+    in-memory tables mapping primary keys to row values.
+    """
+
+    def __init__(self, verifier, old_rows, new_rows):
+        self.tables = {
+            verifier.old_checksum_statement: ('checksum', old_rows),
+            verifier.new_checksum_statement: ('checksum', new_rows),
+            verifier.old_rows_statement: ('rows', old_rows),
+            verifier.new_rows_statement: ('rows', new_rows)}
+        self.executed = []
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement, params=None):
+        self.executed.append((statement, params))
+
+        if statement not in self.tables:
+            return
+
+        kind, rows = self.tables[statement]
+        start, end = params
+        hashes = [(pk, hashlib.md5(rows[pk].encode()).hexdigest())
+                  for pk in sorted(rows) if start <= pk < end]
+
+        if kind == 'rows':
+            self.result = hashes
+        else:
+            self.result = [(len(hashes), ''.join(h for _, h in hashes))]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_sub_ranges_cover_range():
+    assert list(verify.iter_sub_ranges(0, 25, splits=3)) == [
+        (0, 9), (9, 18), (18, 25)]
+    assert list(verify.iter_sub_ranges(5, 7, splits=10)) == [(5, 6), (6, 7)]
+
+
+def test_checksum_statement_hashes_rows_in_old_column_order():
+    verifier = verify.RangeVerifier(OldModel, NewModel)
+
+    assert verifier.new_checksum_statement == (
+        "SELECT count(*), md5(string_agg(md5(ROW(id, text, number, group_id)::text), '' "
+        "ORDER BY id)) FROM testapp_newmodel WHERE id >= %s AND id < %s;")
+
+
+def test_verifier_only_drills_into_mismatching_ranges():
+    verifier = verify.RangeVerifier(OldModel, NewModel, row_compare_size=10)
+
+    old_rows = {pk: 'row {}'.format(pk) for pk in range(1000)}
+    new_rows = dict(old_rows)
+    del new_rows[15]
+    new_rows[512] = 'changed'
+    new_rows[2000] = 'extra'
+
+    cursor = FakeCursor(verifier, old_rows, new_rows)
+    connection = mock.Mock()
+    connection.cursor.return_value = cursor
+
+    missing, extra, changed, mismatched = verifier.verify(connection, 0, 1000)
+
+    assert (missing, extra, changed) == ([15], [], [512])
+    assert mismatched == 5
+
+    row_queries = [params for statement, params in cursor.executed
+                   if statement == verifier.old_rows_statement]
+    assert row_queries == [[10, 20], [510, 520]]
+    assert cursor.executed[0][0].startswith('BEGIN ISOLATION LEVEL')
+    assert cursor.executed[-1][0] == 'COMMIT;'
+
+
+def test_verify_model_data_reports_differences():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = [(1, 100), (1, 120)]
+
+    with mock.patch('removalist.verify.RangeVerifier') as verifier_class:
+        verifier = verifier_class.return_value
+        verifier.verify.side_effect = lambda connection, start, end: (
+            ([], [110], [], 1) if start > 100 else ([], [], [], 0))
+
+        report = verify.verify_model_data(connection, OldModel, NewModel,
+                                          batch_size=50, workers=1)
+
+    assert report == verify.VerificationReport(
+        missing_pks=[], extra_pks=[110], changed_pks=[], ranges_checked=3,
+        mismatched_ranges=1)
+    assert not verify.is_consistent(report)
+
+
+def test_verify_model_data_of_empty_tables():
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (None, None)
+
+    report = verify.verify_model_data(connection, OldModel, NewModel)
+
+    assert report.ranges_checked == 0
+    assert verify.is_consistent(report)